@@ -1,11 +1,105 @@
 import google.generativeai as genai
 from detect_language import detect_script 
-from typing import Optional
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
 from PIL import Image
+import asyncio
 import base64
+import hashlib
+import httpx
 import io
+import json
 import openai
 import os
+import threading
+import time
+
+from cache import LocalCache
+from singleflight import SingleFlight
+from snapshot import JsonCodec
+from tokens import (
+    MAX_INPUT_TOKENS,
+    MAX_OUTPUT_TOKENS,
+    MAX_PERSONALITY_TOKENS,
+    truncate_to_tokens,
+)
+
+# Language instructions are built once at import so a preforked server shares them across workers.
+LANGUAGE_INSTRUCTIONS = {
+    "telugu_native": """**LANGUAGE INSTRUCTION:** The user typed in Telugu Script (తెలుగు). Reply in Telugu **Script (తెలుగు) ONLY**. Do not use Romanized language or other scripts.""",
+    "telugu_roman": """**LANGUAGE INSTRUCTION:** The user typed in Romanized Telugu (e.g., 'ela unnav'). Reply in Romanized Telugu **ONLY**. Do not use Telugu Script or other languages.""",
+    "hindi_native": """**LANGUAGE INSTRUCTION:** The user typed in Devanagari Script (Hindi). Reply in Devanagari Script (हिंदी) **ONLY**. Do not use Romanized language or other scripts.""",
+    "hindi_roman": """**LANGUAGE INSTRUCTION:** The user typed in Romanized Hindi (e.g., 'kya hal hai'). Reply in Romanized Hindi **ONLY**. Do not use Devanagari Script or other languages.""",
+    "english": """**LANGUAGE INSTRUCTION:** The user typed in English. Reply in English **only**. Do not use any other language, Romanized language (like Roman-Hindi or Roman-Telugu), or script.""",
+}
+DEFAULT_LANGUAGE_INSTRUCTION = """**LANGUAGE INSTRUCTION:** Analyze the user's input. Identify the dominant language and script (e.g., English, Roman-Hindi, Telugu Script) and reply **EXCLUSIVELY** in that language and script. If the input is primarily English, reply **ONLY** in English."""
+
+GEMINI_ERROR_REPLY = "Sorry, I encountered an API error while processing your request. Please try again."
+OPENAI_ERROR_REPLY = "Sorry, I encountered an error while processing your request with OpenAI."
+PROMPT_TEMPLATE = (
+    "You are an AI with the personality of a {personality}. "
+    "{lang_instruction} "
+    "Maintain your persona strictly. Be concise and helpful."
+)
+
+SUMMARY_MAX_WORDS = int(os.getenv("SUMMARY_MAX_WORDS", "200"))
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an AI companion. "
+    "Merge the previous summary with the new turns. Keep names, facts about the user, "
+    "preferences, open questions and the language the user writes in. "
+    f"Write at most {SUMMARY_MAX_WORDS} words of plain prose, no preamble."
+)
+
+# Provider transport. One pooled keep-alive client per worker process, created in the app
+# lifespan (after gunicorn forks) rather than at import.
+PROVIDER_CONNECT_TIMEOUT_SECONDS = float(os.getenv("PROVIDER_CONNECT_TIMEOUT_SECONDS", "5"))
+PROVIDER_TIMEOUT_SECONDS = float(os.getenv("PROVIDER_TIMEOUT_SECONDS", "60"))
+PROVIDER_MAX_RETRIES = int(os.getenv("PROVIDER_MAX_RETRIES", "2"))
+PROVIDER_MAX_CONNECTIONS = int(os.getenv("PROVIDER_MAX_CONNECTIONS", "64"))
+PROVIDER_KEEPALIVE_CONNECTIONS = int(os.getenv("PROVIDER_KEEPALIVE_CONNECTIONS", "32"))
+PROVIDER_KEEPALIVE_SECONDS = float(os.getenv("PROVIDER_KEEPALIVE_SECONDS", "300"))
+# HTTP/2 needs the optional h2 package; without it the pool speaks HTTP/1.1
+PROVIDER_HTTP2 = os.getenv("PROVIDER_HTTP2", "1") == "1"
+# Ping the provider when it has been idle this long, so the next real call finds a warm connection (0 disables)
+PROVIDER_WARMUP_INTERVAL_SECONDS = float(os.getenv("PROVIDER_WARMUP_INTERVAL_SECONDS", "60"))
+# On shutdown, wait up to this long for in-flight provider calls before closing connections
+PROVIDER_DRAIN_SECONDS = float(os.getenv("PROVIDER_DRAIN_SECONDS", "30"))
+
+# Longest image side the vision model gets. The browser downscales uploads to this before
+# sending (see GET /config); originals the user chose to send are capped here.
+VISION_MAX_IMAGE_SIDE = int(os.getenv("VISION_MAX_IMAGE_SIDE", "1536"))
+# WebP/JPEG quality (0-1) the browser re-encodes downscaled uploads with
+VISION_IMAGE_QUALITY = float(os.getenv("VISION_IMAGE_QUALITY", "0.85"))
+
+
+def build_http_client() -> httpx.Client:
+    """Connection pool shared by every request this process sends to the provider."""
+    try:
+        import h2  # noqa: F401
+        http2 = PROVIDER_HTTP2
+    except ImportError:
+        http2 = False
+    return httpx.Client(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=PROVIDER_MAX_CONNECTIONS,
+            max_keepalive_connections=PROVIDER_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=PROVIDER_KEEPALIVE_SECONDS,
+        ),
+        timeout=httpx.Timeout(PROVIDER_TIMEOUT_SECONDS, connect=PROVIDER_CONNECT_TIMEOUT_SECONDS),
+    )
+
+
+# System prompts keyed by (personality, script). Snapshots of it are only reused while the
+# template and instructions they were built from are unchanged.
+_PROMPT_VERSION = hashlib.sha1(
+    json.dumps([PROMPT_TEMPLATE, LANGUAGE_INSTRUCTIONS, DEFAULT_LANGUAGE_INSTRUCTION]).encode("utf-8")
+).hexdigest()[:12]
+prompt_cache = LocalCache("prompts", maxsize=4096, codec=JsonCodec(_PROMPT_VERSION))
+
+# Identical text-only turns can reuse a recent reply. Disabled unless REPLY_CACHE_TTL > 0.
+REPLY_CACHE_TTL = float(os.getenv("REPLY_CACHE_TTL", "0"))
+reply_cache = LocalCache("replies", maxsize=2048, ttl=REPLY_CACHE_TTL) if REPLY_CACHE_TTL > 0 else None
 
 
 class AIPersonality:
@@ -30,40 +124,118 @@ class AIPersonality:
         if self.use_gemini:
             if not self.gemini_api_key:
                 raise ValueError("GEMINI_API_KEY is not set.")
-            genai.configure(api_key=self.gemini_api_key)
-            # Fixed: Use GenerativeModel instead of Client
-            self.model = genai.GenerativeModel(self.model_name)
         else:
             if not self.openai_api_key:
                 raise ValueError("OPENAI_API_KEY is not set.")
-            self.client = openai.OpenAI(api_key=self.openai_api_key)
 
-    def _get_language_instruction(self, text: str) -> str:
-        """Determines the language instruction for the AI model based on the script detected."""
-        
-        script = detect_script(text)
-        
-        if script == "telugu_native":
-            return """**LANGUAGE INSTRUCTION:** The user typed in Telugu Script (తెలుగు). Reply in Telugu **Script (తెలుగు) ONLY**. Do not use Romanized language or other scripts."""
-        
-        elif script == "telugu_roman":
-            return """**LANGUAGE INSTRUCTION:** The user typed in Romanized Telugu (e.g., 'ela unnav'). Reply in Romanized Telugu **ONLY**. Do not use Telugu Script or other languages."""
-        
-        elif script == "hindi_native":
-            return """**LANGUAGE INSTRUCTION:** The user typed in Devanagari Script (Hindi). Reply in Devanagari Script (हिंदी) **ONLY**. Do not use Romanized language or other scripts."""
-        
-        elif script == "hindi_roman":
-            return """**LANGUAGE INSTRUCTION:** The user typed in Romanized Hindi (e.g., 'kya hal hai'). Reply in Romanized Hindi **ONLY**. Do not use Devanagari Script or other languages."""
-        
-        elif script == "english":
-            return """**LANGUAGE INSTRUCTION:** The user typed in English. Reply in English **only**. Do not use any other language, Romanized language (like Roman-Hindi or Roman-Telugu), or script."""
-        
-        else:
-            return """**LANGUAGE INSTRUCTION:** Analyze the user's input. Identify the dominant language and script (e.g., English, Roman-Hindi, Telugu Script) and reply **EXCLUSIVELY** in that language and script. If the input is primarily English, reply **ONLY** in English."""
-        
+        # Provider clients are created by start(): from the app lifespan, or lazily on first use
+        self.model = None
+        self.client = None
+        self.http_client = None
+        self._started = False
+        self._start_lock = threading.Lock()
 
-    def _generate_gemini_reply(self, system_prompt, user_input, image_path=None):
-        """Generates a reply using the Google Gemini model."""
+        # In-flight provider calls, so shutdown can drain them
+        self._in_flight = 0
+        self._idle = threading.Condition()
+        self._last_used = 0.0
+
+        # Identical provider requests in flight at the same time share one call
+        self.flights = SingleFlight()
+
+    def start(self):
+        """Create the provider clients. Idempotent; call once per process after forking."""
+        with self._start_lock:
+            if self._started:
+                return
+            if self.use_gemini:
+                # The Gemini SDK talks gRPC: one multiplexed HTTP/2 channel, kept warm by ping()
+                genai.configure(api_key=self.gemini_api_key)
+                # Fixed: Use GenerativeModel instead of Client
+                self.model = genai.GenerativeModel(
+                    self.model_name,
+                    generation_config={"max_output_tokens": MAX_OUTPUT_TOKENS}
+                )
+            else:
+                self.http_client = build_http_client()
+                self.client = openai.OpenAI(
+                    api_key=self.openai_api_key,
+                    http_client=self.http_client,
+                    max_retries=PROVIDER_MAX_RETRIES,
+                )
+            self._started = True
+
+    @contextmanager
+    def _tracked(self):
+        """Counts a provider call as in flight (and makes sure the clients exist)."""
+        self.start()
+        with self._idle:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._idle:
+                self._in_flight -= 1
+                self._last_used = time.monotonic()
+                if not self._in_flight:
+                    self._idle.notify_all()
+
+    def ping(self) -> bool:
+        """Cheap request over the connection real calls use, keeping it open and warm."""
+        try:
+            with self._tracked():
+                if self.use_gemini:
+                    # Through the model's own client: the channel send_message() uses
+                    self.model.count_tokens(
+                        "ping", request_options={"timeout": PROVIDER_CONNECT_TIMEOUT_SECONDS}
+                    )
+                else:
+                    self.client.models.retrieve(self.model_name)
+        except Exception as e:
+            print(f"Provider warm-up ping failed: {e}")
+            return False
+        return True
+
+    async def keep_warm(self, interval: float = PROVIDER_WARMUP_INTERVAL_SECONDS):
+        """Background task: ping whenever no real call has used the connection for `interval` seconds."""
+        while True:
+            if time.monotonic() - self._last_used >= interval:
+                await asyncio.to_thread(self.ping)
+            await asyncio.sleep(interval)
+
+    def close(self, timeout: float = PROVIDER_DRAIN_SECONDS) -> bool:
+        """Wait up to `timeout` seconds for in-flight calls to finish, then release the connections."""
+        with self._idle:
+            drained = self._idle.wait_for(lambda: self._in_flight == 0, timeout)
+        if not drained:
+            print(f"Closing provider clients with {self._in_flight} call(s) still in flight")
+        with self._start_lock:
+            if self.http_client is not None:
+                self.http_client.close()
+            self.model = self.client = self.http_client = None
+            self._started = False
+        return drained
+
+    def transport_stats(self) -> dict:
+        return {"started": self._started, "in_flight": self._in_flight}
+
+    def _build_system_prompt(self, personality: str, user_input: str, language: Optional[str] = None) -> str:
+        """
+        Builds (or reuses) the system prompt for a personality and script. `language` is the
+        caller's sticky per-user estimate; without one the script is detected from user_input.
+        """
+        script = language or detect_script(user_input)
+        personality = truncate_to_tokens(personality, MAX_PERSONALITY_TOKENS)
+        key = (personality, script)
+        system_prompt = prompt_cache.get(key)
+        if system_prompt is None:
+            lang_instruction = LANGUAGE_INSTRUCTIONS.get(script, DEFAULT_LANGUAGE_INSTRUCTION)
+            system_prompt = PROMPT_TEMPLATE.format(personality=personality, lang_instruction=lang_instruction)
+            prompt_cache.set(key, system_prompt)
+        return system_prompt
+
+    def _gemini_request(self, system_prompt, user_input, image_path=None, history=None):
+        """Builds the Gemini chat session and the payload for the new message."""
         
         # Prepare content list
         content_parts = []
@@ -71,37 +243,59 @@ class AIPersonality:
         if image_path:
             try:
                 img = Image.open(image_path)
+                if max(img.size) > VISION_MAX_IMAGE_SIDE:
+                    # thumbnail() decodes JPEGs at reduced scale, so this is cheaper than a full decode
+                    img.thumbnail((VISION_MAX_IMAGE_SIDE, VISION_MAX_IMAGE_SIDE))
                 content_parts.append(img)
             except Exception as e:
                 print(f"Error opening image: {e}")
 
-        # Add text input
-        content_parts.append(user_input)
+        # Send message with system prompt included, after the image if there is one
+        full_prompt = f"{system_prompt}\n\nUser: {user_input}"
+        content_parts.append(full_prompt)
+
+        # Earlier turns go in as chat history; the system prompt rides on the new message
+        chat = self.model.start_chat(history=[
+            {"role": "model" if sender == "ai" else "user", "parts": [content]}
+            for sender, content in (history or [])
+        ])
+        
+        if image_path and content_parts:
+            return chat, content_parts
+        return chat, full_prompt
 
+    def _generate_gemini_reply(self, system_prompt, user_input, image_path=None, history=None):
+        """Generates a reply using the Google Gemini model."""
         try:
-            # Create a new chat with system instruction
-            chat = self.model.start_chat(history=[])
-            
-            # Send message with system prompt included
-            full_prompt = f"{system_prompt}\n\nUser: {user_input}"
-            
-            if image_path and content_parts:
-                response = chat.send_message(content_parts)
-            else:
-                response = chat.send_message(full_prompt)
-            
+            chat, payload = self._gemini_request(system_prompt, user_input, image_path, history)
+            response = chat.send_message(payload, request_options={"timeout": PROVIDER_TIMEOUT_SECONDS})
             return response.text
             
         except Exception as e:
             print(f"Gemini API Error: {e}")
-            return "Sorry, I encountered an API error while processing your request. Please try again."
+            return GEMINI_ERROR_REPLY
 
-    def _generate_openai_reply(self, system_prompt, user_input, image_path=None):
-        """Generates a reply using the OpenAI model."""
+    def _stream_gemini_reply(self, system_prompt, user_input, image_path=None, history=None) -> Iterator[str]:
+        """Streams a reply from the Google Gemini model chunk by chunk."""
+        try:
+            chat, payload = self._gemini_request(system_prompt, user_input, image_path, history)
+            for chunk in chat.send_message(
+                payload, stream=True, request_options={"timeout": PROVIDER_TIMEOUT_SECONDS}
+            ):
+                if chunk.text:
+                    yield chunk.text
+        except Exception as e:
+            print(f"Gemini API Error: {e}")
+            yield GEMINI_ERROR_REPLY
+
+    def _openai_messages(self, system_prompt, user_input, image_path=None, history=None):
+        """Builds the OpenAI chat messages list."""
         
         messages = [
             {"role": "system", "content": system_prompt}
         ]
+        for sender, content in (history or []):
+            messages.append({"role": "assistant" if sender == "ai" else "user", "content": content})
         
         user_content = [{"type": "text", "text": user_input}]
 
@@ -110,34 +304,179 @@ class AIPersonality:
             pass 
 
         messages.append({"role": "user", "content": user_content})
+        return messages
 
+    def _generate_openai_reply(self, system_prompt, user_input, image_path=None, history=None):
+        """Generates a reply using the OpenAI model."""
         try:
             response = self.client.chat.completions.create(
                 model=self.model_name,
-                messages=messages,
-                max_tokens=500
+                messages=self._openai_messages(system_prompt, user_input, image_path, history),
+                max_tokens=MAX_OUTPUT_TOKENS
             )
             return response.choices[0].message.content
         except Exception as e:
             print(f"OpenAI Error: {e}")
-            return "Sorry, I encountered an error while processing your request with OpenAI."
+            return OPENAI_ERROR_REPLY
+
+    def _stream_openai_reply(self, system_prompt, user_input, image_path=None, history=None) -> Iterator[str]:
+        """Streams a reply from the OpenAI model chunk by chunk."""
+        try:
+            stream = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=self._openai_messages(system_prompt, user_input, image_path, history),
+                max_tokens=MAX_OUTPUT_TOKENS,
+                stream=True
+            )
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            print(f"OpenAI Error: {e}")
+            yield OPENAI_ERROR_REPLY
+
+    def _prepare(
+        self,
+        user_input: str,
+        personality: str,
+        summary: Optional[str],
+        language: Optional[str] = None,
+        memories: Optional[List[Tuple[str, str]]] = None
+    ) -> Tuple[str, str]:
+        """Returns the (possibly truncated) user input and the full system prompt."""
+        # Routes reject oversized input up front; this keeps every other caller within budget too
+        user_input = truncate_to_tokens(user_input, MAX_INPUT_TOKENS)
+
+        # System prompt with language instruction, plus the rolling summary if there is one
+        system_prompt = self._build_system_prompt(personality, user_input, language)
+        if summary:
+            system_prompt = f"{system_prompt}\n\nSummary of the earlier conversation: {summary}"
+        # Older messages recalled by semantic similarity (memory.py)
+        if memories:
+            recalled = "\n".join(
+                f"- {'AI' if sender == 'ai' else 'User'}: {content}" for sender, content in memories
+            )
+            system_prompt = f"{system_prompt}\n\nRelevant earlier messages:\n{recalled}"
+        return user_input, system_prompt
 
-    def generate_ai_reply(self, user_input: str, personality: str, image_path: str = None):
+    def _call_provider(self, system_prompt, user_input, image_path=None, history=None) -> str:
+        """Sends one request to the configured provider."""
+        with self._tracked():
+            if self.use_gemini:
+                return self._generate_gemini_reply(system_prompt, user_input, image_path, history)
+            return self._generate_openai_reply(system_prompt, user_input, image_path, history)
+
+    def _flight_key(self, system_prompt, user_input, image_path, history) -> str:
+        """Identity of a provider request, for coalescing identical concurrent calls."""
+        digest = hashlib.sha256()
+        for part in (system_prompt, user_input, *(f"{sender}:{content}" for sender, content in history)):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        if image_path:
+            try:
+                with open(image_path, "rb") as f:
+                    digest.update(hashlib.file_digest(f, "sha256").digest())
+            except OSError:
+                digest.update(image_path.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _begin(self, user_input, personality, image_path, history, summary, language=None, memories=None):
+        """Shared setup for both reply paths: prompt, cache key and cached reply (if any)."""
+        # 1. Construct System Prompt (language instruction included)
+        user_input, system_prompt = self._prepare(user_input, personality, summary, language, memories)
+        history = list(history or [])
+
+        # 2. Reuse a recent identical text-only reply when the reply cache is enabled
+        cache_key = None
+        cached = None
+        if reply_cache is not None and not image_path:
+            cache_key = (system_prompt, tuple(history), user_input)
+            cached = reply_cache.get(cache_key)
+        return user_input, system_prompt, history, cache_key, cached
+
+    def _finish(self, cache_key, reply: str) -> str:
+        if cache_key is not None and reply not in (GEMINI_ERROR_REPLY, OPENAI_ERROR_REPLY):
+            reply_cache.set(cache_key, reply)
+        return reply
+
+    def generate_ai_reply(
+        self,
+        user_input: str,
+        personality: str,
+        image_path: str = None,
+        history: Optional[List[Tuple[str, str]]] = None,
+        summary: Optional[str] = None,
+        language: Optional[str] = None,
+        memories: Optional[List[Tuple[str, str]]] = None
+    ):
         """
         Public method to generate the AI's reply.
+        `history` is the last few (sender, content) turns and `summary` the rolling summary of
+        everything before them, so the prompt stays the same size however long the chat gets.
+        `language` is the user's sticky reply language (language_state.py), if the caller tracks one.
+        `memories` are older (sender, content) messages recalled as relevant to this turn (memory.py).
+        Identical requests already in flight are shared instead of sent again.
         """
-        # 1. Get Language Instruction
-        lang_instruction = self._get_language_instruction(user_input)
-
-        # 2. Construct System Prompt
-        system_prompt = (
-            f"You are an AI with the personality of a {personality}. "
-            f"{lang_instruction} "
-            "Maintain your persona strictly. Be concise and helpful."
+        user_input, system_prompt, history, cache_key, cached = self._begin(
+            user_input, personality, image_path, history, summary, language, memories
         )
+        if cached is not None:
+            return cached
 
         # 3. Generate Reply
-        if self.use_gemini:
-            return self._generate_gemini_reply(system_prompt, user_input, image_path)
-        else:
-            return self._generate_openai_reply(system_prompt, user_input, image_path)
\ No newline at end of file
+        key = self._flight_key(system_prompt, user_input, image_path, history)
+        reply = self.flights.do(key, self._call_provider, system_prompt, user_input, image_path, history)
+        return self._finish(cache_key, reply)
+
+    async def agenerate_ai_reply(
+        self,
+        user_input: str,
+        personality: str,
+        image_path: str = None,
+        history: Optional[List[Tuple[str, str]]] = None,
+        summary: Optional[str] = None,
+        language: Optional[str] = None,
+        memories: Optional[List[Tuple[str, str]]] = None
+    ):
+        """Async version of generate_ai_reply; the provider call runs off the event loop."""
+        user_input, system_prompt, history, cache_key, cached = self._begin(
+            user_input, personality, image_path, history, summary, language, memories
+        )
+        if cached is not None:
+            return cached
+
+        key = self._flight_key(system_prompt, user_input, image_path, history)
+        reply = await self.flights.do_async(key, self._call_provider, system_prompt, user_input, image_path, history)
+        return self._finish(cache_key, reply)
+
+    def stream_ai_reply(
+        self,
+        user_input: str,
+        personality: str,
+        image_path: str = None,
+        history: Optional[List[Tuple[str, str]]] = None,
+        summary: Optional[str] = None,
+        language: Optional[str] = None,
+        memories: Optional[List[Tuple[str, str]]] = None
+    ) -> Iterator[str]:
+        """Same as generate_ai_reply, but yields the reply in chunks as the provider produces them."""
+        user_input, system_prompt = self._prepare(user_input, personality, summary, language, memories)
+        with self._tracked():
+            if self.use_gemini:
+                yield from self._stream_gemini_reply(system_prompt, user_input, image_path, history)
+            else:
+                yield from self._stream_openai_reply(system_prompt, user_input, image_path, history)
+
+    def summarize(self, previous_summary: Optional[str], turns: List[Tuple[str, str]]) -> Optional[str]:
+        """Folds `turns` into the previous rolling summary. Returns None if the provider failed."""
+        transcript = "\n".join(
+            f"{'AI' if sender == 'ai' else 'User'}: {content}" for sender, content in turns
+        )
+        user_input = (
+            f"Previous summary:\n{previous_summary or '(none)'}\n\n"
+            f"New turns:\n{transcript}"
+        )
+        summary = self._call_provider(SUMMARY_SYSTEM_PROMPT, user_input)
+        if summary in (GEMINI_ERROR_REPLY, OPENAI_ERROR_REPLY):
+            return None
+        return summary.strip()
@@ -0,0 +1,43 @@
+# api/main.py
+# Serverless entry point. vercel.json routes every request here and Vercel serves `app`
+# (ASGI); on AWS Lambda use `lambda_handler` (API Gateway / function URL events via Mangum).
+#
+# Everything expensive happens once per container, at import: database engines, provider
+# clients, langdetect profiles and the compiled language instructions. Warm invocations reuse
+# them. What a long-running server does at startup is left out of the cold path:
+#   - schema setup: run `python api/main.py init-db` once per deploy instead
+#   - background loops (archive, GC, job sweep, snapshots): a frozen container can't run them
+#   - connection pooling: DATABASE_POOL=null, so no connection outlives an invocation
+#     (put PgBouncer or the provider's pooled endpoint in front of Postgres)
+# Chat jobs (/chat/jobs) and WebSockets need the long-running server (gunicorn_conf.py), and
+# uploads only persist with STORAGE_BACKEND=s3.
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Ahead of this directory, so "main" is the app module and not this file
+sys.path.insert(0, ROOT)
+
+# Serverless defaults; anything set in the function's environment wins
+os.environ.setdefault("DB_INIT_ON_STARTUP", "0")
+os.environ.setdefault("RUN_BACKGROUND_TASKS", "0")
+os.environ.setdefault("DATABASE_POOL", "null")
+# The deployment bundle is read-only; /tmp is the only writable place
+os.environ.setdefault("UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "zena-uploads"))
+
+from mangum import Mangum  # noqa: E402
+
+from main import ai_personality, app, init_database  # noqa: E402,F401
+
+# Mangum would run the app lifespan around every invocation; start the clients once instead
+ai_personality.start()
+
+lambda_handler = Mangum(app, lifespan="off")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["init-db"]:
+        sys.exit("usage: python api/main.py init-db")
+    init_database()
+    print("Database schema is up to date")
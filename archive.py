@@ -0,0 +1,174 @@
+# archive.py
+# Moves cold messages out of the hot `messages` table into compressed, append-only
+# per-user segments (`message_archive`), and reads them back for history paging.
+#
+# Run once from the command line:   python archive.py
+# The app also runs it in the background every ARCHIVE_INTERVAL_SECONDS (see main.py).
+import asyncio
+import json
+import os
+import zlib
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional
+
+from sqlalchemy.orm import Session
+
+from models import ArchiveSegment, Message
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+# The most recent messages of every user stay hot regardless of age
+ARCHIVE_KEEP_RECENT = int(os.getenv("ARCHIVE_KEEP_RECENT", "50"))
+ARCHIVE_SEGMENT_SIZE = int(os.getenv("ARCHIVE_SEGMENT_SIZE", "500"))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+
+def message_to_dict(msg: Message) -> dict:
+    return {
+        "id": msg.id,
+        "sender": msg.sender,
+        "content": msg.content,
+        "image_url": msg.image_url,
+        "timestamp": msg.timestamp.isoformat(),
+    }
+
+
+def _encode(rows: List[dict]) -> bytes:
+    return zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def _decode(payload: bytes) -> List[dict]:
+    return json.loads(zlib.decompress(payload))
+
+
+def archive_user(db: Session, user_id: int, cutoff: datetime) -> int:
+    """Archive one user's messages older than cutoff. Returns the number of messages moved."""
+    # Never archive inside the user's most recent ARCHIVE_KEEP_RECENT messages
+    keep_from_id = (
+        db.query(Message.id)
+        .filter(Message.user_id == user_id)
+        .order_by(Message.id.desc())
+        .offset(ARCHIVE_KEEP_RECENT)
+        .limit(1)
+        .scalar()
+    )
+    if keep_from_id is None:
+        return 0
+
+    moved = 0
+    while True:
+        batch = (
+            db.query(Message)
+            .filter(
+                Message.user_id == user_id,
+                Message.timestamp < cutoff,
+                Message.id <= keep_from_id,
+            )
+            .order_by(Message.id.asc())
+            .limit(ARCHIVE_SEGMENT_SIZE)
+            .all()
+        )
+        if not batch:
+            return moved
+
+        ids = [msg.id for msg in batch]
+        db.add(ArchiveSegment(
+            user_id=user_id,
+            first_message_id=ids[0],
+            last_message_id=ids[-1],
+            first_timestamp=batch[0].timestamp,
+            last_timestamp=batch[-1].timestamp,
+            message_count=len(batch),
+            payload=_encode([message_to_dict(msg) for msg in batch]),
+        ))
+        deleted = (
+            db.query(Message)
+            .filter(Message.id.in_(ids))
+            .delete(synchronize_session=False)
+        )
+        if deleted != len(ids):
+            # Another worker archived (some of) these rows first; leave them to it.
+            db.rollback()
+            return moved
+        db.commit()
+        moved += deleted
+
+
+def archive_cold_messages(db: Session, max_age_days: int = ARCHIVE_AFTER_DAYS) -> int:
+    """Archive every user's messages older than max_age_days. Returns the number moved."""
+    cutoff = datetime.utcnow() - timedelta(days=max_age_days)
+    user_ids = [
+        user_id for (user_id,) in
+        db.query(Message.user_id)
+        .filter(Message.timestamp < cutoff)
+        .distinct()
+        .all()
+    ]
+    moved = 0
+    for user_id in user_ids:
+        moved += archive_user(db, user_id, cutoff)
+    return moved
+
+
+def load_archived(db: Session, user_id: int, before_id: Optional[int], limit: int) -> List[dict]:
+    """Return up to `limit` archived messages with id < before_id, oldest first."""
+    if limit <= 0:
+        return []
+
+    query = db.query(ArchiveSegment).filter(ArchiveSegment.user_id == user_id)
+    if before_id is not None:
+        query = query.filter(ArchiveSegment.first_message_id < before_id)
+
+    collected = []
+    # Walk segments newest first and stop as soon as the page is full
+    for segment in query.order_by(ArchiveSegment.last_message_id.desc()).yield_per(8):
+        rows = _decode(segment.payload)
+        if before_id is not None:
+            rows = [row for row in rows if row["id"] < before_id]
+        collected = rows[-(limit - len(collected)):] + collected
+        if len(collected) >= limit:
+            break
+    return collected
+
+
+def iter_archived(db: Session, user_id: int) -> Iterator[dict]:
+    """Yield every archived message of a user, oldest first, one segment in memory at a time."""
+    segments = (
+        db.query(ArchiveSegment.payload)
+        .filter(ArchiveSegment.user_id == user_id)
+        .order_by(ArchiveSegment.last_message_id.asc())
+        .yield_per(8)
+    )
+    for (payload,) in segments:
+        yield from _decode(payload)
+
+
+async def archive_loop(session_factory, interval: int = ARCHIVE_INTERVAL_SECONDS):
+    """Background task: archive cold messages every `interval` seconds."""
+    def run_once():
+        db = session_factory()
+        try:
+            return archive_cold_messages(db)
+        finally:
+            db.close()
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            moved = await asyncio.to_thread(run_once)
+            if moved:
+                print(f"Archived {moved} cold messages")
+        except Exception as e:
+            print(f"Archival error: {e}")
+
+
+if __name__ == "__main__":
+    from database import SessionLocal, router
+    from models import Base
+
+    for shard_engine in router.engines.values():
+        Base.metadata.create_all(bind=shard_engine)
+    db = SessionLocal()
+    try:
+        print(f"Archived {archive_cold_messages(db)} messages older than {ARCHIVE_AFTER_DAYS} days")
+    finally:
+        db.close()
@@ -0,0 +1,126 @@
+# batch.py
+# Bulk chat: fan a list of {user_id, message} items out to the provider with bounded
+# concurrency, bulk-insert the resulting messages (with their usage rollups and memory
+# embeddings), and stream results as they complete.
+import asyncio
+import json
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import AsyncIterator, Dict, List
+
+import anyio
+from sqlalchemy import insert
+from starlette.concurrency import run_in_threadpool
+
+from database import note_write, router
+from memory import embedding_row
+from models import Message, MessageEmbedding
+from usage import record_many
+from tokens import MAX_INPUT_TOKENS, count_tokens
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+# Provider calls in flight at once for a single batch request
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))
+# Rows written per INSERT
+BATCH_FLUSH_ROWS = int(os.getenv("BATCH_FLUSH_ROWS", "200"))
+
+
+def _embeddings(rows: List[dict]) -> List[dict]:
+    embeddings = (embedding_row(row["id"], row["user_id"], row["sender"], row["content"]) for row in rows)
+    return [embedding for embedding in embeddings if embedding is not None]
+
+
+def _bulk_insert(session_factory, rows: List[dict]):
+    db = session_factory()
+    try:
+        if router.sharded:
+            # One INSERT per shard; ids come from the shard's sequence (see sharding.py)
+            by_shard = defaultdict(list)
+            for row in rows:
+                by_shard[router.shard_for(row["user_id"])].append(row)
+            for shard, shard_rows in by_shard.items():
+                for row, message_id in zip(shard_rows, router.allocate_ids(db, shard, len(shard_rows))):
+                    row["id"] = message_id
+                # Core insert: the ORM's bulk insert can't be routed per shard
+                conn = db.connection(bind_arguments={"shard_id": shard})
+                conn.execute(insert(Message.__table__), shard_rows)
+                embeddings = _embeddings(shard_rows)
+                if embeddings:
+                    conn.execute(insert(MessageEmbedding.__table__), embeddings)
+        else:
+            message_ids = db.scalars(insert(Message).returning(Message.id, sort_by_parameter_order=True), rows).all()
+            for row, message_id in zip(rows, message_ids):
+                row["id"] = message_id
+            embeddings = _embeddings(rows)
+            if embeddings:
+                db.execute(insert(MessageEmbedding), embeddings)
+        record_many(db, rows)
+        for user_id in {row["user_id"] for row in rows}:
+            note_write(db, user_id)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def run_batch(
+    items: List[dict],
+    personalities: Dict[int, str],
+    ai,
+    session_factory,
+) -> AsyncIterator[bytes]:
+    """
+    Yield one NDJSON line per item, in completion order: {"index", "user_id", "reply"} or
+    {"index", "user_id", "error"}. Items are answered independently, without conversation
+    history, which is what evaluation and bot-integration jobs send.
+    """
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def answer(index: int, item: dict) -> dict:
+        user_id = item["user_id"]
+        personality = personalities.get(user_id)
+        if personality is None:
+            return {"index": index, "user_id": user_id, "error": "User not found."}
+        if count_tokens(item["message"]) > MAX_INPUT_TOKENS:
+            return {"index": index, "user_id": user_id, "error": "Message is too long."}
+        asked_at = datetime.utcnow()
+        async with semaphore:
+            try:
+                reply = await ai.agenerate_ai_reply(item["message"], personality)
+            except Exception as e:
+                print(f"Error generating AI reply: {e}")
+                return {"index": index, "user_id": user_id, "error": "Generation failed."}
+        return {
+            "index": index,
+            "user_id": user_id,
+            "reply": reply,
+            "_rows": [
+                {"user_id": user_id, "sender": "user", "content": item["message"],
+                 "token_count": count_tokens(item["message"]), "timestamp": asked_at},
+                {"user_id": user_id, "sender": "ai", "content": reply,
+                 "token_count": count_tokens(reply), "timestamp": datetime.utcnow()},
+            ],
+        }
+
+    pending_rows = []
+    tasks = [asyncio.ensure_future(answer(i, item)) for i, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            pending_rows.extend(result.pop("_rows", ()))
+            if len(pending_rows) >= BATCH_FLUSH_ROWS:
+                rows, pending_rows = pending_rows, []
+                await run_in_threadpool(_bulk_insert, session_factory, rows)
+            yield (json.dumps(result, ensure_ascii=False) + "\n").encode("utf-8")
+    finally:
+        # Client went away: stop generating for the rest of the batch
+        for task in tasks:
+            task.cancel()
+        # Replies already generated were paid for: store them even if they were never sent
+        for task in tasks:
+            if task.done() and not task.cancelled() and task.exception() is None:
+                pending_rows.extend(task.result().pop("_rows", ()))
+        if pending_rows:
+            # Shielded: on disconnect the stream's cancel scope would abort the write
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(_bulk_insert, session_factory, pending_rows)
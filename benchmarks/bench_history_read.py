@@ -0,0 +1,115 @@
+"""
+History read path: ORM objects + default JSONResponse vs. column-only Core select + fast_json.
+
+Fills a throwaway SQLite database with one user's messages, then serves the same pages
+both ways (the old get_chat_history body, and history.history_page + fast_json.dumps)
+and prints rows/sec and tracemalloc peak memory / allocated blocks per page.
+
+    python benchmarks/bench_history_read.py
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+import fast_json
+from history import history_page
+from models import Base, Message, User
+
+MESSAGES = 20000
+PAGE_SIZES = (50, 200, 1000)
+ROUNDS = 50
+
+
+def orm_page(db, user_id, limit):
+    # What the route did before: full ORM entities, dicts with isoformat, FastAPI's JSON rendering
+    rows = (
+        db.query(Message)
+        .filter(Message.user_id == user_id)
+        .order_by(Message.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    rows.reverse()
+    messages = [
+        {
+            "id": msg.id,
+            "sender": msg.sender,
+            "content": msg.content,
+            "image_url": msg.image_url,
+            "timestamp": msg.timestamp.isoformat(),
+        }
+        for msg in rows[-limit:]
+    ]
+    payload = jsonable_encoder({"messages": messages, "has_more": len(rows) > limit})
+    return json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def lean_page(db, user_id, limit):
+    messages, has_more = history_page(db, user_id, limit)
+    return fast_json.dumps({"messages": messages, "has_more": has_more})
+
+
+def measure(session_factory, fn, limit):
+    db = session_factory()
+    try:
+        fn(db, 1, limit)  # warm up
+        db.expunge_all()
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            fn(db, 1, limit)
+            db.expunge_all()
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        fn(db, 1, limit)
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        db.expunge_all()
+        blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    finally:
+        db.close()
+    return limit * ROUNDS / elapsed, peak, blocks
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+
+        db = session_factory()
+        db.add(User(id=1, name="bench", personality="friendly"))
+        db.commit()
+        start = datetime.utcnow() - timedelta(days=1)
+        db.execute(insert(Message), [
+            {"user_id": 1, "sender": "user" if i % 2 == 0 else "ai",
+             "content": f"message {i} ela unnav? kya hal hai " * 3,
+             "timestamp": start + timedelta(seconds=i)}
+            for i in range(MESSAGES)
+        ])
+        db.commit()
+        db.close()
+
+        print(f"json encoder: {'orjson' if fast_json.orjson is not None else 'stdlib json'}")
+        print(f"{'page':>6} {'path':>5} {'rows/sec':>12} {'peak KiB':>10} {'alloc blocks':>13}")
+        for limit in PAGE_SIZES:
+            for name, fn in (("orm", orm_page), ("lean", lean_page)):
+                rate, peak, blocks = measure(session_factory, fn, limit)
+                print(f"{limit:>6} {name:>5} {rate:>12,.0f} {peak / 1024:>10,.1f} {blocks:>13,}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
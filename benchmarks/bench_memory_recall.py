@@ -0,0 +1,68 @@
+"""
+Semantic memory recall latency at 10k, 100k and 1M messages per user.
+
+Fills a UserMemory with N vectors (hashed-n-gram embeddings of a few thousand synthetic
+messages, tiled to size) and measures, per size: the cold load (unpacking N float16 blobs into
+the float32 matrix), the query embedding, and the NumPy top-k search that MemoryIndex.recall
+runs on every turn. No database involved.
+
+    python benchmarks/bench_memory_recall.py
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory import MEMORY_DIM, MEMORY_TOP_K, UserMemory, embed, pack, top_k, unpack_many
+
+SIZES = (10_000, 100_000, 1_000_000)
+DISTINCT_MESSAGES = 5000
+QUERIES = 30
+WORDS = (
+    "ela unnav today I went to the market and bought mangoes what about you kya hal hai "
+    "my sister lives in hyderabad she works at a hospital we adopted a dog named bruno"
+).split()
+
+
+def median_ms(fn, runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    rng = random.Random(0)
+    texts = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 30))) for _ in range(DISTINCT_MESSAGES)]
+    start = time.perf_counter()
+    blobs = [pack(embed(text)) for text in texts]
+    embed_ms = (time.perf_counter() - start) * 1000 / DISTINCT_MESSAGES
+    queries = [embed(rng.choice(texts)) for _ in range(QUERIES)]
+
+    print(f"dim={MEMORY_DIM} k={MEMORY_TOP_K}  embed: {embed_ms:.3f} ms/message")
+    print(f"{'messages':>10} {'load ms':>10} {'search p50 ms':>14} {'matrix MiB':>11}")
+    for size in SIZES:
+        tiled = [blobs[i % DISTINCT_MESSAGES] for i in range(size)]
+
+        def load():
+            memory = UserMemory()
+            memory.extend(list(range(1, size + 1)), unpack_many(tiled))
+            return memory
+
+        start = time.perf_counter()
+        memory = load()
+        load_ms = (time.perf_counter() - start) * 1000
+
+        matrix = memory.vectors[:memory.size]
+        queue = iter(queries * 2)
+        search_ms = median_ms(lambda: top_k(matrix, next(queue), MEMORY_TOP_K), QUERIES)
+        print(f"{size:>10,} {load_ms:>10,.1f} {search_ms:>14.2f} {matrix.nbytes / 2**20:>11,.1f}")
+
+
+if __name__ == "__main__":
+    main()
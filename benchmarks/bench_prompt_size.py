@@ -0,0 +1,70 @@
+"""
+Prompt size vs. conversation length: raw history vs. rolling summary + recent turns.
+
+Captures what AIPersonality.generate_ai_reply would send to the provider (no network
+calls) for conversations of increasing length, once with the full transcript as history
+and once with the rolling summary (bounded to SUMMARY_MAX_WORDS) plus the turns not
+yet folded into it, and prints the estimated prompt tokens for each.
+
+    python benchmarks/bench_prompt_size.py
+"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+
+from ai_core import AIPersonality, SUMMARY_MAX_WORDS
+from summarizer import RECENT_TURNS, SUMMARY_EVERY
+from tokens import count_tokens
+
+WORDS = "ela unnav today I went to the market and bought mangoes what about you kya hal hai".split()
+
+
+def make_turn(i: int):
+    rng = random.Random(i)
+    return ("user" if i % 2 == 0 else "ai", " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 40))))
+
+
+def fake_summarize(previous_summary, turns):
+    # Stand-in for the provider: merge and keep the newest SUMMARY_MAX_WORDS words, as instructed
+    words = (previous_summary or "").split() + " ".join(content for _, content in turns).split()
+    return " ".join(words[-SUMMARY_MAX_WORDS:])
+
+
+def main():
+    ai = AIPersonality(use_gemini=False)
+    captured = {}
+
+    def capture(system_prompt, user_input, image_path=None, history=None):
+        text = system_prompt + user_input + "".join(content for _, content in (history or []))
+        captured["tokens"] = count_tokens(text)
+        return "ok"
+
+    ai._generate_openai_reply = capture
+
+    transcript = []
+    summary, summarized_upto = None, 0
+    print(f"{'messages':>9} {'raw history':>12} {'summary+recent':>15}")
+    for length in (10, 50, 100, 500, 1000, 5000):
+        while len(transcript) < length:
+            transcript.append(make_turn(len(transcript)))
+            # Same trigger as ConversationSummarizer: fold once SUMMARY_EVERY turns sit outside the window
+            pending = transcript[summarized_upto:-RECENT_TURNS]
+            if len(pending) >= SUMMARY_EVERY:
+                summary = fake_summarize(summary, pending)
+                summarized_upto += len(pending)
+
+        user_input = "what did I buy at the market?"
+        ai.generate_ai_reply(user_input, "cheerful friend", history=transcript)
+        raw = captured["tokens"]
+        # Mirrors load_recent_turns(): unsummarized turns, capped at RECENT_TURNS + SUMMARY_EVERY
+        unsummarized = transcript[summarized_upto:][-(RECENT_TURNS + SUMMARY_EVERY):]
+        ai.generate_ai_reply(user_input, "cheerful friend", history=unsummarized, summary=summary)
+        rolled = captured["tokens"]
+        print(f"{length:>9} {raw:>12} {rolled:>15}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Serverless cold vs. warm invocation latency for api/main.py.
+
+Replays API Gateway (HTTP API v2) events through the Mangum handler. Every cold run is a
+fresh interpreter: the entry point's import (one-time init) plus the first invocation of
+each event. Warm invocations replay the same events in that process afterwards. Uses a
+throwaway SQLite database set up with `init-db` and only routes that make no provider calls.
+
+    python benchmarks/bench_serverless.py --cold-runs 5 --warm 200
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY = os.path.join(ROOT, "api", "main.py")
+
+EVENTS = [
+    ("GET", "/health", ""),
+    ("GET", "/config", ""),
+    ("GET", "/chat/history/1", "limit=50"),
+]
+MESSAGES = 500
+
+
+def http_event(method: str, path: str, query: str = "") -> dict:
+    return {
+        "version": "2.0",
+        "routeKey": "$default",
+        "rawPath": path,
+        "rawQueryString": query,
+        "headers": {"host": "bench.local", "accept": "application/json"},
+        "requestContext": {
+            "accountId": "bench",
+            "apiId": "bench",
+            "domainName": "bench.local",
+            "requestId": "bench",
+            "routeKey": "$default",
+            "stage": "$default",
+            "timeEpoch": 0,
+            "http": {"method": method, "path": path, "protocol": "HTTP/1.1",
+                     "sourceIp": "127.0.0.1", "userAgent": "bench"},
+        },
+        "isBase64Encoded": False,
+    }
+
+
+def child(warm: int):
+    """One container lifetime: import, first invocations, then warm replays. Prints JSON."""
+    context = types.SimpleNamespace(aws_request_id="bench", get_remaining_time_in_millis=lambda: 30000)
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import api.main as entry
+    imported = time.perf_counter()
+
+    result = {"import_ms": (imported - started) * 1000, "first_ms": {}, "warm_ms": {}}
+    for method, path, query in EVENTS:
+        event = http_event(method, path, query)
+        t = time.perf_counter()
+        response = entry.lambda_handler(event, context)
+        result["first_ms"][path] = (time.perf_counter() - t) * 1000
+        if response["statusCode"] != 200:
+            raise RuntimeError(f"{path}: {response['statusCode']} {response.get('body')}")
+
+    for method, path, query in EVENTS:
+        event = http_event(method, path, query)
+        samples = []
+        for _ in range(warm):
+            t = time.perf_counter()
+            entry.lambda_handler(event, context)
+            samples.append((time.perf_counter() - t) * 1000)
+        result["warm_ms"][path] = samples
+    print(json.dumps(result))
+
+
+def seed(env: dict, db_path: str):
+    subprocess.run([sys.executable, ENTRY, "init-db"], env=env, check=True, stdout=subprocess.DEVNULL)
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO users (id, name, personality) VALUES (1, 'bench', 'friendly guide')")
+    start = datetime.utcnow() - timedelta(days=1)
+    conn.executemany(
+        "INSERT INTO messages (user_id, sender, content, token_count, timestamp) VALUES (1, ?, ?, 8, ?)",
+        [("user" if i % 2 == 0 else "ai", f"message {i} ela unnav? kya hal hai", start + timedelta(seconds=i))
+         for i in range(MESSAGES)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cold-runs", type=int, default=5)
+    parser.add_argument("--warm", type=int, default=200)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.warm)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{db_path}",
+            CACHE_BUS_PATH=os.path.join(tmp, "bus.log"),
+            CACHE_SNAPSHOT_DIR=os.path.join(tmp, "snapshots"),
+            GEMINI_API_KEY=os.environ.get("GEMINI_API_KEY", "bench"),
+        )
+        seed(env, db_path)
+
+        runs = []
+        for _ in range(args.cold_runs):
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", "--warm", str(args.warm)],
+                env=env, check=True, capture_output=True, text=True,
+            ).stdout
+            runs.append(json.loads(out.strip().splitlines()[-1]))
+
+    imports = [run["import_ms"] for run in runs]
+    print(f"{args.cold_runs} cold starts, {args.warm} warm invocations per route each")
+    print(f"init (import api/main.py): median {statistics.median(imports):8.1f} ms")
+    print(f"{'route':<22} {'cold first':>11} {'warm p50':>9} {'warm p95':>9}   (ms)")
+    for _, path, _ in EVENTS:
+        first = statistics.median(run["first_ms"][path] for run in runs)
+        warm = [sample for run in runs for sample in run["warm_ms"][path]]
+        print(f"{path:<22} {first:>11.1f} {percentile(warm, 0.5):>9.1f} {percentile(warm, 0.95):>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Write throughput vs. number of shards.
+
+For 1, 2 and 4 throwaway SQLite shards, creates users through the sharded session (so
+they are spread round-robin), then has WRITERS threads store one message per commit,
+like a chat turn does, for DURATION seconds. Prints committed messages/sec per shard count.
+SQLite allows one writer per file, so this mostly shows the write lock being split.
+
+    python benchmarks/bench_shard_writes.py
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+
+from models import Base, Message, User
+from sharding import ShardRouter
+
+SHARD_COUNTS = (1, 2, 4)
+USERS = 64
+WRITERS = 16
+DURATION = 5.0
+
+
+def run(tmp: str, shards: int) -> float:
+    engines = [
+        create_engine(f"sqlite:///{os.path.join(tmp, f'shards{shards}_{i}.db')}",
+                      connect_args={"check_same_thread": False, "timeout": 30})
+        for i in range(shards)
+    ]
+    for engine in engines:
+        Base.metadata.create_all(bind=engine)
+    router = ShardRouter(engines)
+    router.prepare()
+    session_factory = router.sessionmaker(autoflush=False)
+
+    db = session_factory()
+    users = [User(name=f"bench{i}", personality="friendly") for i in range(USERS)]
+    db.add_all(users)
+    db.commit()
+    user_ids = [user.id for user in users]
+    db.close()
+
+    written = [0] * WRITERS
+    deadline = time.perf_counter() + DURATION
+
+    def writer(index: int):
+        rng = random.Random(index)
+        db = session_factory()
+        try:
+            while time.perf_counter() < deadline:
+                db.add(Message(user_id=rng.choice(user_ids), sender="user", content="ela unnav? kya hal hai"))
+                db.commit()
+                written[index] += 1
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(WRITERS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    router.dispose()
+    return sum(written) / elapsed
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{WRITERS} writers, {USERS} users, {DURATION:.0f}s per run")
+        print(f"{'shards':>6} {'msgs/sec':>10}")
+        for shards in SHARD_COUNTS:
+            print(f"{shards:>6} {run(tmp, shards):>10,.0f}")
+
+
+if __name__ == "__main__":
+    main()
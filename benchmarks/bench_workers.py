@@ -0,0 +1,124 @@
+"""
+Throughput vs. worker count for the preforked server (gunicorn_conf.py).
+
+Starts gunicorn against a throwaway SQLite database seeded with one user and a few
+hundred messages, then hammers GET /chat/history/{id} (DB read + JSON encoding, no
+provider calls) from several client processes and reports requests/sec per worker count.
+
+    python benchmarks/bench_workers.py --workers 1 2 4 --seconds 10
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _wait_ready(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"{base_url}/health", timeout=1).read()
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError("server did not come up")
+
+
+def _seed(base_url, db_url, messages):
+    req = urllib.request.Request(
+        f"{base_url}/users/",
+        data=json.dumps({"name": "bench", "personality": "friendly guide"}).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    user_id = json.loads(urllib.request.urlopen(req).read())["id"]
+
+    # Insert history directly; /chat/ would call the provider.
+    sys.path.insert(0, ROOT)
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from models import Message
+
+    db = Session(create_engine(db_url))
+    db.add_all(
+        Message(user_id=user_id, sender="user" if i % 2 == 0 else "ai", content=f"message number {i} " * 8)
+        for i in range(messages)
+    )
+    db.commit()
+    db.close()
+    return user_id
+
+
+def _client(args):
+    url, seconds, threads = args
+    deadline = time.time() + seconds
+
+    def loop():
+        count = 0
+        while time.time() < deadline:
+            urllib.request.urlopen(url).read()
+            count += 1
+        return count
+
+    with ThreadPoolExecutor(threads) as pool:
+        return sum(pool.map(lambda _: loop(), range(threads)))
+
+
+def run(workers, seconds, clients, threads, messages, port):
+    tmp = tempfile.mkdtemp(prefix="zena-bench-")
+    db_url = f"sqlite:///{tmp}/bench.db"
+    env = dict(
+        os.environ,
+        DATABASE_URL=db_url,
+        WEB_CONCURRENCY=str(workers),
+        PORT=str(port),
+        GEMINI_API_KEY=os.getenv("GEMINI_API_KEY", "bench-key"),
+        CACHE_BUS_PATH=f"{tmp}/cache-bus.log",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py", "main:app"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        _wait_ready(base_url)
+        user_id = _seed(base_url, db_url, messages)
+        url = f"{base_url}/chat/history/{user_id}?limit=200"
+        with multiprocessing.Pool(clients) as pool:
+            total = sum(pool.map(_client, [(url, seconds, threads)] * clients))
+        return total / seconds
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=4, help="client processes")
+    parser.add_argument("--threads", type=int, default=8, help="threads per client process")
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    baseline = None
+    print(f"{'workers':>8} {'req/s':>10} {'scaling':>8}")
+    for workers in args.workers:
+        rps = run(workers, args.seconds, args.clients, args.threads, args.messages, args.port)
+        baseline = baseline or rps
+        print(f"{workers:>8} {rps:>10.1f} {rps / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+# cache.py
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+# Shared append-only log used to broadcast invalidations between worker processes.
+# Every worker tails it, so a write handled by one worker evicts stale entries in the others.
+CACHE_BUS_PATH = os.getenv(
+    "CACHE_BUS_PATH", os.path.join(tempfile.gettempdir(), "zena-cache-bus.log")
+)
+CACHE_BUS_POLL_INTERVAL = float(os.getenv("CACHE_BUS_POLL_INTERVAL", "0.05"))
+# The log is replaced by an empty one once it grows past this
+CACHE_BUS_MAX_BYTES = int(os.getenv("CACHE_BUS_MAX_BYTES", str(4 * 1024 * 1024)))
+
+_MISSING = object()
+
+
+def _decode_key(key):
+    """JSON turns tuple keys into lists; turn them back so they hash the same."""
+    if isinstance(key, list):
+        return tuple(_decode_key(k) for k in key)
+    return key
+
+
+class InvalidationBus:
+    """
+    Broadcasts cache invalidations to every process sharing the same log file.
+
+    Rotation replaces the file with an empty one whose first line is the next generation
+    number. Readers keep the old file open, drain it, then continue at the top of the new
+    one; a publisher whose record landed in a file already rotated away writes it again.
+    A reader that finds it skipped a whole generation (idle through two rotations) cannot
+    know what it missed and resyncs every cache instead.
+    """
+
+    def __init__(self, path: str = CACHE_BUS_PATH, poll_interval: float = CACHE_BUS_POLL_INTERVAL,
+                 max_bytes: int = CACHE_BUS_MAX_BYTES):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.max_bytes = max_bytes
+        self._caches = {}
+        self._lock = threading.Lock()
+        self._next_poll = 0.0
+        # Reader side: the log being tailed (read with pread, so a descriptor inherited
+        # across fork is safe), its generation and how far into it this process has read
+        self._fd = self._open()
+        # No log yet: the first one is generation 0
+        self._gen = self._generation(self._fd) if self._fd is not None else -1
+        self._offset = os.fstat(self._fd).st_size if self._fd is not None else 0
+        self.rotations = 0
+        self.resyncs = 0
+
+    def _open(self) -> Optional[int]:
+        try:
+            return os.open(self.path, os.O_RDONLY)
+        except OSError:
+            return None
+
+    def _inode(self) -> Optional[int]:
+        try:
+            return os.stat(self.path).st_ino
+        except OSError:
+            return None
+
+    @staticmethod
+    def _generation(fd: int) -> int:
+        head = os.pread(fd, 64, 0).split(b"\n", 1)[0]
+        try:
+            return int(json.loads(head).get("gen", 0))
+        except (ValueError, AttributeError):
+            return 0  # The first log, created without a header
+
+    def register(self, cache: "LocalCache"):
+        self._caches[cache.name] = cache
+
+    def caches(self) -> list:
+        return list(self._caches.values())
+
+    def reset(self):
+        """Truncate the log. Called once by the master process before workers fork."""
+        with open(self.path, "w"):
+            pass
+        with self._lock:
+            if self._fd is None:
+                self._fd = self._open()
+            self._gen = 0
+            self._offset = 0
+
+    def _rotate(self, fd: int):
+        """Swap in an empty log of the next generation, unless another process already rotated this one."""
+        try:
+            import fcntl
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except (ImportError, OSError):
+            pass  # No flock: a simultaneous second rotation shows up as a skipped generation
+        if self._inode() != os.fstat(fd).st_ino:
+            return
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix=".bus-")
+        try:
+            try:
+                os.write(tmp_fd, (json.dumps({"gen": self._generation(fd) + 1}) + "\n").encode("utf-8"))
+            finally:
+                os.close(tmp_fd)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+
+    def publish(self, namespace: str, key: Optional[Hashable] = None):
+        """Append an invalidation record. key=None clears the whole namespace."""
+        line = (json.dumps({"pid": os.getpid(), "ns": namespace, "key": key}) + "\n").encode("utf-8")
+        while True:
+            # O_APPEND writes smaller than PIPE_BUF are atomic, so concurrent workers never interleave.
+            fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+                written = os.fstat(fd)
+                if written.st_size > self.max_bytes:
+                    self._rotate(fd)
+            finally:
+                os.close(fd)
+            if self._inode() in (written.st_ino, None) or written.st_size > self.max_bytes:
+                return
+            # Rotated between open and write: readers may already have left that file
+
+    def _read(self) -> bytes:
+        """Complete records appended since the last read, following the log across rotations."""
+        chunks = []
+        while True:
+            if self._fd is None:
+                self._fd = self._open()
+                if self._fd is None:
+                    break
+                gen = self._generation(self._fd)
+                if gen != self._gen + 1:
+                    self._resync()
+                self._gen = gen
+                self._offset = 0
+            # Looked up before reading: a record that is in neither this read nor the new
+            # log can only have been written after the swap, and its publisher republishes it
+            current = self._inode()
+            stat = os.fstat(self._fd)
+            if stat.st_size < self._offset:
+                # Truncated by reset(); start over from the top
+                self._offset = 0
+            if stat.st_size > self._offset:
+                data = os.pread(self._fd, stat.st_size - self._offset, self._offset)
+                # Only consume complete lines; a partial trailing line is picked up next time.
+                end = data.rfind(b"\n") + 1
+                chunks.append(data[:end])
+                self._offset += end
+            if current in (stat.st_ino, None):
+                break
+            # Rotated, and the old file is drained: continue with the new one
+            os.close(self._fd)
+            self._fd = None
+            self.rotations += 1
+        return b"".join(chunks)
+
+    def _resync(self):
+        """Invalidations were lost: drop every cached entry (or its equivalent)."""
+        self.resyncs += 1
+        for cache in self._caches.values():
+            resync = getattr(cache, "resync", None)
+            if resync is not None:
+                resync()
+            else:
+                cache.clear(broadcast=False)
+
+    def poll(self, force: bool = False):
+        """Apply invalidations written by other processes since the last poll."""
+        now = time.monotonic()
+        if not force and now < self._next_poll:
+            return
+        self._next_poll = now + self.poll_interval
+
+        with self._lock:
+            try:
+                data = self._read()
+            except OSError:
+                return
+        if not data:
+            return
+
+        pid = os.getpid()
+        for raw in data.splitlines():
+            try:
+                record = json.loads(raw)
+            except ValueError:
+                continue
+            if record.get("pid") == pid:
+                continue
+            cache = self._caches.get(record.get("ns"))
+            if cache is None:
+                continue
+            if record.get("key") is None:
+                cache.clear(broadcast=False)
+            else:
+                cache.invalidate(_decode_key(record["key"]), broadcast=False)
+
+
+bus = InvalidationBus()
+
+
+class LocalCache:
+    """
+    Small thread-safe LRU cache with optional TTL and cross-process invalidation.
+    Caches given a `codec` are saved across restarts by snapshot.py; their restored entries
+    stay encoded until first read. With `maxbytes`, entries are also evicted to keep the
+    total of sizeof(value) within it (set() the value again after it grows in place).
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: Optional[float] = None, codec=None,
+                 maxbytes: Optional[int] = None, sizeof: Optional[Callable[[Any], int]] = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.codec = codec
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self._data = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._bytes = 0
+        self._restored: Dict[Hashable, Any] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.restored = 0
+        bus.register(self)
+
+    def _store(self, key: Hashable, value: Any, expires_at: Optional[float]):
+        """Insert or replace an entry as most recently used, then evict. Called with the lock held."""
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        if self.maxbytes is not None:
+            size = self.sizeof(value)
+            self._bytes += size - self._sizes.get(key, 0)
+            self._sizes[key] = size
+        while self._data and (
+            len(self._data) > self.maxsize or (self.maxbytes is not None and self._bytes > self.maxbytes)
+        ):
+            self._drop(next(iter(self._data)))
+
+    def _drop(self, key: Hashable):
+        """Remove an entry if present. Called with the lock held."""
+        self._data.pop(key, None)
+        self._bytes -= self._sizes.pop(key, 0)
+
+    def _take_restored(self, key: Hashable) -> Any:
+        """Decode a snapshot entry into the cache on its first read. Called with the lock held."""
+        raw = self._restored.pop(key, None)
+        if raw is None:
+            return _MISSING
+        try:
+            value = self.codec.decode(raw)
+        except Exception as e:
+            print(f"Dropping unreadable {self.name} snapshot entry {key!r}: {e}")
+            return _MISSING
+        self._store(key, value, None)
+        self.restored += 1
+        return value, None
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        bus.poll()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING and self._restored:
+                entry = self._take_restored(key)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                self._drop(key)
+                self.misses += 1
+                return default
+            if key in self._data:  # Not if it alone is larger than maxbytes: served once, not kept
+                self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._restored.pop(key, None)
+            self._store(key, value, expires_at)
+
+    def invalidate(self, key: Hashable, broadcast: bool = True):
+        with self._lock:
+            self._drop(key)
+            self._restored.pop(key, None)
+        if broadcast:
+            bus.publish(self.name, key)
+
+    def clear(self, broadcast: bool = True):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self._bytes = 0
+            self._restored.clear()
+        if broadcast:
+            bus.publish(self.name)
+
+    def restore(self, entries: Dict[Hashable, Any]):
+        """Adopt encoded entries from a snapshot; later snapshots passed in override earlier ones."""
+        with self._lock:
+            for key, raw in entries.items():
+                if key not in self._data:
+                    self._restored[key] = raw
+            # Never keep more than the cache could hold
+            while len(self._restored) > self.maxsize:
+                self._restored.pop(next(iter(self._restored)))
+
+    def snapshot_entries(self) -> List[Tuple[Hashable, bytes]]:
+        """Encoded entries, least recently used first; restored entries never read are carried over as-is."""
+        now = time.monotonic()
+        with self._lock:
+            pending = [(key, bytes(raw)) for key, raw in self._restored.items()]
+            live = [(key, value) for key, (value, expires_at) in self._data.items()
+                    if expires_at is None or expires_at >= now]
+        # Encode outside the lock: memory matrices can be large
+        return pending + [(key, self.codec.encode(value)) for key, value in live]
+
+    def stats(self) -> dict:
+        stats = {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "restored": self.restored,
+            "pending_restore": len(self._restored),
+        }
+        if self.maxbytes is not None:
+            stats["bytes"] = self._bytes
+        return stats
@@ -0,0 +1,111 @@
+# concurrency.py
+# Adaptive in-flight limit for chat turns. Provider latency swings too much for a fixed worker
+# count: the limit follows observed turn latency instead (the "gradient" algorithm from
+# Netflix's concurrency-limits). The baseline is the lowest recent latency, what a turn costs
+# without queueing. While current latency stays within CHAT_LIMIT_TOLERANCE of it the limit
+# grows by about sqrt(limit) per adjustment; above that it shrinks in proportion; failed turns
+# cut it by CHAT_LIMIT_BACKOFF. Only samples taken with at least half the limit in use adjust
+# it, so a quiet period never shrinks the limit for the next burst. Turns over the limit are
+# refused at once so callers can retry elsewhere instead of queueing until they time out.
+# The limit is per worker process.
+import math
+import os
+import threading
+from typing import Optional
+
+CHAT_LIMIT_INITIAL = int(os.getenv("CHAT_LIMIT_INITIAL", "20"))
+CHAT_LIMIT_MIN = int(os.getenv("CHAT_LIMIT_MIN", "2"))
+CHAT_LIMIT_MAX = int(os.getenv("CHAT_LIMIT_MAX", "200"))
+# Recent latency may exceed the baseline by this factor before the limit starts shrinking
+CHAT_LIMIT_TOLERANCE = float(os.getenv("CHAT_LIMIT_TOLERANCE", "1.5"))
+# How far each sample moves the limit towards its new estimate (0..1)
+CHAT_LIMIT_SMOOTHING = float(os.getenv("CHAT_LIMIT_SMOOTHING", "0.2"))
+# Multiplicative decrease after a failed turn
+CHAT_LIMIT_BACKOFF = float(os.getenv("CHAT_LIMIT_BACKOFF", "0.9"))
+# Samples averaged into the current latency
+SHORT_WINDOW = 10
+# The baseline restarts from the current latency this often (in samples), so it can follow
+# the provider getting slower for good
+BASELINE_WINDOW = 500
+RETRY_AFTER_MAX_SECONDS = 30
+
+
+class AdaptiveLimiter:
+    """Gradient concurrency limit: acquire() before a turn, release() with its latency after."""
+
+    def __init__(self, initial: int = CHAT_LIMIT_INITIAL, minimum: int = CHAT_LIMIT_MIN,
+                 maximum: int = CHAT_LIMIT_MAX, tolerance: float = CHAT_LIMIT_TOLERANCE,
+                 smoothing: float = CHAT_LIMIT_SMOOTHING, backoff: float = CHAT_LIMIT_BACKOFF):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.backoff = backoff
+        self.limit = float(initial)
+        self.in_flight = 0
+        self.short_rtt: Optional[float] = None
+        self.baseline_rtt: Optional[float] = None
+        self._baseline_samples = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        """Take a slot, or return False at once if the limit is reached."""
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            self.accepted += 1
+            return True
+
+    def release(self, latency: Optional[float], failed: bool = False):
+        """Give the slot back. `latency` in seconds, or None for turns that say nothing about load."""
+        with self._lock:
+            in_flight = self.in_flight
+            self.in_flight -= 1
+            if failed:
+                self.failed += 1
+                self.limit = max(self.minimum, self.limit * self.backoff)
+            elif latency is not None:
+                self._sample(latency, in_flight)
+
+    def _sample(self, latency: float, in_flight: int):
+        if self.short_rtt is None:
+            self.short_rtt = self.baseline_rtt = latency
+            return
+        self.short_rtt += (latency - self.short_rtt) / SHORT_WINDOW
+        self._baseline_samples += 1
+        if self._baseline_samples >= BASELINE_WINDOW:
+            self.baseline_rtt = self.short_rtt
+            self._baseline_samples = 0
+        else:
+            self.baseline_rtt = min(self.baseline_rtt, latency)
+
+        if in_flight < self.limit / 2:
+            # Mostly idle: latency then says nothing about the limit, in either direction.
+            # Fast samples don't show it could be higher, and slow ones are provider noise,
+            # not queueing (lowering on them would leave a small limit for the next burst).
+            return
+        gradient = max(0.5, min(1.0, self.tolerance * self.baseline_rtt / self.short_rtt))
+        estimate = self.limit * gradient + math.sqrt(self.limit)
+        limit = self.limit * (1 - self.smoothing) + estimate * self.smoothing
+        self.limit = max(self.minimum, min(self.maximum, limit))
+
+    def retry_after(self) -> int:
+        """Seconds a refused caller should wait: about one current turn latency."""
+        rtt = self.short_rtt or 1.0
+        return max(1, min(RETRY_AFTER_MAX_SECONDS, math.ceil(rtt)))
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "short_latency_ms": round(self.short_rtt * 1000) if self.short_rtt is not None else None,
+            "baseline_latency_ms": round(self.baseline_rtt * 1000) if self.baseline_rtt is not None else None,
+        }
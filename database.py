@@ -1,30 +1,280 @@
 # database.py
+import itertools
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import threading
+import time
+from typing import Optional
+
+from fastapi import Request
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import NullPool
+
+from cache import bus
+from sharding import ShardRouter
 
 # Read the DATABASE_URL from environment variable or default to SQLite
 # NOTE: The default SQLite URL will only work in a local environment!
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./zena.db")
 
-# Create the SQLAlchemy engine
-if DATABASE_URL.startswith("sqlite"):
-    # This block is for local development only
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-else:
+# "queue" keeps a connection pool per process; "null" opens a connection per session and
+# closes it afterwards, for short-lived serverless containers (put PgBouncer or the
+# provider's pooled endpoint in front of Postgres)
+DATABASE_POOL = os.getenv("DATABASE_POOL", "queue")
+
+# Optional read replicas, comma-separated. GET routes scoped to a user read from them.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# After a user's own write, their reads stay on the primary for this long (replica lag headroom)
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+# How often a replica in use is re-checked, and how long a failed one is skipped
+REPLICA_CHECK_INTERVAL_SECONDS = float(os.getenv("REPLICA_CHECK_INTERVAL_SECONDS", "10"))
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+
+# Optional extra shards, comma-separated; DATABASE_URL is always shard 0 (see sharding.py).
+# Append only: removing or reordering URLs strands the users mapped to them.
+DATABASE_SHARD_URLS = [url.strip() for url in os.getenv("DATABASE_SHARD_URLS", "").split(",") if url.strip()]
+
+
+def _make_engine(url: str, **kwargs):
+    if DATABASE_POOL == "null":
+        kwargs.setdefault("poolclass", NullPool)
+    if url.startswith("sqlite"):
+        # This block is for local development only
+        return create_engine(url, connect_args={"check_same_thread": False}, **kwargs)
     # This block will run on Vercel with a remote database URL
     # Use 'postgresql+psycopg2' for explicit driver
-    engine = create_engine(DATABASE_URL)
-    
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    return create_engine(url, **kwargs)
+
+
+# Create the SQLAlchemy engine
+engine = _make_engine(DATABASE_URL)
+
+router = ShardRouter([engine] + [_make_engine(url) for url in DATABASE_SHARD_URLS])
+
+if router.sharded:
+    SessionLocal = router.sessionmaker(autocommit=False, autoflush=False)
+else:
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Base class for model definitions
 Base = declarative_base()
 
-def get_db():
-    """Dependency to yield a new database session for each request."""
-    db = SessionLocal()
+def ensure_columns(engine, metadata):
+    """
+    Add columns that exist on the models but not yet in the database.
+    create_all() only creates missing tables, and we don't run a migration tool, so new
+    nullable columns on existing tables are added here with plain ALTER TABLE statements.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+
+
+def ensure_indexes(engine, metadata):
+    """
+    Create indexes that exist on the models but not yet in the database.
+    create_all() skips tables that already exist, so an index added to a model later
+    never reaches databases created before it.
+    """
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+class ReadOnlySession(Session):
+    """Session bound to a replica. Flushing is an error: writes must go to the primary."""
+
+    def flush(self, objects=None):
+        if self.new or self.dirty or self.deleted:
+            raise RuntimeError("Attempted to write through a read-only replica session.")
+        super().flush(objects)
+
+
+class ReplicaPool:
+    """Round-robin over the replicas, skipping ones that fail a health check."""
+
+    def __init__(self, urls):
+        self.urls = urls
+        self.engines = [_make_engine(url, pool_pre_ping=True) for url in urls]
+        self.sessionmakers = [
+            sessionmaker(autocommit=False, autoflush=False, bind=e, class_=ReadOnlySession)
+            for e in self.engines
+        ]
+        self._next = itertools.count()
+        self._checked_at = [0.0] * len(urls)
+        self._down_until = [0.0] * len(urls)
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.engines)
+
+    def _healthy(self, index: int) -> bool:
+        now = time.monotonic()
+        if self._down_until[index] > now:
+            return False
+        if now - self._checked_at[index] < REPLICA_CHECK_INTERVAL_SECONDS:
+            return True
+        try:
+            with self.engines[index].connect() as conn:
+                conn.execute(text("SELECT 1"))
+        except Exception as e:
+            print(f"Replica {index} failed health check: {e}")
+            self.mark_down(index)
+            return False
+        self._checked_at[index] = now
+        return True
+
+    def mark_down(self, index: int):
+        with self._lock:
+            self._down_until[index] = time.monotonic() + REPLICA_RETRY_SECONDS
+            self._checked_at[index] = 0.0
+
+    def session(self) -> Optional[Session]:
+        """A session on the next healthy replica, or None if none is available."""
+        for _ in range(len(self.engines)):
+            index = next(self._next) % len(self.engines)
+            if self._healthy(index):
+                db = self.sessionmakers[index]()
+                db.info["replica"] = index
+                return db
+        return None
+
+    def dispose(self, close: bool = True):
+        for e in self.engines:
+            e.dispose(close=close)
+
+    def stats(self) -> list:
+        now = time.monotonic()
+        return [{"replica": i, "healthy": self._down_until[i] <= now} for i in range(len(self.engines))]
+
+
+class RecentWriters:
+    """
+    Users who wrote within the last READ_YOUR_WRITES_SECONDS and must read from the primary.
+    Rides on the cache invalidation bus (a write "invalidates" the user's replica view),
+    so a write handled by one worker pins the user in every worker.
+    """
+
+    name = "recent-writers"
+
+    def __init__(self, window: float = READ_YOUR_WRITES_SECONDS):
+        self.window = window
+        self._until = {}
+        # Everyone is pinned until then, after the bus lost track of writes (see resync)
+        self._all_until = 0.0
+        self._lock = threading.Lock()
+        bus.register(self)
+
+    def invalidate(self, user_id: int, broadcast: bool = True):
+        with self._lock:
+            self._until[user_id] = time.monotonic() + self.window
+        if broadcast:
+            bus.publish(self.name, user_id)
+
+    def clear(self, broadcast: bool = True):
+        with self._lock:
+            self._until.clear()
+        if broadcast:
+            bus.publish(self.name)
+
+    def resync(self):
+        """Writes were missed on the bus: send every user's reads to the primary for one window."""
+        with self._lock:
+            self._all_until = time.monotonic() + self.window
+
+    def pinned(self, user_id: int) -> bool:
+        bus.poll()
+        now = time.monotonic()
+        with self._lock:
+            if self._all_until > now:
+                return True
+            until = self._until.get(user_id)
+            if until is None:
+                return False
+            if until < now:
+                del self._until[user_id]
+                return False
+            return True
+
+
+# Replicas mirror a single primary; with sharding each shard scales its own reads instead
+replicas = ReplicaPool([] if router.sharded else DATABASE_REPLICA_URLS)
+recent_writers = RecentWriters()
+
+
+def shard_bind(user_id: int) -> dict:
+    """bind_arguments routing a Core statement on SessionLocal to the user's shard ({} when unsharded)."""
+    return {"shard_id": router.shard_for(user_id)} if router.sharded else {}
+
+
+def note_write(db: Session, user_id: int):
+    """
+    Record that this transaction writes data belonging to user_id. ORM rows with a user_id
+    column are picked up automatically; call this for Core inserts and for new users.
+    """
+    db.info.setdefault("written_users", set()).add(user_id)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_written_users(session, flush_context):
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        user_id = getattr(obj, "user_id", None)
+        if user_id is not None:
+            note_write(session, user_id)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _pin_written_users(session):
+    written = session.info.pop("written_users", None)
+    if written and replicas:
+        for user_id in written:
+            recent_writers.invalidate(user_id)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _forget_written_users(session):
+    session.info.pop("written_users", None)
+
+
+def read_session(user_id: Optional[int] = None) -> Session:
+    """
+    A session for read-only work: a healthy replica when one is configured and the user
+    has not written recently, the primary otherwise.
+    """
+    if replicas and (user_id is None or not recent_writers.pinned(user_id)):
+        db = replicas.session()
+        if db is not None:
+            return db
+    return SessionLocal()
+
+
+def get_db(request: Request):
+    """
+    Dependency to yield a new database session for each request.
+    GET routes with a {user_id} path parameter read from a replica (see read_session);
+    everything else, including unscoped GETs like job polling, uses the primary.
+    """
+    user_id = request.path_params.get("user_id")
+    if replicas and request.method == "GET" and str(user_id).isdigit():
+        db = read_session(int(user_id))
+    else:
+        db = SessionLocal()
     try:
         yield db
+    except OperationalError:
+        # Connection-level failure on a replica: take it out of rotation for a while
+        if "replica" in db.info:
+            replicas.mark_down(db.info["replica"])
+        raise
     finally:
         db.close()
\ No newline at end of file
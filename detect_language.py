@@ -1,9 +1,37 @@
 import re
-from langdetect import detect, DetectorFactory
+from typing import Optional, Tuple
+from langdetect import detect, detect_langs, DetectorFactory
 
 # Set seed for consistent results
 DetectorFactory.seed = 0
 
+TELUGU_RE = re.compile(r'[\u0C00-\u0C7F]')
+DEVANAGARI_RE = re.compile(r'[\u0900-\u097F]')
+ENGLISH_RE = re.compile(r'^[a-zA-Z0-9\s\.,!?;:\'\"-]+$')
+LATIN_RE = re.compile(r'[a-zA-Z]')
+WORD_RE = re.compile(r"[a-z']+")
+
+# Frequent words that give away romanized Telugu / Hindi without running langdetect
+ROMAN_TELUGU_WORDS = frozenset(
+    "ela unnav unnavu unnaru nenu nuvvu meeru enti emi cheppu chey chesav ledu undi avunu "
+    "kadu baagunnava bagunnava entha ekkada eppudu enduku manchidi".split()
+)
+ROMAN_HINDI_WORDS = frozenset(
+    "kya hai hain hal kaise kaisa mera meri tum tera aap nahi nahin haan acha accha kyun "
+    "kab kahan bahut thik theek karo raha rahi".split()
+)
+
+
+def warm_up():
+    """
+    Load langdetect's language profiles eagerly.
+    langdetect reads ~55 JSON profiles on the first detect() call; doing it at import time
+    lets a preforking server share those pages with every worker instead of each one loading them.
+    """
+    from langdetect.detector_factory import init_factory
+    init_factory()
+
+
 def detect_script(text: str):
     """
     Enhanced language/script detection combining langdetect and script analysis
@@ -12,15 +40,15 @@ def detect_script(text: str):
         return "unknown"
     
     # Check for Telugu script (Unicode range U+0C00 to U+0C7F)
-    if re.search(r'[\u0C00-\u0C7F]', text):
+    if TELUGU_RE.search(text):
         return "telugu_native"
     
     # Check for Devanagari (Hindi) script (Unicode range U+0900 to U+097F)
-    if re.search(r'[\u0900-\u097F]', text):
+    if DEVANAGARI_RE.search(text):
         return "hindi_native"
     
     # Check if it's mostly English (letters, numbers, common punctuation)
-    if re.match(r'^[a-zA-Z0-9\s\.,!?;:\'\"-]+$', text.strip()):
+    if ENGLISH_RE.match(text.strip()):
         return "english"
     
     try:
@@ -38,6 +66,43 @@ def detect_script(text: str):
         
     except Exception:
         # If detection fails, assume English if it has Latin characters
-        if re.search(r'[a-zA-Z]', text):
+        if LATIN_RE.search(text):
             return "english"
-        return "unknown"
\ No newline at end of file
+        return "unknown"
+
+
+def scan_script(text: str) -> Optional[str]:
+    """
+    Cheap pass: Unicode ranges plus a few common romanized words.
+    Returns None when it cannot tell; detect_with_confidence() is the expensive fallback.
+    """
+    if TELUGU_RE.search(text):
+        return "telugu_native"
+    if DEVANAGARI_RE.search(text):
+        return "hindi_native"
+    words = WORD_RE.findall(text.lower())
+    telugu = sum(word in ROMAN_TELUGU_WORDS for word in words)
+    hindi = sum(word in ROMAN_HINDI_WORDS for word in words)
+    if telugu > hindi:
+        return "telugu_roman"
+    if hindi > telugu:
+        return "hindi_roman"
+    if words and ENGLISH_RE.match(text.strip()):
+        return "english"
+    return None
+
+
+def detect_with_confidence(text: str) -> Tuple[str, float]:
+    """Full detection with langdetect's probability for the winning language."""
+    if TELUGU_RE.search(text):
+        return "telugu_native", 1.0
+    if DEVANAGARI_RE.search(text):
+        return "hindi_native", 1.0
+    try:
+        best = detect_langs(text)[0]
+    except Exception:
+        if LATIN_RE.search(text):
+            return "english", 0.5
+        return "unknown", 0.0
+    script = {"hi": "hindi_roman", "te": "telugu_roman", "en": "english"}.get(best.lang, best.lang)
+    return script, best.prob
@@ -0,0 +1,73 @@
+# export.py
+# Streams a user's full history (archive + hot table) as NDJSON with constant memory.
+import json
+import zlib
+from typing import Iterator
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from archive import iter_archived
+from models import Message
+
+EXPORT_BATCH_ROWS = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+def iter_user_messages(db: Session, user_id: int) -> Iterator[dict]:
+    """Every message of a user, oldest first: archived segments, then the hot table."""
+    yield from iter_archived(db, user_id)
+
+    # Column-only select with yield_per: server-side cursor on Postgres, batched fetch on SQLite
+    stmt = (
+        select(Message.id, Message.sender, Message.content, Message.image_url, Message.timestamp)
+        .where(Message.user_id == user_id)
+        .order_by(Message.id.asc())
+        .execution_options(yield_per=EXPORT_BATCH_ROWS)
+    )
+    for msg_id, sender, content, image_url, timestamp in db.execute(stmt):
+        yield {
+            "id": msg_id,
+            "sender": sender,
+            "content": content,
+            "image_url": image_url,
+            "timestamp": timestamp.isoformat() if timestamp else None,
+        }
+
+
+def ndjson_stream(session_factory, user_id: int, compress: bool = False) -> Iterator[bytes]:
+    """
+    Yield the export in ~64 KB chunks (gzip-compressed on the fly if `compress`).
+    The first line is flushed on its own so clients see bytes right away.
+    Owns its session because it keeps running after the route handler has returned.
+    """
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def emit(data: bytes, flush: bool = False) -> bytes:
+        if gz is None:
+            return data
+        out = gz.compress(data)
+        if flush:
+            out += gz.flush(zlib.Z_SYNC_FLUSH)
+        return out
+
+    db = session_factory()
+    try:
+        buffer = bytearray()
+        first = True
+        for row in iter_user_messages(db, user_id):
+            buffer += json.dumps(row, ensure_ascii=False).encode("utf-8")
+            buffer += b"\n"
+            if first or len(buffer) >= EXPORT_CHUNK_BYTES:
+                chunk = emit(bytes(buffer), flush=first)
+                buffer.clear()
+                first = False
+                if chunk:
+                    yield chunk
+        tail = emit(bytes(buffer))
+        if gz is not None:
+            tail += gz.flush()
+        if tail:
+            yield tail
+    finally:
+        db.close()
@@ -0,0 +1,38 @@
+# gunicorn_conf.py
+# Multi-process serving: gunicorn master preloads main.app, then forks uvicorn workers.
+#
+#   gunicorn -c gunicorn_conf.py main:app
+#
+# Preloading means SDK imports, the compiled language instructions and langdetect's profiles are
+# loaded once in the master and shared copy-on-write by every worker.
+import gc
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+
+def on_starting(server):
+    # Start every deploy with an empty invalidation log; there is nothing cached yet to invalidate.
+    from cache import bus
+    bus.reset()
+
+
+def when_ready(server):
+    # Move everything the preloaded app allocated into the permanent generation so the
+    # workers' garbage collector never touches (and un-shares) those pages.
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Connections opened in the master (create_all) must not be shared with the children.
+    from database import replicas, router
+    router.dispose(close=False)
+    replicas.dispose(close=False)
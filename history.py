@@ -0,0 +1,39 @@
+# history.py
+# Lean read path for chat history: column-only Core selects, rows as plain tuples,
+# no ORM objects or identity-map bookkeeping. Serialize the result with fast_json.dumps.
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from archive import load_archived
+from database import shard_bind
+from models import Message
+
+HISTORY_FIELDS = ("id", "sender", "content", "image_url", "timestamp")
+HISTORY_COLUMNS = (Message.id, Message.sender, Message.content, Message.image_url, Message.timestamp)
+
+
+def history_page(db: Session, user_id: int, limit: int, before_id: Optional[int] = None) -> Tuple[List[dict], bool]:
+    """
+    The newest `limit` messages before `before_id` (oldest first), completed from the archive
+    when the hot table runs out, and whether older messages exist.
+    Timestamps stay datetime objects; fast_json formats them while encoding.
+    """
+    # Fetch one extra row to know whether there is another page
+    wanted = limit + 1
+    stmt = select(*HISTORY_COLUMNS).where(Message.user_id == user_id)
+    if before_id is not None:
+        stmt = stmt.where(Message.id < before_id)
+    stmt = stmt.order_by(Message.id.desc()).limit(wanted)
+    rows = db.connection(bind_arguments=shard_bind(user_id)).execute(stmt).all()
+
+    messages = [dict(zip(HISTORY_FIELDS, row)) for row in reversed(rows)]
+    if len(messages) < wanted:
+        oldest_id = messages[0]["id"] if messages else before_id
+        messages = load_archived(db, user_id, oldest_id, wanted - len(messages)) + messages
+
+    has_more = len(messages) > limit
+    if has_more:
+        messages = messages[1:]
+    return messages, has_more
@@ -0,0 +1,127 @@
+# idempotency.py
+# Idempotency-Key support for /chat/: a retried turn attaches to the attempt still running
+# or gets the stored reply back, instead of paying for a second generation.
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import IdempotencyKey
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# How long a retry waits for an attempt running in another worker before giving up with 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "60"))
+IDEMPOTENCY_POLL_SECONDS = 0.5
+IDEMPOTENCY_PURGE_INTERVAL_SECONDS = 3600
+
+
+class IdempotencyStore:
+    """Tracks keyed /chat/ attempts in the database, plus in-process futures for attempts running here."""
+
+    def __init__(self):
+        self._local = {}
+
+    async def begin(self, db: Session, user_id: int, key: str) -> Optional[str]:
+        """
+        Claim `key` for a new attempt and return None, or return the reply of the attempt
+        that already used it (waiting for it to finish if it is still running).
+        """
+        while True:
+            now = datetime.utcnow()
+            db.add(IdempotencyKey(
+                user_id=user_id,
+                key=key,
+                status="pending",
+                created_at=now,
+                expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+            ))
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+            else:
+                self._local[(user_id, key)] = asyncio.get_running_loop().create_future()
+                return None
+
+            # Someone already holds the key
+            row = db.get(IdempotencyKey, (user_id, key))
+            if row is None:
+                continue
+            if row.expires_at < now:
+                db.delete(row)
+                db.commit()
+                continue
+            if row.status == "done":
+                return row.reply
+            return await self._wait(db, user_id, key)
+
+    async def _wait(self, db: Session, user_id: int, key: str) -> str:
+        local = self._local.get((user_id, key))
+        if local is not None:
+            # The first attempt runs in this process: share its result directly
+            return await asyncio.shield(local)
+
+        # Running in another worker: poll the row until it finishes or disappears
+        deadline = asyncio.get_running_loop().time() + IDEMPOTENCY_WAIT_SECONDS
+        while asyncio.get_running_loop().time() < deadline:
+            # End the read transaction so no pooled connection is held while we sleep
+            db.rollback()
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+            row = db.get(IdempotencyKey, (user_id, key))
+            if row is None:
+                raise HTTPException(status_code=409, detail="The original request failed; retry with a new key.")
+            if row.status == "done":
+                return row.reply
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress.")
+
+    def complete(self, db: Session, user_id: int, key: str, reply: str, ai_message_id: Optional[int] = None):
+        """Store the finished reply and wake up any retries waiting on it."""
+        db.query(IdempotencyKey).filter(
+            IdempotencyKey.user_id == user_id, IdempotencyKey.key == key
+        ).update({"status": "done", "reply": reply, "ai_message_id": ai_message_id}, synchronize_session=False)
+        db.commit()
+        future = self._local.pop((user_id, key), None)
+        if future is not None and not future.done():
+            future.set_result(reply)
+
+    def abandon(self, db: Session, user_id: int, key: str):
+        """The attempt failed: release the key so a retry can run for real."""
+        db.rollback()
+        db.query(IdempotencyKey).filter(
+            IdempotencyKey.user_id == user_id, IdempotencyKey.key == key
+        ).delete(synchronize_session=False)
+        db.commit()
+        future = self._local.pop((user_id, key), None)
+        if future is not None and not future.done():
+            future.set_exception(HTTPException(status_code=409, detail="The original request failed; retry with a new key."))
+            # Nobody may be waiting; don't warn about an unretrieved exception
+            future.exception()
+
+
+def purge_expired(db: Session) -> int:
+    deleted = db.query(IdempotencyKey).filter(
+        IdempotencyKey.expires_at < datetime.utcnow()
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+async def purge_loop(session_factory, interval: int = IDEMPOTENCY_PURGE_INTERVAL_SECONDS):
+    """Background task: drop expired keys every `interval` seconds (uses the expires_at index)."""
+    def run_once():
+        db = session_factory()
+        try:
+            return purge_expired(db)
+        finally:
+            db.close()
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(run_once)
+        except Exception as e:
+            print(f"Idempotency purge error: {e}")
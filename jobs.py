@@ -0,0 +1,167 @@
+# jobs.py
+# Opt-in background job mode for slow chat turns (images, video). The HTTP request only
+# records the job; a local thread pool runs it, and clients poll GET /chat/jobs/{id}.
+# Jobs live in the chat_jobs table, so queued or interrupted work survives a restart.
+import asyncio
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy.orm import Session
+
+from models import ChatJob, Message
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# A "running" job not touched for this long belongs to a dead worker and is requeued
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "600"))
+JOB_SWEEP_INTERVAL_SECONDS = int(os.getenv("JOB_SWEEP_INTERVAL_SECONDS", "30"))
+JOB_POLL_SECONDS = 0.5
+
+TERMINAL_STATUSES = ("done", "failed")
+
+
+def job_to_dict(job: ChatJob) -> dict:
+    return {
+        "id": job.id,
+        "user_id": job.user_id,
+        "status": job.status,
+        "reply": job.reply,
+        "message_id": job.ai_message_id,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+    }
+
+
+class JobRunner:
+    """Runs queued ChatJobs on a local thread pool."""
+
+    def __init__(
+        self,
+        session_factory,
+        run_turn: Callable[[Session, ChatJob], Message],
+        after_turn: Optional[Callable[[int], None]] = None,
+        workers: int = JOB_WORKERS,
+    ):
+        self.session_factory = session_factory
+        self.run_turn = run_turn
+        self.after_turn = after_turn
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-job")
+        self._submitted = set()
+        self._lock = threading.Lock()
+
+    def _submit(self, job_id: str):
+        # The periodic sweep sees jobs that are already waiting in our pool; don't queue them twice
+        with self._lock:
+            if job_id in self._submitted:
+                return
+            self._submitted.add(job_id)
+        self.executor.submit(self._run, job_id)
+
+    def create(self, db: Session, user_id: int, message: str, personality: str,
+               image_path: Optional[str] = None, image_url: Optional[str] = None) -> ChatJob:
+        """Persist a new job and hand it to the pool."""
+        job = ChatJob(
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            status="queued",
+            message=message,
+            personality=personality,
+            image_path=image_path,
+            image_url=image_url,
+            attempts=0,
+        )
+        db.add(job)
+        db.commit()
+        self._submit(job.id)
+        return job
+
+    def _claim(self, db: Session, job_id: str) -> Optional[ChatJob]:
+        """queued -> running, atomically, so two workers never run the same job."""
+        claimed = (
+            db.query(ChatJob)
+            .filter(ChatJob.id == job_id, ChatJob.status == "queued")
+            .update(
+                {"status": "running", "attempts": ChatJob.attempts + 1, "updated_at": datetime.utcnow()},
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        return db.get(ChatJob, job_id) if claimed else None
+
+    def _run(self, job_id: str):
+        with self._lock:
+            self._submitted.discard(job_id)
+        db = self.session_factory()
+        try:
+            job = self._claim(db, job_id)
+            if job is None:
+                return
+            try:
+                ai_message = self.run_turn(db, job)
+            except Exception as e:
+                print(f"Chat job {job_id} failed: {e}")
+                db.rollback()
+                retry = job.attempts < JOB_MAX_ATTEMPTS
+                job.status = "queued" if retry else "failed"
+                job.error = None if retry else str(e)
+                job.updated_at = datetime.utcnow()
+                db.commit()
+                if retry:
+                    self._submit(job_id)
+                return
+
+            job.status = "done"
+            job.reply = ai_message.content
+            job.ai_message_id = ai_message.id
+            job.updated_at = datetime.utcnow()
+            db.commit()
+            if self.after_turn:
+                self.after_turn(job.user_id)
+        finally:
+            db.close()
+
+    def recover(self) -> int:
+        """Requeue jobs abandoned by a dead worker and (re)submit everything queued."""
+        db = self.session_factory()
+        try:
+            stale_before = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+            db.query(ChatJob).filter(
+                ChatJob.status == "running", ChatJob.updated_at < stale_before
+            ).update({"status": "queued", "updated_at": datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+            queued = [job_id for (job_id,) in db.query(ChatJob.id).filter(ChatJob.status == "queued").all()]
+        finally:
+            db.close()
+        for job_id in queued:
+            self._submit(job_id)
+        return len(queued)
+
+    async def sweep_loop(self, interval: int = JOB_SWEEP_INTERVAL_SECONDS):
+        """Background task: recover at startup, then periodically."""
+        while True:
+            try:
+                await asyncio.to_thread(self.recover)
+            except Exception as e:
+                print(f"Job recovery error: {e}")
+            await asyncio.sleep(interval)
+
+    async def wait(self, db: Session, job_id: str, timeout: float) -> Optional[ChatJob]:
+        """Long-poll: return the job once it is done/failed, or as it is after `timeout` seconds."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            job = db.get(ChatJob, job_id)
+            if job is None or job.status in TERMINAL_STATUSES or loop.time() >= deadline:
+                return job
+            # End the read transaction so no pooled connection is held while we sleep
+            db.rollback()
+            await asyncio.sleep(JOB_POLL_SECONDS)
+
+    def shutdown(self):
+        # Running jobs finish; anything still queued is picked up again after restart
+        self.executor.shutdown(wait=True, cancel_futures=True)
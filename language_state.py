@@ -0,0 +1,123 @@
+# language_state.py
+# Sticky per-user reply language. Users rarely switch language mid-conversation, so instead of
+# classifying every message from scratch we keep a confidence-weighted moving estimate per
+# user. The cheap script scan confirms the current language; langdetect only runs when the
+# scan is inconclusive or disagrees. Short messages ("ok", "haha") carry little weight, so
+# they no longer flip the reply language.
+import json
+import os
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from cache import LocalCache
+from detect_language import detect_with_confidence, scan_script
+from models import User
+from snapshot import JsonCodec
+
+# How far one long, confidently classified message moves the estimate (0..1)
+LANGUAGE_ALPHA = float(os.getenv("LANGUAGE_ALPHA", "0.6"))
+# A challenger must lead the current language by this much before replies switch
+LANGUAGE_SWITCH_MARGIN = float(os.getenv("LANGUAGE_SWITCH_MARGIN", "0.1"))
+# Messages with at least this many words count fully; shorter ones proportionally less
+LANGUAGE_FULL_WEIGHT_WORDS = 6
+MIN_SCORE = 0.01
+
+
+class LanguageState:
+    """Moving estimate of one user's language: scores per script plus the sticky winner."""
+
+    __slots__ = ("script", "scores")
+
+    def __init__(self, script: Optional[str] = None, scores: Optional[dict] = None):
+        self.script = script
+        self.scores = dict(scores or {})
+
+    def observe(self, text: str) -> Optional[str]:
+        """Fold one message into the estimate and return the language to reply in."""
+        words = len(text.split())
+        if not words:
+            return self.script
+
+        cheap = scan_script(text)
+        if cheap is not None and cheap == self.script:
+            observed, confidence = cheap, 1.0
+        else:
+            observed, confidence = detect_with_confidence(text)
+        if observed == "unknown":
+            return self.script
+
+        weight = LANGUAGE_ALPHA * confidence * min(1.0, words / LANGUAGE_FULL_WEIGHT_WORDS)
+        for script in list(self.scores):
+            self.scores[script] *= 1 - weight
+            if self.scores[script] < MIN_SCORE:
+                del self.scores[script]
+        self.scores[observed] = self.scores.get(observed, 0.0) + weight
+
+        best = max(self.scores, key=self.scores.get)
+        if self.script is None or (
+            best != self.script and self.scores[best] > self.scores.get(self.script, 0.0) + LANGUAGE_SWITCH_MARGIN
+        ):
+            self.script = best
+        return self.script
+
+    def dumps(self) -> str:
+        return json.dumps({script: round(score, 4) for script, score in self.scores.items()})
+
+
+class LanguageStateCodec(JsonCodec):
+    """Snapshot codec for LanguageState: [script, scores]."""
+
+    def __init__(self):
+        super().__init__("1")
+
+    def encode(self, state: LanguageState) -> bytes:
+        return super().encode([state.script, state.scores])
+
+    def decode(self, raw) -> LanguageState:
+        script, scores = super().decode(raw)
+        return LanguageState(script, scores)
+
+
+class LanguageTracker:
+    """LanguageState per user, cached in memory and persisted on the User row."""
+
+    def __init__(self, maxsize: int = 10000):
+        self.cache = LocalCache("languages", maxsize, codec=LanguageStateCodec())
+
+    def _load(self, db: Session, user_id: int) -> LanguageState:
+        row = db.query(User.language, User.language_scores).filter(User.id == user_id).first()
+        if row is None or row.language is None:
+            return LanguageState()
+        try:
+            scores = json.loads(row.language_scores or "{}")
+        except ValueError:
+            scores = {}
+        return LanguageState(row.language, scores)
+
+    def observe(self, db: Session, user_id: int, text: str) -> Optional[str]:
+        """
+        Update the user's language with a new message and return it. The row update joins
+        the caller's transaction (committed with the message itself).
+        """
+        state = self.cache.get(user_id)
+        if state is None:
+            state = self._load(db, user_id)
+        script = state.observe(text)
+        db.query(User).filter(User.id == user_id).update(
+            {"language": state.script, "language_scores": state.dumps()}, synchronize_session=False
+        )
+        # Other workers reload from the row on their next message for this user
+        self.cache.invalidate(user_id)
+        self.cache.set(user_id, state)
+        return script
+
+    def current(self, db: Session, user_id: int) -> Optional[str]:
+        """The user's language as last observed, without folding in a new message."""
+        state = self.cache.get(user_id)
+        if state is None:
+            state = self._load(db, user_id)
+        return state.script
+
+    def stats(self) -> dict:
+        return self.cache.stats()
@@ -3,35 +3,112 @@ load_dotenv()
 
 import sys
 import os
-import shutil
+import asyncio
+import io
+import json
+import time
+from contextlib import asynccontextmanager
+from functools import partial
 from pathlib import Path
 
 # Use __file__ to get the current script's directory
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from ai_core import AIPersonality
-from database import get_db, engine
-from models import Base, User, Message
-
-from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Form
+from ai_core import (
+    GEMINI_ERROR_REPLY,
+    OPENAI_ERROR_REPLY,
+    PROVIDER_WARMUP_INTERVAL_SECONDS,
+    VISION_IMAGE_QUALITY,
+    VISION_MAX_IMAGE_SIDE,
+    AIPersonality,
+    prompt_cache,
+    reply_cache,
+)
+import fast_json
+from archive import ARCHIVE_INTERVAL_SECONDS, archive_loop
+from batch import BATCH_MAX_ITEMS, run_batch
+from cache import LocalCache
+from concurrency import AdaptiveLimiter
+from database import (
+    get_db, SessionLocal, ensure_columns, ensure_indexes, note_write, read_session, replicas, router,
+)
+from detect_language import warm_up as warm_up_language_detection
+from export import ndjson_stream
+from history import history_page
+from jobs import JobRunner, job_to_dict
+from language_state import LanguageTracker
+from memory import MemoryIndex
+from idempotency import IdempotencyStore, purge_loop as idempotency_purge_loop
+from models import Base, User, Message, ChatJob
+from summarizer import RECENT_TURNS, SUMMARY_EVERY, ConversationSummarizer, load_recent_messages, load_recent_turns
+from tokens import HISTORY_TOKEN_BUDGET, MAX_INPUT_TOKENS, count_tokens, fit_history
+from snapshot import CACHE_SNAPSHOT_INTERVAL_SECONDS, CacheSnapshots, JsonCodec
+from storage import get_storage
+from uploads import UploadStore
+import usage
+
+from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Form, Header, BackgroundTasks, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse, Response, StreamingResponse
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
-from datetime import datetime
+from starlette.concurrency import iterate_in_threadpool
+from datetime import date, datetime
 from pydantic import BaseModel
-from typing import Optional
-
-
-# Ensure database tables are created
-Base.metadata.create_all(bind=engine)
+from typing import List, Optional
+
+
+# Schema setup at import. Serverless deployments (api/main.py) turn this off and run
+# `python api/main.py init-db` once per deploy instead of on every cold start.
+DB_INIT_ON_STARTUP = os.getenv("DB_INIT_ON_STARTUP", "1") == "1"
+# Maintenance loops (archive, GC, job sweep, snapshots); pointless in frozen serverless containers
+RUN_BACKGROUND_TASKS = os.getenv("RUN_BACKGROUND_TASKS", "1") == "1"
+
+
+def init_database():
+    """Create missing tables, columns and indexes on every shard."""
+    for shard_engine in router.engines.values():
+        Base.metadata.create_all(bind=shard_engine)
+        ensure_columns(shard_engine, Base.metadata)
+        ensure_indexes(shard_engine, Base.metadata)
+    if router.sharded:
+        router.prepare()
+
+
+if DB_INIT_ON_STARTUP:
+    init_database()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop provider clients and background maintenance tasks."""
+    # Provider connections are per process: open them here, after gunicorn has forked
+    await asyncio.to_thread(ai_personality.start)
+    tasks = []
+    if RUN_BACKGROUND_TASKS:
+        if PROVIDER_WARMUP_INTERVAL_SECONDS > 0:
+            tasks.append(asyncio.create_task(ai_personality.keep_warm(PROVIDER_WARMUP_INTERVAL_SECONDS)))
+        if ARCHIVE_INTERVAL_SECONDS > 0:
+            tasks.append(asyncio.create_task(archive_loop(SessionLocal, ARCHIVE_INTERVAL_SECONDS)))
+        tasks.append(asyncio.create_task(idempotency_purge_loop(SessionLocal)))
+        tasks.append(asyncio.create_task(job_runner.sweep_loop()))
+        tasks.append(asyncio.create_task(upload_store.gc_loop(SessionLocal)))
+        if CACHE_SNAPSHOT_INTERVAL_SECONDS > 0:
+            tasks.append(asyncio.create_task(cache_snapshots.loop(CACHE_SNAPSHOT_INTERVAL_SECONDS)))
+    yield
+    for task in tasks:
+        task.cancel()
+    try:
+        await asyncio.to_thread(cache_snapshots.save)
+    except Exception as e:
+        print(f"Cache snapshot error: {e}")
+    await asyncio.to_thread(job_runner.shutdown)
+    # Let in-flight replies and summaries finish before closing the provider connections
+    await asyncio.to_thread(ai_personality.close)
 
-# Create uploads directory
-UPLOAD_DIR = Path("uploads") 
-UPLOAD_DIR.mkdir(exist_ok=True)
 
 # Initialize FastAPI app
-app = FastAPI(title="Zena - Multilingual AI Chatbot", version="2.0.0")
+app = FastAPI(title="Zena - Multilingual AI Chatbot", version="2.0.0", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -45,6 +122,228 @@ app.add_middleware(
 # Initialize AI Personality
 ai_personality = AIPersonality(use_gemini=True)
 
+# Load langdetect profiles now so preforked workers share them (see gunicorn_conf.py)
+warm_up_language_detection()
+
+# Small per-user records, shared by routes that only need to know who the user is.
+# Anything that modifies a User row must call user_cache.invalidate(user_id) so other workers drop it too.
+# Snapshotted across restarts; bump the codec version when the cached dict's fields change.
+user_cache = LocalCache("users", maxsize=10000, codec=JsonCodec("1"))
+
+
+def _get_user(db: Session, user_id: int) -> Optional[dict]:
+    """Look up a user through the cache, falling back to the database."""
+    user = user_cache.get(user_id)
+    if user is None:
+        db_user = db.query(User).filter(User.id == user_id).first()
+        if not db_user:
+            return None
+        user = {
+            "id": db_user.id,
+            "name": db_user.name,
+            "personality": db_user.personality,
+            "summary": db_user.summary,
+            "summary_upto_id": db_user.summary_upto_id,
+        }
+        user_cache.set(user_id, user)
+    return user
+
+
+# Idempotency-Key bookkeeping for /chat/ retries
+idempotency = IdempotencyStore()
+
+# Adaptive in-flight limit for /chat/ (per worker); see concurrency.py
+chat_limiter = AdaptiveLimiter()
+
+
+async def chat_slot():
+    """
+    Dependency holding a chat_limiter slot for the turn. Over the limit the request fails
+    fast with 503 + Retry-After. Runs after the form is read, so slow uploads don't count
+    as turn latency; client errors (4xx) don't count at all.
+    """
+    if not chat_limiter.acquire():
+        raise HTTPException(
+            status_code=503,
+            detail="Zena is busy right now. Please retry shortly.",
+            headers={"Retry-After": str(chat_limiter.retry_after())},
+        )
+    started = time.monotonic()
+    try:
+        yield
+    except asyncio.CancelledError:
+        # Client went away: says nothing about provider health
+        chat_limiter.release(None)
+        raise
+    except HTTPException as e:
+        chat_limiter.release(None, failed=e.status_code >= 500)
+        raise
+    except BaseException:
+        chat_limiter.release(None, failed=True)
+        raise
+    chat_limiter.release(time.monotonic() - started)
+
+# Rolling conversation summaries, refreshed after the response is sent
+summarizer = ConversationSummarizer(ai_personality, SessionLocal, on_update=user_cache.invalidate)
+
+
+# Strong references to fire-and-forget tasks so they aren't garbage-collected mid-run
+_background_tasks = set()
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+# Sticky per-user reply language
+language_tracker = LanguageTracker()
+
+# Semantic recall over each user's older messages
+memory_index = MemoryIndex()
+
+# Upload index, quotas and background cleanup
+upload_store = UploadStore(get_storage())
+
+
+def _message_watermark() -> int:
+    """Newest message id, the lowest across shards; stored with each cache snapshot."""
+    db = SessionLocal()
+    try:
+        return min((newest or 0 for newest in db.scalars(select(func.max(Message.id)))), default=0)
+    finally:
+        db.close()
+
+
+def _forget_users_written_after(watermark: int) -> int:
+    """
+    Restored entries can predate turns stored by other processes after the snapshot was
+    taken (their invalidations are gone with the old bus log): drop those users' entries.
+    Memory matrices catch up from the database by themselves.
+    """
+    db = SessionLocal()
+    try:
+        user_ids = set(db.scalars(select(Message.user_id).where(Message.id > watermark).distinct()))
+    finally:
+        db.close()
+    for user_id in user_ids:
+        user_cache.invalidate(user_id, broadcast=False)
+        language_tracker.cache.invalidate(user_id, broadcast=False)
+    return len(user_ids)
+
+
+# Warm the caches from the previous run's snapshots. With gunicorn's preload this runs once
+# in the master and the workers share the mapped files; entries are decoded on first use.
+cache_snapshots = CacheSnapshots(watermark=_message_watermark)
+try:
+    _snapshot_watermark = cache_snapshots.restore()
+    if _snapshot_watermark is not None:
+        _forget_users_written_after(_snapshot_watermark)
+except Exception as e:
+    # Without the staleness check the restored users can't be trusted: start those cold
+    print(f"Cache snapshot restore error: {e}")
+    user_cache.clear(broadcast=False)
+    language_tracker.cache.clear(broadcast=False)
+
+
+def _chat_context(db: Session, user_id: int, before_id: Optional[int] = None) -> tuple:
+    """Rolling summary + the turns after it (and before `before_id`), trimmed to the history token budget."""
+    user = _get_user(db, user_id) or {}
+    summary = user.get("summary")
+    history = fit_history(
+        load_recent_turns(db, user_id, after_id=user.get("summary_upto_id"), before_id=before_id),
+        HISTORY_TOKEN_BUDGET - count_tokens(summary)
+    )
+    return summary, history
+
+
+def _recall(db: Session, user_id: int, text: str) -> list:
+    """
+    Older messages relevant to `text`. Only messages already folded into the rolling summary
+    are searched; everything after it is in the prompt verbatim anyway.
+    """
+    summary_upto_id = (_get_user(db, user_id) or {}).get("summary_upto_id")
+    if summary_upto_id is None:
+        return []
+    try:
+        return memory_index.recall(db, user_id, text, before_id=summary_upto_id + 1)
+    except Exception as e:
+        print(f"Memory recall failed for user {user_id}: {e}")
+        return []
+
+
+def _job_turn(db: Session, job: ChatJob) -> Message:
+    """A /chat/ turn as run by the job pool (worker thread, so the blocking provider call is fine)."""
+    # A retried or recovered job stored the user's message on its first attempt: keep it
+    # out of the history it is answered with, and don't store (or count) it again
+    summary, history = _chat_context(db, job.user_id, before_id=job.user_message_id)
+    memories = _recall(db, job.user_id, job.message)
+    asked_at = datetime.utcnow()
+    if job.user_message_id is None:
+        language = language_tracker.observe(db, job.user_id, job.message)
+        user_message = _store_message(db, job.user_id, "user", job.message, job.image_url, language, commit=False)
+        job.user_message_id = user_message.id
+        db.commit()
+    else:
+        language = language_tracker.current(db, job.user_id)
+    ai_reply = ai_personality.generate_ai_reply(
+        user_input=job.message,
+        personality=job.personality,
+        image_path=upload_store.local_path(job.image_url),
+        history=history,
+        summary=summary,
+        language=language,
+        memories=memories
+    )
+    if ai_reply in (GEMINI_ERROR_REPLY, OPENAI_ERROR_REPLY):
+        # The provider failed and apologised instead: retry, then fail the job, don't store it
+        raise RuntimeError("AI provider error")
+    return _store_message(db, job.user_id, "ai", ai_reply, language=language, latency_ms=_since(asked_at))
+
+
+def _store_message(
+    db: Session,
+    user_id: int,
+    sender: str,
+    content: str,
+    image_url: Optional[str] = None,
+    language: Optional[str] = None,
+    latency_ms: Optional[int] = None,
+    commit: bool = True
+) -> Message:
+    """
+    Insert one chat message, together with its usage rollup and memory embedding. Committed
+    unless `commit` is False (the caller commits it with its own changes).
+    """
+    message = Message(
+        user_id=user_id,
+        sender=sender,
+        content=content,
+        image_url=image_url,
+        token_count=count_tokens(content),
+        timestamp=datetime.utcnow()
+    )
+    db.add(message)
+    usage.record(db, user_id, sender, language, message.token_count, message.timestamp, latency_ms)
+    db.flush()
+    memory_index.add(db, message)
+    if image_url:
+        upload_store.attach(db, image_url, message.id)
+    if commit:
+        db.commit()
+    return message
+
+
+def _since(start: datetime) -> int:
+    """Milliseconds since `start` (reply latency for the usage rollups)."""
+    return int((datetime.utcnow() - start).total_seconds() * 1000)
+
+
+# Background chat jobs (POST /chat/jobs)
+job_runner = JobRunner(SessionLocal, run_turn=_job_turn, after_turn=summarizer.maybe_update)
+
 
 # Pydantic Models
 class UserCreate(BaseModel):
@@ -52,6 +351,11 @@ class UserCreate(BaseModel):
     personality: str
 
 
+class BatchChatItem(BaseModel):
+    user_id: int
+    message: str
+
+
 # UPDATED: Serve frontend from root
 @app.get("/", response_class=HTMLResponse)
 async def root():
@@ -64,9 +368,40 @@ async def root():
         return HTMLResponse(content="<h1>Frontend file not found</h1>", status_code=404)
 
 
+@app.get("/metrics")
+async def metrics():
+    """Runtime counters for monitoring (per worker process)."""
+    return {
+        "pid": os.getpid(),
+        "provider_requests": ai_personality.flights.stats(),
+        "provider_transport": ai_personality.transport_stats(),
+        "caches": {
+            "users": user_cache.stats(),
+            "prompts": prompt_cache.stats(),
+            "replies": reply_cache.stats() if reply_cache is not None else None,
+        },
+        "uploads": upload_store.stats(),
+        "languages": language_tracker.stats(),
+        "memory": memory_index.stats(),
+        "replicas": replicas.stats(),
+        "shards": router.stats(),
+        "cache_snapshots": cache_snapshots.stats(),
+        "chat_concurrency": chat_limiter.stats(),
+    }
+
+
+@app.get("/config")
+async def client_config():
+    """Settings the frontend applies before uploading: images are downscaled to the vision size."""
+    return {
+        "vision_max_image_side": VISION_MAX_IMAGE_SIDE,
+        "image_quality": VISION_IMAGE_QUALITY,
+    }
+
+
 @app.get("/health")
 async def health_check():
-    """Health check endpoint for deployment platforms"""
+    """Health check endpoint for deployment platforms (never subject to the chat limit)"""
     return {
         "status": "healthy",
         "version": "2.0.0",
@@ -83,6 +418,9 @@ async def create_user(user: UserCreate, db: Session = Depends(get_db)):
     """Create a new user with custom personality"""
     db_user = User(name=user.name, personality=user.personality)
     db.add(db_user)
+    db.flush()
+    # Keep the new user's first reads on the primary until replicas have caught up
+    note_write(db, db_user.id)
     db.commit()
     db.refresh(db_user)
     
@@ -93,97 +431,346 @@ async def create_user(user: UserCreate, db: Session = Depends(get_db)):
     }
 
 
-@app.post("/chat/")
-async def chat(
-    message: str = Form(...),
-    personality: str = Form(...),
-    user_id: int = Form(...),
-    file: Optional[UploadFile] = File(None),
-    db: Session = Depends(get_db)
-):
-    """Handle chat messages with optional image/video uploads"""
+async def _chat_turn(
+    db: Session,
+    user_id: int,
+    message: str,
+    personality: str,
+    file: Optional[UploadFile]
+) -> Message:
+    """Run one /chat/ turn end to end. Returns the stored AI message."""
     image_path = None
     image_url = None
 
     # Handle file upload
     if file:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        file_extension = Path(file.filename).suffix
-        filename = f"{user_id}_{timestamp}{file_extension}"
-        file_path = UPLOAD_DIR / filename
+        image_path, image_url = upload_store.save(db, user_id, file.filename, file.file)
 
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+    # Conversation context: rolling summary + the turns after it (read before this turn is saved)
+    summary, history = _chat_context(db, user_id)
+    memories = await asyncio.to_thread(_recall, db, user_id, message)
 
-        image_path = str(file_path)
-        image_url = f"/uploads/{filename}"
+    # Update the sticky reply language; saved together with the user message
+    language = language_tracker.observe(db, user_id, message)
 
     # Save user message to database
-    user_message = Message(
-        user_id=user_id,
-        sender="user",
-        content=message,
-        image_url=image_url,
-        timestamp=datetime.utcnow()
-    )
-    db.add(user_message)
-    db.commit()
+    asked_at = datetime.utcnow()
+    _store_message(db, user_id, "user", message, image_url, language)
 
     # Generate AI reply
     try:
-        ai_reply = ai_personality.generate_ai_reply(
+        ai_reply = await ai_personality.agenerate_ai_reply(
             user_input=message,
             personality=personality,
-            image_path=image_path
+            image_path=image_path,
+            history=history,
+            summary=summary,
+            language=language,
+            memories=memories
         )
     except Exception as e:
         print(f"Error generating AI reply: {e}")
         ai_reply = "Sorry, I'm having trouble responding right now. Please try again."
 
     # Save AI message to database
-    ai_message = Message(
-        user_id=user_id,
-        sender="ai",
-        content=ai_reply,
-        timestamp=datetime.utcnow()
+    return _store_message(db, user_id, "ai", ai_reply, language=language, latency_ms=_since(asked_at))
+
+
+@app.post("/chat/")
+async def chat(
+    background_tasks: BackgroundTasks,
+    message: str = Form(...),
+    personality: str = Form(...),
+    user_id: int = Form(...),
+    file: Optional[UploadFile] = File(None),
+    idempotency_key: Optional[str] = Form(None),
+    idempotency_key_header: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: Session = Depends(get_db),
+    _slot: None = Depends(chat_slot),
+):
+    """
+    Handle chat messages with optional image/video uploads.
+    With an Idempotency-Key (header or form field), a retry of the same turn returns the
+    original reply instead of generating and storing it again.
+    """
+    message_tokens = count_tokens(message)
+    if message_tokens > MAX_INPUT_TOKENS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Message is too long ({message_tokens} tokens, limit {MAX_INPUT_TOKENS})."
+        )
+
+    key = idempotency_key_header or idempotency_key
+    if key:
+        previous_reply = await idempotency.begin(db, user_id, key)
+        if previous_reply is not None:
+            return {"reply": previous_reply}
+
+    try:
+        ai_message = await _chat_turn(db, user_id, message, personality, file)
+    except BaseException:
+        if key:
+            idempotency.abandon(db, user_id, key)
+        raise
+    if key:
+        idempotency.complete(db, user_id, key, ai_message.content, ai_message.id)
+
+    background_tasks.add_task(summarizer.maybe_update, user_id)
+
+    return {"reply": ai_message.content}
+
+
+@app.post("/chat/jobs", status_code=202)
+async def create_chat_job(
+    message: str = Form(...),
+    personality: str = Form(...),
+    user_id: int = Form(...),
+    file: Optional[UploadFile] = File(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Queue a chat turn and return its job id immediately. Meant for slow (image/video) turns:
+    no connection or DB session is held while the reply is generated.
+    Poll GET /chat/jobs/{job_id}?wait=30 for the result.
+    """
+    message_tokens = count_tokens(message)
+    if message_tokens > MAX_INPUT_TOKENS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Message is too long ({message_tokens} tokens, limit {MAX_INPUT_TOKENS})."
+        )
+
+    image_path = None
+    image_url = None
+    if file:
+        image_path, image_url = upload_store.save(db, user_id, file.filename, file.file)
+
+    job = job_runner.create(db, user_id, message, personality, image_path, image_url)
+    return {"job_id": job.id, "status": job.status}
+
+
+@app.get("/chat/jobs/{job_id}")
+async def get_chat_job(job_id: str, wait: float = 0, db: Session = Depends(get_db)):
+    """Job status and, once done, the reply. `wait` long-polls up to that many seconds (max 60)."""
+    job = await job_runner.wait(db, job_id, min(max(wait, 0), 60))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job_to_dict(job)
+
+
+@app.websocket("/ws/chat/{user_id}")
+async def chat_websocket(websocket: WebSocket, user_id: int):
+    """
+    Long-lived chat channel. The user and recent context are loaded once per connection.
+    No database connection is held while the socket waits for a frame or the reply
+    streams: the session hands its connection back to the pool before both.
+
+    Client -> server:
+      binary frame                                   image for the next message
+      {"message": "...", "filename": "photo.jpg"}    a chat turn (filename names the pending image)
+    Server -> client:
+      {"type": "ready"}
+      {"type": "typing", "state": true|false}
+      {"type": "chunk", "text": "..."}              streamed reply
+      {"type": "done", "reply": "...", "message_id": 123}
+      {"type": "error", "detail": "..."}
+    """
+    await websocket.accept()
+    db = SessionLocal()
+    try:
+        user = _get_user(db, user_id)
+        if not user:
+            await websocket.close(code=4404, reason="User not found.")
+            return
+
+        # Per-connection state: (id, sender, content, token_count) turns, kept in memory between messages
+        turns = load_recent_messages(db, user_id, after_id=user.get("summary_upto_id"))
+        pending_image = None
+        await websocket.send_json({"type": "ready"})
+
+        while True:
+            # Hand the connection back to the pool while waiting; the session reconnects on next use
+            db.close()
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                break
+            if frame.get("bytes") is not None:
+                pending_image = frame["bytes"]
+                continue
+
+            try:
+                data = json.loads(frame.get("text") or "{}")
+            except ValueError:
+                await websocket.send_json({"type": "error", "detail": "Invalid JSON."})
+                continue
+            message = (data.get("message") or "").strip()
+            if not message:
+                continue
+            message_tokens = count_tokens(message)
+            if message_tokens > MAX_INPUT_TOKENS:
+                await websocket.send_json({
+                    "type": "error",
+                    "detail": f"Message is too long ({message_tokens} tokens, limit {MAX_INPUT_TOKENS})."
+                })
+                continue
+
+            image_path = image_url = None
+            if pending_image is not None:
+                try:
+                    image_path, image_url = upload_store.save(db, user_id, data.get("filename"), io.BytesIO(pending_image))
+                except HTTPException as e:
+                    await websocket.send_json({"type": "error", "detail": e.detail})
+                    continue
+                finally:
+                    pending_image = None
+
+            await websocket.send_json({"type": "typing", "state": True})
+            memories = await asyncio.to_thread(_recall, db, user_id, message)
+            language = language_tracker.observe(db, user_id, message)
+            asked_at = datetime.utcnow()
+            user_message = _store_message(db, user_id, "user", message, image_url, language)
+            user_message_id = user_message.id
+
+            # The summary may have moved on in the background since the last turn: drop the
+            # turns it has folded in, they would otherwise be sent twice
+            current = _get_user(db, user_id) or {}
+            summary = current.get("summary")
+            summary_upto_id = current.get("summary_upto_id")
+            if summary_upto_id is not None:
+                turns = [turn for turn in turns if turn[0] > summary_upto_id]
+            # Nor while the reply streams
+            db.close()
+            history = fit_history(
+                [(sender, content, token_count) for _, sender, content, token_count in turns],
+                HISTORY_TOKEN_BUDGET - count_tokens(summary)
+            )
+
+            parts = []
+            async for chunk in iterate_in_threadpool(ai_personality.stream_ai_reply(
+                user_input=message,
+                personality=user["personality"],
+                image_path=image_path,
+                history=history,
+                summary=summary,
+                language=language,
+                memories=memories
+            )):
+                parts.append(chunk)
+                await websocket.send_json({"type": "chunk", "text": chunk})
+            ai_reply = "".join(parts) or "Sorry, I'm having trouble responding right now. Please try again."
+
+            ai_message = _store_message(db, user_id, "ai", ai_reply, language=language, latency_ms=_since(asked_at))
+            ai_message_id, ai_tokens = ai_message.id, ai_message.token_count
+            turns.append((user_message_id, "user", message, message_tokens))
+            turns.append((ai_message_id, "ai", ai_reply, ai_tokens))
+            del turns[:-(RECENT_TURNS + SUMMARY_EVERY)]
+
+            await websocket.send_json({"type": "done", "reply": ai_reply, "message_id": ai_message_id})
+            await websocket.send_json({"type": "typing", "state": False})
+            _spawn(asyncio.to_thread(summarizer.maybe_update, user_id))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        db.close()
+
+
+@app.post("/chat/batch")
+async def chat_batch(items: List[BatchChatItem], db: Session = Depends(get_db)):
+    """
+    Answer many messages in one request. Replies are streamed back as NDJSON lines
+    (tagged with the item's index) as they complete, and stored with bulk inserts.
+    """
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch.")
+
+    # One query for every user in the batch
+    user_ids = {item.user_id for item in items}
+    personalities = dict(
+        db.query(User.id, User.personality).filter(User.id.in_(user_ids)).all()
     )
-    db.add(ai_message)
-    db.commit()
 
-    return {"reply": ai_reply}
+    return StreamingResponse(
+        run_batch(
+            [{"user_id": item.user_id, "message": item.message} for item in items],
+            personalities,
+            ai_personality,
+            SessionLocal
+        ),
+        media_type="application/x-ndjson"
+    )
 
 
 @app.get("/chat/history/{user_id}")
-async def get_chat_history(user_id: int, limit: int = 50, db: Session = Depends(get_db)):
-    """Retrieve chat history for a specific user"""
-    user_exists = db.query(User).filter(User.id == user_id).first()
-    if not user_exists:
+async def get_chat_history(
+    user_id: int,
+    limit: int = 50,
+    before_id: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Retrieve chat history for a specific user.
+    Returns the newest `limit` messages (oldest first) and whether older ones exist;
+    pass `before_id` (the oldest id you have) to page further back.
+    Pages that reach past the hot table are completed from the archive.
+    """
+    if not _get_user(db, user_id):
         raise HTTPException(status_code=404, detail="User not found.")
 
-    messages = (
-        db.query(Message)
-        .filter(Message.user_id == user_id)
-        .order_by(Message.timestamp.asc())
-        .limit(limit)
-        .all()
+    messages, has_more = history_page(db, user_id, limit, before_id)
+    return Response(
+        content=fast_json.dumps({"messages": messages, "has_more": has_more}),
+        media_type="application/json"
     )
 
-    return {
-        "messages": [
-            {
-                "id": msg.id,
-                "sender": msg.sender,
-                "content": msg.content,
-                "image_url": msg.image_url,
-                "timestamp": msg.timestamp.isoformat()
-            }
-            for msg in messages
-        ]
-    }
 
+@app.get("/chat/export/{user_id}")
+async def export_chat_history(user_id: int, gzip: bool = False, db: Session = Depends(get_db)):
+    """
+    Stream a user's entire history (archived and hot) as NDJSON, oldest first.
+    Pass ?gzip=true for a gzip-compressed download.
+    """
+    if not _get_user(db, user_id):
+        raise HTTPException(status_code=404, detail="User not found.")
+
+    filename = f"chat_{user_id}.ndjson" + (".gz" if gzip else "")
+    return StreamingResponse(
+        ndjson_stream(partial(read_session, user_id), user_id, compress=gzip),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
-# Mount static files directory for uploads
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+
+@app.get("/uploads/{name}")
+async def get_upload(name: str):
+    """Serve an uploaded file (its thumbnail once the original has been evicted) and record the access."""
+    found = upload_store.resolve(name)
+    if found is None:
+        raise HTTPException(status_code=404, detail="File not found.")
+    key, media_type = found
+    # Hand out a direct (presigned) URL when the backend has one, so media bytes bypass the app
+    url = upload_store.storage.url(key)
+    if url:
+        return RedirectResponse(url, status_code=307)
+    return FileResponse(upload_store.storage.local_path(key), media_type=media_type)
+
+
+@app.get("/stats")
+async def get_stats(
+    group_by: str = "day",
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    user_id: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Usage totals from the daily rollups (never scans messages).
+    `group_by` is a comma-separated mix of day, user, sender and language; empty for grand totals.
+    """
+    groups = [name.strip() for name in group_by.split(",") if name.strip()]
+    unknown = [name for name in groups if name not in usage.STATS_GROUPS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by: {', '.join(unknown)}.")
+    return {"stats": usage.query_stats(db, groups, start, end, user_id)}
 
 
 # Error handlers
@@ -0,0 +1,255 @@
+# memory.py
+# Per-user semantic memory: every stored message gets a small hashed n-gram embedding, and a
+# new turn recalls the most similar older messages (those already folded into the rolling
+# summary) so facts from thousands of messages ago can still reach the prompt.
+#
+# Embeddings are signed feature hashes of words and character trigrams: CPU-only, no model
+# download, stable across processes. They are stored packed as little-endian float16 and held
+# per user as one float32 matrix, so recall is a single matrix-vector product plus a partial sort.
+#
+# Index existing hot-table history once:   python memory.py backfill
+import os
+import re
+import struct
+import sys
+import threading
+import zlib
+from typing import List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from cache import LocalCache
+from models import Message, MessageEmbedding
+
+MEMORY_DIM = int(os.getenv("MEMORY_DIM", "256"))
+MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", "3"))
+# Cosine similarity below this is noise for hashed n-grams
+MEMORY_MIN_SCORE = float(os.getenv("MEMORY_MIN_SCORE", "0.3"))
+# Users whose matrices stay loaded in this process, and the most memory those may take
+# (a user's matrix is 4 * MEMORY_DIM bytes per message, plus growth headroom). A user whose
+# matrix alone exceeds the budget is loaded from the database on every recall.
+MEMORY_CACHE_USERS = int(os.getenv("MEMORY_CACHE_USERS", "64"))
+MEMORY_CACHE_BYTES = int(os.getenv("MEMORY_CACHE_BYTES", str(512 * 1024 * 1024)))
+# Messages shorter than this ("ok", "haha") are not worth remembering
+MEMORY_MIN_WORDS = 3
+MEMORY_SNIPPET_CHARS = 500
+
+WORD_RE = re.compile(r"\w+")
+VECTOR_DTYPE = np.dtype("<f2")
+
+
+def embed(text: str) -> np.ndarray:
+    """Unit-length float32 vector of signed word and character-trigram hashes."""
+    buckets = []
+    signs = []
+    for word in WORD_RE.findall(text.lower()):
+        padded = f" {word} "
+        for feature in [word] + [padded[i:i + 3] for i in range(len(padded) - 2)]:
+            h = zlib.crc32(feature.encode("utf-8"))
+            buckets.append(h % MEMORY_DIM)
+            signs.append(1.0 if h & 0x80000000 else -1.0)
+    vector = np.zeros(MEMORY_DIM, dtype=np.float32)
+    if buckets:
+        np.add.at(vector, buckets, signs)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+    return vector
+
+
+def pack(vector: np.ndarray) -> bytes:
+    return vector.astype(VECTOR_DTYPE).tobytes()
+
+
+def unpack_many(blobs: List[bytes]) -> np.ndarray:
+    return np.frombuffer(b"".join(blobs), dtype=VECTOR_DTYPE).reshape(-1, MEMORY_DIM).astype(np.float32)
+
+
+def top_k(matrix: np.ndarray, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Row indices and scores of the k rows most similar to query, best first."""
+    scores = matrix @ query
+    if len(scores) > k:
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    order = candidates[np.argsort(scores[candidates])[::-1]]
+    return order, scores[order]
+
+
+def embedding_row(message_id: int, user_id: int, sender: str, content: Optional[str]) -> Optional[dict]:
+    """message_embeddings values for one message, or None if it is too short to be worth remembering."""
+    content = content or ""
+    if len(content.split()) < MEMORY_MIN_WORDS:
+        return None
+    return {
+        "message_id": message_id,
+        "user_id": user_id,
+        "sender": sender,
+        "snippet": content[:MEMORY_SNIPPET_CHARS],
+        "vector": pack(embed(content)),
+    }
+
+
+def add_embedding(db: Session, message: Message):
+    row = embedding_row(message.id, message.user_id, message.sender, message.content)
+    if row is not None:
+        db.add(MessageEmbedding(**row))
+
+
+class UserMemory:
+    """One user's embeddings in message-id order, in a buffer that grows by doubling."""
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.vectors = np.empty((0, MEMORY_DIM), dtype=np.float32)
+        self.size = 0
+        self.lock = threading.Lock()
+
+    @property
+    def last_id(self) -> int:
+        return int(self.ids[self.size - 1]) if self.size else 0
+
+    def extend(self, ids: List[int], vectors: np.ndarray):
+        needed = self.size + len(ids)
+        if needed > len(self.ids):
+            capacity = max(needed, 2 * len(self.ids), 1024)
+            grown_ids = np.empty(capacity, dtype=np.int64)
+            grown_vectors = np.empty((capacity, MEMORY_DIM), dtype=np.float32)
+            grown_ids[:self.size] = self.ids[:self.size]
+            grown_vectors[:self.size] = self.vectors[:self.size]
+            self.ids, self.vectors = grown_ids, grown_vectors
+        self.ids[self.size:needed] = ids
+        self.vectors[self.size:needed] = vectors
+        self.size = needed
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held, growth headroom included."""
+        return self.ids.nbytes + self.vectors.nbytes
+
+
+class UserMemoryCodec:
+    """Snapshot codec for UserMemory: row count (int64), ids (int64), then float32 vectors."""
+
+    # Bump when embed() changes: vectors from different versions don't compare
+    version = f"dim={MEMORY_DIM};embed=1"
+
+    def encode(self, memory: UserMemory) -> bytes:
+        with memory.lock:
+            size = memory.size
+            return (
+                struct.pack("<q", size)
+                + memory.ids[:size].astype("<i8").tobytes()
+                + memory.vectors[:size].astype("<f4").tobytes()
+            )
+
+    def decode(self, raw) -> UserMemory:
+        (size,) = struct.unpack_from("<q", raw)
+        memory = UserMemory()
+        # Read-only views straight into the snapshot mapping. Capacity equals size, so the
+        # first extend() copies into fresh buffers instead of writing into the mapping.
+        memory.ids = np.frombuffer(raw, dtype="<i8", count=size, offset=8)
+        memory.vectors = np.frombuffer(
+            raw, dtype="<f4", count=size * MEMORY_DIM, offset=8 + 8 * size
+        ).reshape(size, MEMORY_DIM)
+        memory.size = size
+        return memory
+
+
+class MemoryIndex:
+    """Writes embeddings with each message and answers recall queries from per-user matrices."""
+
+    def __init__(self, cache_users: int = MEMORY_CACHE_USERS, cache_bytes: int = MEMORY_CACHE_BYTES):
+        self.cache = LocalCache(
+            "memory", cache_users, codec=UserMemoryCodec(), maxbytes=cache_bytes, sizeof=lambda memory: memory.nbytes
+        )
+        self._lock = threading.Lock()
+
+    def add(self, db: Session, message: Message):
+        """Embed a just-flushed message. Joins the caller's transaction."""
+        add_embedding(db, message)
+
+    def _load(self, db: Session, user_id: int) -> UserMemory:
+        """The user's matrix, caught up with rows written since it was loaded (by any worker)."""
+        with self._lock:
+            memory = self.cache.get(user_id)
+            if memory is None:
+                memory = UserMemory()
+                self.cache.set(user_id, memory)
+        with memory.lock:
+            rows = db.execute(
+                select(MessageEmbedding.message_id, MessageEmbedding.vector)
+                .where(MessageEmbedding.user_id == user_id, MessageEmbedding.message_id > memory.last_id)
+                .order_by(MessageEmbedding.message_id.asc())
+            ).all()
+            if rows:
+                memory.extend([message_id for message_id, _ in rows], unpack_many([vector for _, vector in rows]))
+                # Weigh it again now that it grew (may evict it or other users)
+                self.cache.set(user_id, memory)
+        return memory
+
+    def recall(self, db: Session, user_id: int, text: str, before_id: int,
+               k: int = MEMORY_TOP_K) -> List[Tuple[str, str]]:
+        """
+        Up to k (sender, snippet) pairs from messages with id < before_id most similar to
+        text, best first.
+        """
+        memory = self._load(db, user_id)
+        cutoff = int(np.searchsorted(memory.ids[:memory.size], before_id))
+        if not cutoff:
+            return []
+        rows, scores = top_k(memory.vectors[:cutoff], embed(text), k)
+        ids = [int(memory.ids[row]) for row, score in zip(rows, scores) if score >= MEMORY_MIN_SCORE]
+        if not ids:
+            return []
+        found = {
+            message_id: (sender, snippet)
+            for message_id, sender, snippet in db.execute(
+                select(MessageEmbedding.message_id, MessageEmbedding.sender, MessageEmbedding.snippet)
+                .where(MessageEmbedding.user_id == user_id, MessageEmbedding.message_id.in_(ids))
+            )
+        }
+        return [found[message_id] for message_id in ids if message_id in found]
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+def backfill(db: Session, batch: int = 1000) -> int:
+    """Embed hot-table messages that have no embedding yet, oldest first."""
+    total = 0
+    last_id = 0
+    while True:
+        messages = db.scalars(
+            select(Message)
+            .outerjoin(MessageEmbedding, MessageEmbedding.message_id == Message.id)
+            .where(Message.id > last_id, MessageEmbedding.message_id.is_(None))
+            .order_by(Message.id.asc())
+            .limit(batch)
+        ).all()
+        # Sharded, every shard returns its own first `batch`: keep the overall first `batch`
+        messages = sorted(messages, key=lambda message: message.id)[:batch]
+        if not messages:
+            return total
+        for message in messages:
+            add_embedding(db, message)
+        db.commit()
+        total += len(messages)
+        last_id = messages[-1].id
+
+
+if __name__ == "__main__":
+    from database import SessionLocal, router
+    from models import Base
+
+    if sys.argv[1:] != ["backfill"]:
+        sys.exit("usage: python memory.py backfill")
+    for shard_engine in router.engines.values():
+        Base.metadata.create_all(bind=shard_engine)
+    db = SessionLocal()
+    try:
+        print(f"Checked {backfill(db)} messages for embeddings")
+    finally:
+        db.close()
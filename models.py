@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Date, DateTime, LargeBinary, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -10,6 +10,12 @@ class User(Base):
     name = Column(String, index=True)
     # Store the user-defined personality string here
     personality = Column(Text) 
+    # Rolling summary of the conversation up to (and including) message summary_upto_id
+    summary = Column(Text, nullable=True)
+    summary_upto_id = Column(Integer, nullable=True)
+    # Sticky reply language and its moving estimate (JSON scores per script), see language_state.py
+    language = Column(String, nullable=True)
+    language_scores = Column(Text, nullable=True)
 
     messages = relationship("Message", back_populates="user")
 
@@ -21,6 +27,128 @@ class Message(Base):
     sender = Column(String)  # "user" or "ai"
     content = Column(Text)
     image_url = Column(String, nullable=True)  # NEW: Store image/video URL
+    token_count = Column(Integer, nullable=True)  # tokens.count_tokens(content), set on insert
     timestamp = Column(DateTime, default=datetime.utcnow)
 
-    user = relationship("User", back_populates="messages")
\ No newline at end of file
+    user = relationship("User", back_populates="messages")
+
+    __table_args__ = (
+        # History pages are "newest N before id X" for one user
+        Index("ix_messages_user_id_id", "user_id", "id"),
+        # Don't let SQLite reuse ids after old rows move to the archive
+        {"sqlite_autoincrement": True},
+    )
+
+class ChatJob(Base):
+    """A chat turn queued for background processing (POST /chat/jobs), see jobs.py."""
+    __tablename__ = "chat_jobs"
+
+    id = Column(String, primary_key=True)  # uuid4 hex
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    status = Column(String, index=True)  # "queued", "running", "done" or "failed"
+    message = Column(Text)
+    personality = Column(Text)
+    image_path = Column(String, nullable=True)
+    image_url = Column(String, nullable=True)
+    reply = Column(Text, nullable=True)
+    user_message_id = Column(Integer, nullable=True)  # stored by the first attempt, reused by retries
+    ai_message_id = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class IdempotencyKey(Base):
+    """A /chat/ turn keyed by the client's Idempotency-Key, so retries don't generate twice."""
+    __tablename__ = "idempotency_keys"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    key = Column(String, primary_key=True)
+    status = Column(String)  # "pending" or "done"
+    reply = Column(Text, nullable=True)
+    ai_message_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+
+class ArchiveSegment(Base):
+    """An immutable, compressed block of old messages for one user (see archive.py)."""
+    __tablename__ = "message_archive"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    first_message_id = Column(Integer)
+    last_message_id = Column(Integer)
+    first_timestamp = Column(DateTime)
+    last_timestamp = Column(DateTime)
+    message_count = Column(Integer)
+    payload = Column(LargeBinary)  # zlib-compressed JSON list of message dicts
+
+    __table_args__ = (
+        Index("ix_message_archive_user_last_id", "user_id", "last_message_id"),
+    )
+
+class Upload(Base):
+    """Index entry for one uploaded file (see uploads.py); name is its storage key."""
+    __tablename__ = "uploads"
+
+    name = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=True)
+    size = Column(Integer, default=0)  # bytes of the original while it is on disk
+    # Message whose image_url points here; NULL until that message commits (or forever, for orphans).
+    # 0 marks files that predate the index and are assumed to be referenced.
+    message_id = Column(Integer, nullable=True)
+    thumb_name = Column(String, nullable=True)  # key under storage.THUMB_PREFIX, made when evicting
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_access_at = Column(DateTime, default=datetime.utcnow, index=True)
+    evicted_at = Column(DateTime, nullable=True)  # original deleted, only the thumbnail remains
+
+
+class UsageDaily(Base):
+    """Per user/day/sender/language message rollup, updated with every insert (see usage.py)."""
+    __tablename__ = "usage_daily"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    sender = Column(String, primary_key=True)  # "user" or "ai"
+    language = Column(String, primary_key=True)  # script from detect_language, "unknown" if none
+    message_count = Column(Integer, default=0)
+    token_count = Column(Integer, default=0)
+    # AI messages only: milliseconds from the user's message to the stored reply
+    latency_ms_sum = Column(Integer, default=0)
+
+    __table_args__ = (
+        # /stats filters by date range across all users
+        Index("ix_usage_daily_day", "day"),
+    )
+
+
+class MessageEmbedding(Base):
+    """Hashed n-gram embedding of one message for semantic recall (see memory.py)."""
+    __tablename__ = "message_embeddings"
+
+    message_id = Column(Integer, primary_key=True)  # Message.id; kept after the message is archived
+    user_id = Column(Integer, ForeignKey("users.id"))
+    sender = Column(String)
+    snippet = Column(Text)  # leading MEMORY_SNIPPET_CHARS of the content, so recall never needs the archive
+    vector = Column(LargeBinary)  # MEMORY_DIM little-endian float16 values
+
+    __table_args__ = (
+        # Loading / catching up one user's matrix in id order
+        Index("ix_message_embeddings_user_message", "user_id", "message_id"),
+    )
+
+
+class UserShard(Base):
+    """Shard map entry: which shard holds a user's rows (see sharding.py). Lives on shard 0 only."""
+    __tablename__ = "user_shards"
+
+    user_id = Column(Integer, primary_key=True)  # no FK: the user row may live on another shard
+    shard = Column(Integer, nullable=False)
+
+
+class IdSequence(Base):
+    """Per-shard counter for user/message ids on SQLite; Postgres uses a real sequence (see sharding.py)."""
+    __tablename__ = "id_sequence"
+
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False)
@@ -0,0 +1,300 @@
+# sharding.py
+# Optional horizontal sharding of per-user data. Shard "0" is DATABASE_URL and also holds the
+# shard map (user_shards); DATABASE_SHARD_URLS adds shards "1", "2", ... Every table with a
+# user_id column (and users itself) lives on the user's shard, so one user's turn only ever
+# takes that shard's write lock.
+#
+# Routing is done by SQLAlchemy's ShardedSession with the choosers below: new rows go to the
+# shard of their user_id, queries filtered by user_id (or users.id) go to that user's shard,
+# and unfiltered queries (maintenance loops, lookups by job id) fan out to every shard.
+# User and message ids are allocated per shard as seq * MAX_SHARDS + shard, which keeps them
+# unique across shards and lets rows move between shards unchanged.
+#
+# Move users between shards:   python sharding.py rebalance [--dry-run]
+#                              python sharding.py move USER_ID SHARD
+import itertools
+import sys
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, event, func, insert, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.dml import Insert
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, ColumnClause
+
+from cache import LocalCache
+
+# Upper bound on the number of shards ever used; part of every allocated id, never change it
+MAX_SHARDS = 64
+DIRECTORY_SHARD = "0"
+SHARD_MAP_TABLE = "user_shards"
+ID_SEQUENCE_TABLE = "id_sequence"
+PG_ID_SEQUENCE = "shard_id_seq"
+# Tables whose ids are allocated by the router rather than autoincrement
+ALLOCATED_ID_TABLES = ("users", "messages")
+MOVE_BATCH_ROWS = 1000
+
+
+def _is_user_key(column) -> bool:
+    name = getattr(column, "name", None)
+    if name == "user_id":
+        return True
+    table = getattr(column, "table", None)
+    return name == "id" and getattr(table, "name", None) == "users"
+
+
+def _user_ids_in(statement) -> Optional[set]:
+    """user_id values the statement (or a subquery of it) pins with = or IN, or None if it doesn't."""
+    user_ids = set()
+    for element in visitors.iterate(statement):
+        if not isinstance(element, BinaryExpression):
+            continue
+        column, bind = element.left, element.right
+        if isinstance(column, BindParameter):
+            column, bind = bind, column
+        if not (isinstance(column, ColumnClause) and isinstance(bind, BindParameter) and _is_user_key(column)):
+            continue
+        value = bind.effective_value
+        if value is None:
+            continue
+        if element.operator is operators.eq:
+            user_ids.add(value)
+        elif element.operator is operators.in_op:
+            user_ids.update(value)
+    return user_ids or None
+
+
+def advance_ids(conn, past_id: int):
+    """Make the shard's next allocated id larger than `past_id`."""
+    floor = past_id // MAX_SHARDS + 1
+    if conn.dialect.name == "postgresql":
+        if conn.scalar(text(f"SELECT last_value FROM {PG_ID_SEQUENCE}")) < floor:
+            conn.execute(text("SELECT setval(:seq, :value)"), {"seq": PG_ID_SEQUENCE, "value": floor})
+    else:
+        conn.execute(
+            text(f"UPDATE {ID_SEQUENCE_TABLE} SET value = :v WHERE name = 'ids' AND value < :v"), {"v": floor}
+        )
+
+
+class ShardRouter:
+    """Shard map, id allocation and the ShardedSession choosers."""
+
+    def __init__(self, engines: List[Engine]):
+        self.engines: Dict[str, Engine] = {str(i): e for i, e in enumerate(engines)}
+        self.map_cache = LocalCache("shards", maxsize=100000)
+        self._placement = itertools.count()
+
+    @property
+    def sharded(self) -> bool:
+        return len(self.engines) > 1
+
+    def shard_for(self, user_id: int) -> str:
+        shard = self.map_cache.get(user_id)
+        if shard is None:
+            with self.engines[DIRECTORY_SHARD].connect() as conn:
+                found = conn.scalar(
+                    text(f"SELECT shard FROM {SHARD_MAP_TABLE} WHERE user_id = :user_id"), {"user_id": user_id}
+                )
+            # Users created before sharding was enabled have no entry and live on shard 0
+            shard = str(found) if found is not None else DIRECTORY_SHARD
+            self.map_cache.set(user_id, shard)
+        return shard
+
+    def place(self) -> str:
+        """Shard for a new user (round-robin)."""
+        return str(next(self._placement) % len(self.engines))
+
+    def allocate_ids(self, session, shard: str, count: int = 1) -> List[int]:
+        """`count` new globally unique ids on `shard`, in increasing order, within the session's transaction."""
+        conn = session.connection(bind_arguments={"shard_id": shard})
+        if conn.dialect.name == "postgresql":
+            # Sequences are non-transactional: no row lock held until commit
+            seqs = conn.execute(
+                text(f"SELECT nextval('{PG_ID_SEQUENCE}') FROM generate_series(1, :n)"), {"n": count}
+            ).scalars().all()
+        else:
+            # SQLite has one writer per file anyway, and this is the writer
+            conn.execute(text(f"UPDATE {ID_SEQUENCE_TABLE} SET value = value + :n WHERE name = 'ids'"), {"n": count})
+            end = conn.scalar(text(f"SELECT value FROM {ID_SEQUENCE_TABLE} WHERE name = 'ids'"))
+            seqs = range(end - count + 1, end + 1)
+        return [seq * MAX_SHARDS + int(shard) for seq in seqs]
+
+    def prepare(self):
+        """Create or advance each shard's id sequence past every id already stored there. Run after create_all."""
+        for shard, engine in self.engines.items():
+            with engine.begin() as conn:
+                existing = max(
+                    conn.scalar(text(f"SELECT COALESCE(MAX(id), 0) FROM {table}")) for table in ALLOCATED_ID_TABLES
+                )
+                if conn.dialect.name == "postgresql":
+                    conn.execute(text(f"CREATE SEQUENCE IF NOT EXISTS {PG_ID_SEQUENCE}"))
+                elif conn.scalar(text(f"SELECT value FROM {ID_SEQUENCE_TABLE} WHERE name = 'ids'")) is None:
+                    conn.execute(text(f"INSERT INTO {ID_SEQUENCE_TABLE} (name, value) VALUES ('ids', 0)"))
+                advance_ids(conn, existing)
+
+    # ShardedSession hooks
+
+    def _shard_chooser(self, mapper, instance, clause=None) -> str:
+        if instance is None:
+            return DIRECTORY_SHARD
+        if mapper.local_table.name == "users":
+            return self.shard_for(instance.id) if instance.id is not None else DIRECTORY_SHARD
+        user_id = getattr(instance, "user_id", None)
+        return self.shard_for(user_id) if user_id is not None else DIRECTORY_SHARD
+
+    def _identity_chooser(self, mapper, primary_key, *, lazy_loaded_from=None, **kw) -> List[str]:
+        if lazy_loaded_from is not None:
+            return [lazy_loaded_from.identity_token]
+        names = [column.name for column in mapper.primary_key]
+        if mapper.local_table.name == "users":
+            return [self.shard_for(primary_key[0])]
+        if "user_id" in names:
+            return [self.shard_for(primary_key[names.index("user_id")])]
+        return list(self.engines)
+
+    def _execute_chooser(self, context) -> List[str]:
+        statement = context.statement
+        user_ids = _user_ids_in(statement)
+        if user_ids is None and isinstance(statement, Insert):
+            params = context.parameters
+            rows = params if isinstance(params, list) else [params or {}]
+            user_ids = {row["user_id"] for row in rows if row.get("user_id") is not None} or None
+            if user_ids is None:
+                return [DIRECTORY_SHARD]
+        if user_ids is None:
+            return list(self.engines)
+        return sorted({self.shard_for(user_id) for user_id in user_ids})
+
+    def _before_flush(self, session, flush_context, instances):
+        """Give new users a shard and an id, and new messages an id from their user's shard."""
+        for obj in list(session.new):
+            table = getattr(type(obj), "__tablename__", None)
+            if table not in ALLOCATED_ID_TABLES or obj.id is not None:
+                continue
+            if table == "users":
+                shard = self.place()
+                obj.id = self.allocate_ids(session, shard)[0]
+                session.execute(
+                    text(f"INSERT INTO {SHARD_MAP_TABLE} (user_id, shard) VALUES (:user_id, :shard)"),
+                    {"user_id": obj.id, "shard": int(shard)},
+                    bind_arguments={"shard_id": DIRECTORY_SHARD},
+                )
+                self.map_cache.set(obj.id, shard)
+            else:
+                obj.id = self.allocate_ids(session, self.shard_for(obj.user_id))[0]
+
+    def sessionmaker(self, **kwargs):
+        factory = sessionmaker(
+            class_=ShardedSession,
+            shards=self.engines,
+            shard_chooser=self._shard_chooser,
+            identity_chooser=self._identity_chooser,
+            execute_chooser=self._execute_chooser,
+            **kwargs,
+        )
+        event.listen(factory, "before_flush", self._before_flush)
+        return factory
+
+    def dispose(self, close: bool = True):
+        for engine in self.engines.values():
+            engine.dispose(close=close)
+
+    def stats(self) -> dict:
+        return {"shards": len(self.engines), "map": self.map_cache.stats()}
+
+
+def _user_tables(metadata):
+    """Tables holding per-user rows, parents first."""
+    return [
+        table for table in metadata.sorted_tables
+        if table.name == "users" or ("user_id" in table.c and table.name != SHARD_MAP_TABLE)
+    ]
+
+
+def _user_key(table):
+    return table.c.id if table.name == "users" else table.c.user_id
+
+
+def move_user(router: ShardRouter, metadata, user_id: int, target: str) -> int:
+    """
+    Copy every row of a user to `target`, repoint the shard map, then delete the source rows.
+    Writes for this user that land on the old shard between the copy and the map switch
+    (reaching other workers over the cache bus) are not carried over: run during low traffic.
+    """
+    source = router.shard_for(user_id)
+    if source == target:
+        return 0
+    tables = _user_tables(metadata)
+    copied = 0
+    with router.engines[source].connect() as src, router.engines[target].begin() as dst:
+        for table in tables:
+            result = src.execution_options(stream_results=True).execute(
+                select(table).where(_user_key(table) == user_id)
+            )
+            for rows in result.mappings().partitions(MOVE_BATCH_ROWS):
+                rows = [dict(row) for row in rows]
+                # Other autoincrement ids (message_archive) are per shard: let the target assign them
+                if table.name not in ALLOCATED_ID_TABLES and table.autoincrement_column is not None:
+                    for row in rows:
+                        row.pop(table.autoincrement_column.name, None)
+                dst.execute(insert(table), rows)
+                copied += len(rows)
+        # The user's new ids must keep sorting after the ones just copied
+        moved_max = max(
+            dst.scalar(select(func.coalesce(func.max(table.c.id), 0)).where(_user_key(table) == user_id))
+            for table in tables if table.name in ALLOCATED_ID_TABLES
+        )
+        advance_ids(dst, moved_max)
+
+    with router.engines[DIRECTORY_SHARD].begin() as conn:
+        conn.execute(text(f"DELETE FROM {SHARD_MAP_TABLE} WHERE user_id = :user_id"), {"user_id": user_id})
+        conn.execute(
+            text(f"INSERT INTO {SHARD_MAP_TABLE} (user_id, shard) VALUES (:user_id, :shard)"),
+            {"user_id": user_id, "shard": int(target)},
+        )
+    # Broadcast: every worker looks the user up again
+    router.map_cache.invalidate(user_id)
+
+    with router.engines[source].begin() as src:
+        for table in reversed(tables):
+            src.execute(delete(table).where(_user_key(table) == user_id))
+    return copied
+
+
+def rebalance(router: ShardRouter, metadata, dry_run: bool = False) -> List[tuple]:
+    """Move users from the fullest shards to the emptiest until user counts differ by at most one."""
+    user_ids = {}
+    for shard, engine in router.engines.items():
+        with engine.connect() as conn:
+            # Newest users first: they have the least history to copy
+            user_ids[shard] = conn.scalars(text("SELECT id FROM users ORDER BY id ASC")).all()
+    moves = []
+    while True:
+        fullest = max(user_ids, key=lambda shard: len(user_ids[shard]))
+        emptiest = min(user_ids, key=lambda shard: len(user_ids[shard]))
+        if len(user_ids[fullest]) - len(user_ids[emptiest]) <= 1:
+            break
+        user_id = user_ids[fullest].pop()
+        user_ids[emptiest].append(user_id)
+        if not dry_run:
+            move_user(router, metadata, user_id, emptiest)
+        moves.append((user_id, fullest, emptiest))
+    return moves
+
+
+if __name__ == "__main__":
+    import models  # noqa: F401  (registers the tables on Base.metadata)
+    from database import Base, router
+
+    args = sys.argv[1:]
+    if args[:1] == ["rebalance"]:
+        for user_id, source, target in rebalance(router, Base.metadata, dry_run="--dry-run" in args):
+            print(f"user {user_id}: shard {source} -> {target}")
+    elif args[:1] == ["move"] and len(args) == 3:
+        if args[2] not in router.engines:
+            sys.exit(f"Unknown shard {args[2]}")
+        print(f"Moved {move_user(router, Base.metadata, int(args[1]), args[2])} rows")
+    else:
+        sys.exit("usage: python sharding.py rebalance [--dry-run] | move USER_ID SHARD")
@@ -0,0 +1,59 @@
+# singleflight.py
+# Coalesces concurrent identical calls: the first caller for a key runs the function,
+# everyone else arriving while it is in flight waits for and shares that result.
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable
+
+
+class SingleFlight:
+    """Per-key in-flight call deduplication, usable from threads and from the event loop."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def _join(self, key: Hashable):
+        """Returns (future, is_leader) for key."""
+        with self._lock:
+            self.calls += 1
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            return future, True
+
+    def _run(self, key: Hashable, future: Future, fn: Callable, args, kwargs):
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """Blocking: run fn (or wait for the identical call already running) and return its result."""
+        future, leader = self._join(key)
+        if leader:
+            self._run(key, future, fn, args, kwargs)
+        return future.result()
+
+    async def do_async(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Async: the leader runs the blocking fn in the default executor. Waiters are shielded,
+        so one caller disconnecting never cancels the shared call for the others.
+        """
+        future, leader = self._join(key)
+        if leader:
+            loop = asyncio.get_running_loop()
+            loop.run_in_executor(None, self._run, key, future, fn, args, kwargs)
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._calls)}
@@ -0,0 +1,183 @@
+# snapshot.py
+# Warm caches across restarts and deploys. Each worker writes the caches that have a codec
+# (see LocalCache) to its own file in CACHE_SNAPSHOT_DIR, periodically and on graceful
+# shutdown. At startup the files are memory-mapped and handed to the caches as encoded
+# entries, which are only decoded when first read; with gunicorn's preload the master does
+# this once and the workers share the mapped pages.
+#
+# File layout (little-endian):
+#   header   magic "ZSNAP\0", format version u16, written_at f64 (unix time), watermark i64, index length u64
+#   index    JSON {cache name: {"version": codec version, "entries": [[key, offset, length], ...]}}
+#   data     encoded values, 8-byte aligned, offsets relative to the start of this section
+#
+# A snapshot is discarded when its format version differs, when it is older than
+# CACHE_SNAPSHOT_MAX_AGE_SECONDS, and per cache when the codec version changed. Files left by
+# workers that have exited are deleted by the next save() once they pass that age.
+# Mount CACHE_SNAPSHOT_DIR on a volume that outlives the container to keep it across deploys.
+import asyncio
+import glob
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+from typing import Callable, Optional
+
+from cache import _decode_key, bus
+
+CACHE_SNAPSHOT_DIR = os.getenv("CACHE_SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "zena-cache-snapshots"))
+CACHE_SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("CACHE_SNAPSHOT_INTERVAL_SECONDS", "300"))
+CACHE_SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("CACHE_SNAPSHOT_MAX_AGE_SECONDS", "3600"))
+
+MAGIC = b"ZSNAP\0"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<6sHdqQ")
+ALIGN = 8
+
+
+class JsonCodec:
+    """Codec for JSON-compatible values. Bump `version` whenever the value's shape changes."""
+
+    def __init__(self, version: str):
+        self.version = version
+
+    def encode(self, value) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, raw) -> object:
+        return json.loads(bytes(raw))
+
+
+def _padding(offset: int) -> int:
+    return -offset % ALIGN
+
+
+class CacheSnapshots:
+    """Writes and restores snapshots of every registered LocalCache that has a codec."""
+
+    def __init__(self, directory: str = CACHE_SNAPSHOT_DIR, watermark: Optional[Callable[[], int]] = None):
+        self.directory = directory
+        # Optional position in the write stream (e.g. newest message id) stored with each
+        # snapshot, so the caller can find what changed after it was taken
+        self.watermark = watermark
+        self._maps = []
+        self.saved = 0
+        self.loaded = 0
+        self.discarded = 0
+        self.pruned = 0
+
+    def _caches(self) -> dict:
+        return {
+            cache.name: cache for cache in bus.caches()
+            if getattr(cache, "codec", None) is not None and not cache.ttl
+        }
+
+    def _path(self) -> str:
+        return os.path.join(self.directory, f"cache-{os.getpid()}.snap")
+
+    def save(self) -> int:
+        """Write this process's snapshot (atomically replacing its previous one). Returns the entry count."""
+        watermark = self.watermark() if self.watermark else -1
+        index = {}
+        chunks = []
+        offset = 0
+        for name, cache in self._caches().items():
+            entries = []
+            for key, data in cache.snapshot_entries():
+                pad = _padding(offset)
+                if pad:
+                    chunks.append(b"\0" * pad)
+                    offset += pad
+                entries.append([key, offset, len(data)])
+                chunks.append(data)
+                offset += len(data)
+            index[name] = {"version": cache.codec.version, "entries": entries}
+        index_bytes = json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, time.time(), watermark, len(index_bytes))
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path()
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(header)
+            f.write(index_bytes)
+            f.write(b"\0" * _padding(len(header) + len(index_bytes)))
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp, path)
+        self.saved += 1
+        self._prune()
+        return sum(len(section["entries"]) for section in index.values())
+
+    def _prune(self):
+        """Delete other processes' snapshots too old to be restored (live workers rewrite theirs every interval)."""
+        own = self._path()
+        for path in glob.glob(os.path.join(self.directory, "cache-*.snap")):
+            try:
+                if path != own and time.time() - os.path.getmtime(path) > CACHE_SNAPSHOT_MAX_AGE_SECONDS:
+                    os.unlink(path)
+                    self.pruned += 1
+            except OSError:
+                pass
+
+    def _load(self, path: str, caches: dict) -> int:
+        """Map one snapshot file and hand its entries to the caches. Returns its watermark."""
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mapped) < HEADER.size:
+            raise ValueError("truncated header")
+        magic, version, written_at, watermark, index_length = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"format {version!r} is not {FORMAT_VERSION}")
+        if time.time() - written_at > CACHE_SNAPSHOT_MAX_AGE_SECONDS:
+            raise ValueError(f"written {time.time() - written_at:.0f}s ago")
+        index = json.loads(mapped[HEADER.size:HEADER.size + index_length])
+        data_start = HEADER.size + index_length
+        data_start += _padding(data_start)
+
+        view = memoryview(mapped)
+        for name, section in index.items():
+            cache = caches.get(name)
+            if cache is None or section["version"] != cache.codec.version:
+                continue
+            cache.restore({
+                _decode_key(key): view[data_start + offset:data_start + offset + length]
+                for key, offset, length in section["entries"]
+            })
+        # Restored entries are views into the mapping: keep it open for the life of the process
+        self._maps.append(mapped)
+        return watermark
+
+    def restore(self) -> Optional[int]:
+        """
+        Load every usable snapshot, oldest first so newer entries win, and delete unusable ones.
+        Returns the lowest watermark among the loaded snapshots (None if nothing was loaded).
+        """
+        caches = self._caches()
+        paths = glob.glob(os.path.join(self.directory, "cache-*.snap"))
+        watermarks = []
+        for path in sorted(paths, key=os.path.getmtime):
+            try:
+                watermarks.append(self._load(path, caches))
+                self.loaded += 1
+            except (OSError, ValueError) as e:
+                print(f"Discarding cache snapshot {path}: {e}")
+                self.discarded += 1
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        return min(watermarks) if watermarks else None
+
+    async def loop(self, interval: float = CACHE_SNAPSHOT_INTERVAL_SECONDS):
+        """Background task: save every `interval` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.save)
+            except Exception as e:
+                print(f"Cache snapshot error: {e}")
+
+    def stats(self) -> dict:
+        return {"saved": self.saved, "loaded": self.loaded, "discarded": self.discarded, "pruned": self.pruned}
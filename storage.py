@@ -0,0 +1,271 @@
+# storage.py
+# Where upload bytes live. LocalStorage keeps them under UPLOAD_DIR (one container, or a shared
+# volume); S3Storage puts them in an S3-compatible bucket (AWS, MinIO, R2...) so every container
+# and the serverless deploy see the same files. Keys are file names, with thumbnails under
+# "thumbs/". Media is handed to clients by URL (presigned for S3) wherever possible, so the app
+# does not proxy the bytes.
+#
+# STORAGE_BACKEND=s3 needs boto3 (pip install boto3), which is otherwise not required.
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # pragma: no cover - only needed for STORAGE_BACKEND=s3
+    boto3 = None
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "uploads"))
+# Optional: a web server or CDN in front of UPLOAD_DIR; /uploads/<name> then redirects there
+UPLOAD_PUBLIC_BASE_URL = os.getenv("UPLOAD_PUBLIC_BASE_URL", "").rstrip("/")
+
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "uploads/")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None  # e.g. http://localhost:9000 for MinIO
+S3_REGION = os.getenv("S3_REGION") or None
+S3_PRESIGN_SECONDS = int(os.getenv("S3_PRESIGN_SECONDS", "3600"))
+# Uploads above this go up in parts of S3_MULTIPART_CHUNK_BYTES, streamed from the request body
+S3_MULTIPART_CHUNK_BYTES = int(os.getenv("S3_MULTIPART_CHUNK_BYTES", str(8 * 1024 * 1024)))
+
+# Local copies of remote objects the vision path reads (and just-uploaded files)
+STORAGE_CACHE_DIR = Path(os.getenv("STORAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "zena-media-cache")))
+STORAGE_CACHE_MAX_BYTES = int(os.getenv("STORAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+THUMB_PREFIX = "thumbs/"
+
+
+class LocalStorage:
+    """Files under a local directory."""
+
+    def __init__(self, root: Path = UPLOAD_DIR, public_base_url: str = UPLOAD_PUBLIC_BASE_URL):
+        self.root = root
+        self.public_base_url = public_base_url
+        # Created on the first write rather than at import: serverless filesystems are read-only
+        self._ready = False
+
+    def put(self, key: str, fileobj: BinaryIO) -> int:
+        if not self._ready:
+            (self.root / THUMB_PREFIX).mkdir(parents=True, exist_ok=True)
+            self._ready = True
+        path = self.root / key
+        with path.open("wb") as buffer:
+            shutil.copyfileobj(fileobj, buffer)
+        return path.stat().st_size
+
+    def exists(self, key: str) -> bool:
+        return (self.root / key).is_file()
+
+    def delete(self, key: str):
+        try:
+            (self.root / key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key: str) -> str:
+        return str(self.root / key)
+
+    def url(self, key: str) -> Optional[str]:
+        """Where clients can fetch the object directly, or None if the app has to serve it."""
+        return f"{self.public_base_url}/{key}" if self.public_base_url else None
+
+    def iter_files(self) -> Iterator[Tuple[str, int, datetime]]:
+        """(key, size, modified) of every top-level upload; thumbnails are skipped."""
+        if not self.root.is_dir():
+            return
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    yield entry.name, stat.st_size, datetime.utcfromtimestamp(stat.st_mtime)
+
+
+class ReadThroughCache:
+    """
+    Bounded directory of local copies, least recently used removed first. The directory is
+    scanned once at startup and again only when the running total goes over max_bytes.
+    """
+
+    def __init__(self, root: Path = STORAGE_CACHE_DIR, max_bytes: int = STORAGE_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        root.mkdir(parents=True, exist_ok=True)
+        self._bytes = sum(size for _, size, _ in self._entries())
+
+    def path(self, key: str) -> Path:
+        return self.root / key.replace("/", "__")
+
+    def get(self, key: str) -> Optional[str]:
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return str(path)
+
+    def fill(self, key: str, writer) -> str:
+        """Create the local copy with writer(open binary file); atomic, so readers never see half a file."""
+        path = self.path(key)
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+        try:
+            with tmp.open("wb") as f:
+                writer(f)
+            size = tmp.stat().st_size
+            with self._lock:
+                try:
+                    replaced = path.stat().st_size
+                except FileNotFoundError:
+                    replaced = 0
+                os.replace(tmp, path)
+                self._bytes += size - replaced
+                over = self._bytes > self.max_bytes
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        if over:
+            self._trim()
+        return str(path)
+
+    def discard(self, key: str):
+        with self._lock:
+            try:
+                size = self.path(key).stat().st_size
+                self.path(key).unlink()
+            except FileNotFoundError:
+                return
+            self._bytes -= size
+
+    def _entries(self):
+        """(mtime, size, path) of every cached copy; in-progress temp files are skipped."""
+        entries = []
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith("."):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _trim(self):
+        with self._lock:
+            # Recount while we're at it: other processes may share the directory
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self._bytes = total
+
+
+class _TeeReader:
+    """Reads a stream for upload_fileobj, copying every chunk to `copy_to` and counting bytes."""
+
+    def __init__(self, fileobj: BinaryIO):
+        self.fileobj = fileobj
+        self.copy_to = None
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self.size += len(data)
+        if self.copy_to is not None:
+            self.copy_to.write(data)
+        return data
+
+
+class S3Storage:
+    """Objects in an S3-compatible bucket, with a local read-through cache for the vision path."""
+
+    def __init__(self, bucket: str = S3_BUCKET, prefix: str = S3_PREFIX, endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+                 region: Optional[str] = S3_REGION, cache: Optional[ReadThroughCache] = None):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3).")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires S3_BUCKET.")
+        self.bucket = bucket
+        self.prefix = prefix
+        # Path-style addressing works with MinIO and other self-hosted endpoints
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            config=BotoConfig(s3={"addressing_style": "path"} if endpoint_url else {}),
+        )
+        self.transfer = TransferConfig(
+            multipart_threshold=S3_MULTIPART_CHUNK_BYTES,
+            multipart_chunksize=S3_MULTIPART_CHUNK_BYTES,
+        )
+        self.cache = cache or ReadThroughCache()
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def put(self, key: str, fileobj: BinaryIO) -> int:
+        # Streamed to the bucket chunk by chunk as the body is read. The bytes are copied into
+        # the local cache on the way: the vision path reads the file right after upload.
+        tee = _TeeReader(fileobj)
+
+        def upload(cache_file):
+            tee.copy_to = cache_file
+            self.client.upload_fileobj(tee, self.bucket, self._object_key(key), Config=self.transfer)
+
+        self.cache.fill(key, upload)
+        return tee.size
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        self.cache.discard(key)
+
+    def local_path(self, key: str) -> str:
+        path = self.cache.get(key)
+        if path is None:
+            path = self.cache.fill(
+                key, lambda f: self.client.download_fileobj(self.bucket, self._object_key(key), f, Config=self.transfer)
+            )
+        return path
+
+    def url(self, key: str) -> Optional[str]:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._object_key(key)},
+            ExpiresIn=S3_PRESIGN_SECONDS,
+        )
+
+    def iter_files(self) -> Iterator[Tuple[str, int, datetime]]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix, Delimiter="/"):
+            for obj in page.get("Contents", ()):
+                key = obj["Key"][len(self.prefix):]
+                if key:
+                    yield key, obj["Size"], obj["LastModified"].replace(tzinfo=None)
+
+
+def get_storage():
+    """The backend selected by STORAGE_BACKEND."""
+    if STORAGE_BACKEND == "s3":
+        return S3Storage()
+    if STORAGE_BACKEND != "local":
+        raise RuntimeError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r} (expected 'local' or 's3').")
+    return LocalStorage()
@@ -0,0 +1,125 @@
+# summarizer.py
+# Keeps a rolling per-user summary of older turns on the User row, so the prompt is
+# "summary + the few turns after it" instead of an ever-growing transcript.
+import os
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import Message, User
+
+# Number of recent messages always sent verbatim (never folded into the summary)
+RECENT_TURNS = int(os.getenv("RECENT_TURNS", "6"))
+# Fold older turns into the summary once this many have piled up outside the recent window
+SUMMARY_EVERY = int(os.getenv("SUMMARY_EVERY", "20"))
+# Upper bound on turns folded in one provider call (catching up on a long backlog)
+SUMMARY_MAX_BATCH = int(os.getenv("SUMMARY_MAX_BATCH", "80"))
+
+
+def load_recent_messages(db: Session, user_id: int, after_id: Optional[int] = None,
+                         before_id: Optional[int] = None) -> List[Tuple[int, str, str, Optional[int]]]:
+    """
+    Turns not yet folded into the summary (id > after_id), oldest first, as
+    (id, sender, content, token_count). Normally RECENT_TURNS..RECENT_TURNS+SUMMARY_EVERY
+    messages; never more than that.
+    """
+    query = db.query(Message.id, Message.sender, Message.content, Message.token_count).filter(
+        Message.user_id == user_id
+    )
+    if after_id is not None:
+        query = query.filter(Message.id > after_id)
+    if before_id is not None:
+        query = query.filter(Message.id < before_id)
+    rows = query.order_by(Message.id.desc()).limit(RECENT_TURNS + SUMMARY_EVERY).all()
+    return [tuple(row) for row in reversed(rows)]
+
+
+def load_recent_turns(db: Session, user_id: int, after_id: Optional[int] = None,
+                      before_id: Optional[int] = None) -> List[Tuple[str, str, Optional[int]]]:
+    """
+    load_recent_messages() without the ids: (sender, content, token_count) turns, oldest
+    first. Trim to a token budget with tokens.fit_history().
+    """
+    return [
+        (sender, content, token_count)
+        for _, sender, content, token_count in load_recent_messages(db, user_id, after_id, before_id)
+    ]
+
+
+class ConversationSummarizer:
+    """Updates User.summary in the background after every SUMMARY_EVERY messages."""
+
+    def __init__(self, ai, session_factory, on_update: Optional[Callable[[int], None]] = None):
+        self.ai = ai
+        self.session_factory = session_factory
+        self.on_update = on_update
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    def maybe_update(self, user_id: int):
+        """Fold pending turns into the summary if enough have accumulated. Safe to call after every turn."""
+        with self._lock:
+            if user_id in self._in_flight:
+                return
+            self._in_flight.add(user_id)
+        try:
+            self._update(user_id)
+        except Exception as e:
+            print(f"Summary update failed for user {user_id}: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(user_id)
+
+    def _update(self, user_id: int):
+        db = self.session_factory()
+        try:
+            user = db.query(User).filter(User.id == user_id).first()
+            if not user:
+                return
+
+            # Everything newer than the summary, minus the recent window that is sent verbatim
+            recent_ids = [
+                msg_id for (msg_id,) in
+                db.query(Message.id)
+                .filter(Message.user_id == user_id)
+                .order_by(Message.id.desc())
+                .limit(RECENT_TURNS)
+                .all()
+            ]
+            if len(recent_ids) < RECENT_TURNS:
+                return
+            query = db.query(Message.id, Message.sender, Message.content).filter(
+                Message.user_id == user_id,
+                Message.id < min(recent_ids),
+            )
+            if user.summary_upto_id is not None:
+                query = query.filter(Message.id > user.summary_upto_id)
+
+            pending = query.order_by(Message.id.asc()).limit(SUMMARY_MAX_BATCH).all()
+            if len(pending) < SUMMARY_EVERY:
+                return
+
+            summary = self.ai.summarize(user.summary, [(sender, content) for _, sender, content in pending])
+            if not summary:
+                return
+
+            # Compare-and-set: if another worker updated the summary meanwhile, keep theirs
+            previous_upto = user.summary_upto_id
+            unchanged = (
+                User.summary_upto_id.is_(None) if previous_upto is None
+                else User.summary_upto_id == previous_upto
+            )
+            updated = (
+                db.query(User)
+                .filter(User.id == user_id, unchanged)
+                .update(
+                    {"summary": summary, "summary_upto_id": pending[-1].id},
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
+            if updated and self.on_update:
+                self.on_update(user_id)
+        finally:
+            db.close()
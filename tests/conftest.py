@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Keep the suite away from a developer's database and cache bus
+_tmp = tempfile.mkdtemp(prefix="zena-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'zena.db')}")
+os.environ.setdefault("CACHE_BUS_PATH", os.path.join(_tmp, "bus.log"))
+os.environ.setdefault("CACHE_SNAPSHOT_DIR", os.path.join(_tmp, "snapshots"))
+os.environ.setdefault("UPLOAD_DIR", os.path.join(_tmp, "uploads"))
+# main builds its provider client at import; tests never reach the provider
+os.environ.setdefault("GEMINI_API_KEY", "test")
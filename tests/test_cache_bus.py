@@ -0,0 +1,60 @@
+import os
+
+import cache
+from cache import InvalidationBus
+
+
+class Recorder:
+    def __init__(self, name="t"):
+        self.name = name
+        self.keys = []
+        self.cleared = 0
+
+    def invalidate(self, key, broadcast=False):
+        self.keys.append(key)
+
+    def clear(self, broadcast=False):
+        self.cleared += 1
+
+
+def poll_as_other_process(bus, monkeypatch):
+    # Records from the reader's own pid are skipped
+    with monkeypatch.context() as m:
+        m.setattr(cache.os, "getpid", lambda: -1)
+        bus.poll(force=True)
+
+
+def test_rotation_keeps_the_log_small_and_loses_nothing(tmp_path, monkeypatch):
+    path = str(tmp_path / "bus.log")
+    writer = InvalidationBus(path, max_bytes=300)
+    reader = InvalidationBus(path, poll_interval=0, max_bytes=300)
+    recorder = Recorder()
+    reader.register(recorder)
+
+    sent = []
+    for step in range(20):
+        for i in range(3):
+            key = f"{step}-{i}"
+            writer.publish("t", key)
+            sent.append(key)
+        poll_as_other_process(reader, monkeypatch)
+
+    assert recorder.keys == sent
+    assert reader.rotations > 0
+    assert reader.resyncs == 0
+    assert os.path.getsize(path) <= 300 + 100
+
+
+def test_reader_idle_through_two_rotations_resyncs(tmp_path, monkeypatch):
+    path = str(tmp_path / "bus.log")
+    writer = InvalidationBus(path, max_bytes=200)
+    reader = InvalidationBus(path, poll_interval=0, max_bytes=200)
+    recorder = Recorder()
+    reader.register(recorder)
+
+    for i in range(30):
+        writer.publish("t", i)
+    poll_as_other_process(reader, monkeypatch)
+
+    assert reader.resyncs == 1
+    assert recorder.cleared == 1
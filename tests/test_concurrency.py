@@ -0,0 +1,34 @@
+import random
+
+from concurrency import AdaptiveLimiter
+
+
+def turn(limiter, latency):
+    assert limiter.acquire()
+    limiter.release(latency)
+
+
+def test_idle_traffic_keeps_the_limit_for_the_next_burst():
+    rng = random.Random(1)
+    limiter = AdaptiveLimiter(initial=20)
+    # One turn at a time with ordinary provider jitter
+    for _ in range(300):
+        turn(limiter, rng.lognormvariate(0.5, 0.4))
+    assert int(limiter.limit) >= 20
+
+    burst = [limiter.acquire() for _ in range(20)]
+    assert all(burst)
+    assert limiter.rejected == 0
+
+
+def test_latency_rising_under_load_shrinks_the_limit():
+    limiter = AdaptiveLimiter(initial=20)
+    for _ in range(20):
+        turn(limiter, 1.0)
+    # Saturated: every slot busy and turns queueing behind the provider
+    for latency in [1.0 + i * 0.2 for i in range(20)]:
+        held = [limiter.acquire() for _ in range(int(limiter.limit))]
+        assert all(held)
+        for _ in held:
+            limiter.release(latency)
+    assert limiter.limit < 20
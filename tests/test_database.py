@@ -0,0 +1,22 @@
+from sqlalchemy import create_engine, inspect, text
+
+from database import ensure_columns, ensure_indexes
+from models import Base
+
+
+def test_ensure_indexes_adds_model_indexes_to_existing_tables(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    # messages as created before the history paging index existed
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE messages (id INTEGER PRIMARY KEY, user_id INTEGER, sender VARCHAR, "
+            "content TEXT, image_url VARCHAR, timestamp DATETIME)"
+        ))
+    Base.metadata.create_all(bind=engine)
+    ensure_columns(engine, Base.metadata)
+    assert "ix_messages_user_id_id" not in {ix["name"] for ix in inspect(engine).get_indexes("messages")}
+
+    ensure_indexes(engine, Base.metadata)
+    ensure_indexes(engine, Base.metadata)  # idempotent
+
+    assert "ix_messages_user_id_id" in {ix["name"] for ix in inspect(engine).get_indexes("messages")}
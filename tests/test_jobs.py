@@ -0,0 +1,80 @@
+import pytest
+
+from jobs import JOB_MAX_ATTEMPTS, JobRunner
+from models import ChatJob, Message, UsageDaily, User
+
+
+@pytest.fixture
+def main():
+    import main
+    return main
+
+
+def test_retried_job_stores_the_user_message_once(main, monkeypatch):
+    calls = []
+
+    def flaky_reply(**kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            raise RuntimeError("provider unavailable")
+        return "Once upon a time"
+
+    monkeypatch.setattr(main.ai_personality, "generate_ai_reply", flaky_reply)
+    runner = JobRunner(main.SessionLocal, run_turn=main._job_turn)
+    # Run attempts by hand instead of on the pool
+    monkeypatch.setattr(runner, "_submit", lambda job_id: None)
+
+    db = main.SessionLocal()
+    try:
+        user = User(name="retry", personality="storyteller")
+        db.add(user)
+        db.commit()
+        job = runner.create(db, user.id, "tell me a story about the sea", "storyteller")
+
+        runner._run(job.id)
+        db.expire_all()
+        assert db.get(ChatJob, job.id).status == "queued"
+
+        runner._run(job.id)
+        db.expire_all()
+        finished = db.get(ChatJob, job.id)
+        assert finished.status == "done"
+        assert finished.attempts == 2
+
+        rows = db.query(Message.sender).filter(Message.user_id == user.id).all()
+        assert sorted(sender for (sender,) in rows) == ["ai", "user"]
+        user_rollups = db.query(UsageDaily.message_count).filter(
+            UsageDaily.user_id == user.id, UsageDaily.sender == "user"
+        ).all()
+        assert sum(count for (count,) in user_rollups) == 1
+        # The retry doesn't see its own message as an earlier turn
+        assert calls[1]["history"] == []
+    finally:
+        db.close()
+
+
+def test_provider_error_reply_fails_the_job_instead_of_storing_it(main, monkeypatch):
+    from ai_core import GEMINI_ERROR_REPLY
+
+    monkeypatch.setattr(main.ai_personality, "generate_ai_reply", lambda **kwargs: GEMINI_ERROR_REPLY)
+    runner = JobRunner(main.SessionLocal, run_turn=main._job_turn)
+    monkeypatch.setattr(runner, "_submit", lambda job_id: None)
+
+    db = main.SessionLocal()
+    try:
+        user = User(name="outage", personality="storyteller")
+        db.add(user)
+        db.commit()
+        job = runner.create(db, user.id, "tell me a story about the sea", "storyteller")
+
+        for _ in range(JOB_MAX_ATTEMPTS):
+            runner._run(job.id)
+        db.expire_all()
+        failed = db.get(ChatJob, job.id)
+        assert failed.status == "failed"
+        assert failed.attempts == JOB_MAX_ATTEMPTS
+
+        rows = db.query(Message.sender).filter(Message.user_id == user.id).all()
+        assert [sender for (sender,) in rows] == ["user"]
+    finally:
+        db.close()
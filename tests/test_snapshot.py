@@ -0,0 +1,65 @@
+import os
+import struct
+import time
+
+from cache import LocalCache
+from snapshot import CACHE_SNAPSHOT_MAX_AGE_SECONDS, FORMAT_VERSION, HEADER, CacheSnapshots, JsonCodec
+
+
+def test_save_then_restore_round_trip(tmp_path):
+    cache = LocalCache("snapshot-round-trip", codec=JsonCodec("1"))
+    cache.set("greeting", {"text": "hello", "count": 2})
+    cache.set((7, "en"), [1, 2, 3])
+    snapshots = CacheSnapshots(str(tmp_path), watermark=lambda: 42)
+    assert snapshots.save() >= 2
+
+    # A fresh process: same cache name and codec, nothing in memory
+    restored = LocalCache("snapshot-round-trip", codec=JsonCodec("1"))
+    assert CacheSnapshots(str(tmp_path)).restore() == 42
+    assert restored.get("greeting") == {"text": "hello", "count": 2}
+    assert restored.get((7, "en")) == [1, 2, 3]
+
+
+def test_other_format_version_is_discarded_and_deleted(tmp_path):
+    cache = LocalCache("snapshot-format", codec=JsonCodec("1"))
+    cache.set("k", "v")
+    snapshots = CacheSnapshots(str(tmp_path))
+    snapshots.save()
+    path = snapshots._path()
+    with open(path, "r+b") as f:
+        f.seek(struct.calcsize("<6s"))
+        f.write(struct.pack("<H", FORMAT_VERSION + 1))
+
+    restored = LocalCache("snapshot-format", codec=JsonCodec("1"))
+    restoring = CacheSnapshots(str(tmp_path))
+    assert restoring.restore() is None
+    assert restoring.discarded == 1
+    assert not os.path.exists(path)
+    assert restored.get("k") is None
+
+
+def test_changed_codec_version_skips_that_cache(tmp_path):
+    cache = LocalCache("snapshot-codec", codec=JsonCodec("1"))
+    cache.set("k", "old shape")
+    CacheSnapshots(str(tmp_path), watermark=lambda: 5).save()
+
+    restored = LocalCache("snapshot-codec", codec=JsonCodec("2"))
+    assert CacheSnapshots(str(tmp_path)).restore() == 5
+    assert restored.get("k") is None
+
+
+def test_save_prunes_expired_snapshots_of_exited_workers(tmp_path):
+    LocalCache("snapshot-prune", codec=JsonCodec("1")).set("k", "v")
+    header = HEADER.pack(b"ZSNAP\0", FORMAT_VERSION, time.time(), -1, 2) + b"{}"
+    stale, recent = tmp_path / "cache-1.snap", tmp_path / "cache-2.snap"
+    for path in (stale, recent):
+        path.write_bytes(header)
+    expired = time.time() - CACHE_SNAPSHOT_MAX_AGE_SECONDS - 60
+    os.utime(stale, (expired, expired))
+
+    snapshots = CacheSnapshots(str(tmp_path))
+    snapshots.save()
+    assert not stale.exists()
+    assert recent.exists()  # may still be a live worker's
+    assert os.path.exists(snapshots._path())
+    assert snapshots.pruned == 1
@@ -0,0 +1,95 @@
+import io
+import os
+
+import pytest
+
+moto = pytest.importorskip("moto")
+boto3 = pytest.importorskip("boto3")
+
+from storage import ReadThroughCache, S3Storage  # noqa: E402
+
+BUCKET = "zena-test-uploads"
+
+
+@pytest.fixture
+def s3(tmp_path, monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET)
+        yield S3Storage(bucket=BUCKET, region="us-east-1", cache=ReadThroughCache(tmp_path / "cache"))
+
+
+class ReadOnlyStream(io.RawIOBase):
+    """A request body: read() only, no seek()."""
+
+    def __init__(self, data: bytes):
+        self._data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._data.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+def test_put_exists_url_delete(s3):
+    assert not s3.exists("1_photo.jpg")
+
+    assert s3.put("1_photo.jpg", ReadOnlyStream(b"jpeg bytes")) == 10
+    assert s3.exists("1_photo.jpg")
+    body = s3.client.get_object(Bucket=BUCKET, Key="uploads/1_photo.jpg")["Body"].read()
+    assert body == b"jpeg bytes"
+
+    url = s3.url("1_photo.jpg")
+    assert BUCKET in url and "/uploads/1_photo.jpg?" in url and "Signature=" in url
+
+    s3.delete("1_photo.jpg")
+    assert not s3.exists("1_photo.jpg")
+
+
+def test_large_put_streams_in_parts_and_keeps_a_local_copy(s3):
+    data = os.urandom(6 * 1024 * 1024)
+    s3.transfer.multipart_threshold = s3.transfer.multipart_chunksize = 5 * 1024 * 1024
+
+    assert s3.put("2_video.mp4", ReadOnlyStream(data)) == len(data)
+
+    head = s3.client.head_object(Bucket=BUCKET, Key="uploads/2_video.mp4")
+    assert head["ContentLength"] == len(data)
+    assert head["ETag"].endswith('-2"')  # two multipart parts
+    with open(s3.local_path("2_video.mp4"), "rb") as f:
+        assert f.read() == data
+
+
+def test_local_path_downloads_objects_missing_from_the_cache(s3):
+    s3.put("3_note.png", io.BytesIO(b"png bytes"))
+    s3.cache.discard("3_note.png")
+
+    with open(s3.local_path("3_note.png"), "rb") as f:
+        assert f.read() == b"png bytes"
+
+
+def test_cache_keeps_a_running_total_and_trims_only_when_over(tmp_path, monkeypatch):
+    (tmp_path / "cache").mkdir()
+    (tmp_path / "cache" / "old").write_bytes(b"x" * 4)
+    cache = ReadThroughCache(tmp_path / "cache", max_bytes=10)
+    assert cache._bytes == 4
+
+    scans = []
+    entries = cache._entries
+    monkeypatch.setattr(cache, "_entries", lambda: scans.append(1) or entries())
+
+    cache.fill("a", lambda f: f.write(b"a" * 3))
+    cache.fill("a", lambda f: f.write(b"a" * 5))
+    assert (cache._bytes, scans) == (9, [])
+    cache.discard("a")
+    assert cache._bytes == 4
+
+    os.utime(tmp_path / "cache" / "old", (0, 0))
+    cache.fill("b", lambda f: f.write(b"b" * 8))
+    assert scans == [1]
+    assert cache._bytes == 8
+    assert not (tmp_path / "cache" / "old").exists()
@@ -0,0 +1,93 @@
+import io
+import os
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, select
+
+import uploads
+from models import Base, Upload, User
+from sharding import ShardRouter
+from storage import LocalStorage
+from uploads import UploadStore
+
+LONG_AGO = datetime(2020, 1, 1)
+
+
+@pytest.fixture
+def sharded(tmp_path, monkeypatch):
+    engines = [create_engine(f"sqlite:///{tmp_path / f'shard{i}.db'}") for i in range(2)]
+    for engine in engines:
+        Base.metadata.create_all(bind=engine)
+    router = ShardRouter(engines)
+    router.prepare()
+    monkeypatch.setattr(uploads, "router", router)
+    yield router, router.sessionmaker(autocommit=False, autoflush=False)
+    router.dispose()
+
+
+def test_flush_touches_updates_uploads_on_every_shard(sharded, tmp_path):
+    router, session_factory = sharded
+    db = session_factory()
+    try:
+        users = [User(name=f"u{i}", personality="friendly") for i in range(2)]
+        db.add_all(users)
+        db.commit()
+        assert {router.shard_for(user.id) for user in users} == {"0", "1"}
+
+        names = [f"{user.id}_20240101_000000_abcd1234.jpg" for user in users] + ["legacy.jpg"]
+        db.add_all([
+            Upload(name=names[0], user_id=users[0].id, size=1, created_at=LONG_AGO, last_access_at=LONG_AGO),
+            Upload(name=names[1], user_id=users[1].id, size=1, created_at=LONG_AGO, last_access_at=LONG_AGO),
+            Upload(name=names[2], user_id=None, size=1, created_at=LONG_AGO, last_access_at=LONG_AGO),
+        ])
+        db.commit()
+
+        store = UploadStore(LocalStorage(tmp_path / "uploads"))
+        for name in names:
+            store.touch(name)
+        assert store.flush_touches(db) == 3
+        # A second flush (nothing pending) and a full GC pass still work on the sharded session
+        assert store.flush_touches(db) == 0
+        store.run_once(session_factory)
+    finally:
+        db.close()
+
+    for shard, engine in router.engines.items():
+        with engine.connect() as conn:
+            for name, last_access_at in conn.execute(select(Upload.name, Upload.last_access_at)):
+                assert last_access_at > LONG_AGO, (shard, name)
+
+
+def test_save_rejects_uploads_past_the_remaining_quota(sharded, tmp_path, monkeypatch):
+    _, session_factory = sharded
+    monkeypatch.setattr(uploads, "UPLOAD_USER_QUOTA_BYTES", 100)
+    store = UploadStore(LocalStorage(tmp_path / "uploads"))
+    db = session_factory()
+    try:
+        user = User(name="quota", personality="friendly")
+        db.add(user)
+        db.commit()
+
+        # Larger than the whole quota
+        with pytest.raises(HTTPException) as rejected:
+            store.save(db, user.id, "big.jpg", io.BytesIO(b"x" * 101))
+        assert rejected.value.status_code == 413
+
+        # Fits, and leaves 10 bytes
+        path, _ = store.save(db, user.id, "first.jpg", io.BytesIO(b"x" * 90))
+        assert os.path.getsize(path) == 90
+
+        # Small on its own, but over what is left
+        with pytest.raises(HTTPException) as rejected:
+            store.save(db, user.id, "second.jpg", io.BytesIO(b"x" * 11))
+        assert rejected.value.status_code == 413
+
+        # Rejected uploads leave neither an index row nor a file behind
+        assert [upload.name for upload in db.scalars(select(Upload).where(Upload.user_id == user.id))] == [
+            os.path.basename(path)
+        ]
+        assert [f.name for f in (tmp_path / "uploads").iterdir() if f.is_file()] == [os.path.basename(path)]
+    finally:
+        db.close()
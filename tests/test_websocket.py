@@ -0,0 +1,93 @@
+import time
+
+import pytest
+from starlette.testclient import TestClient
+
+from database import engine
+from models import User
+
+
+@pytest.fixture
+def main():
+    import main
+    return main
+
+
+@pytest.fixture
+def user_id(main):
+    db = main.SessionLocal()
+    try:
+        user = User(name="socket", personality="friendly guide")
+        db.add(user)
+        db.commit()
+        return user.id
+    finally:
+        db.close()
+
+
+def wait_for_idle_pool(timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while engine.pool.checkedout() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return engine.pool.checkedout()
+
+
+def test_idle_socket_holds_no_connection(main, user_id, monkeypatch):
+    checked_out_while_streaming = []
+
+    def stream_ai_reply(**kwargs):
+        checked_out_while_streaming.append(engine.pool.checkedout())
+        yield "hello there, how are you today"
+
+    monkeypatch.setattr(main.ai_personality, "stream_ai_reply", stream_ai_reply)
+    with TestClient(main.app).websocket_connect(f"/ws/chat/{user_id}") as ws:
+        assert ws.receive_json() == {"type": "ready"}
+        assert wait_for_idle_pool() == 0
+
+        for _ in range(3):
+            ws.send_json({"message": "tell me something nice about the weather"})
+            frames = [ws.receive_json() for _ in range(4)]
+            assert [frame["type"] for frame in frames] == ["typing", "chunk", "done", "typing"]
+            assert wait_for_idle_pool() == 0
+
+    assert checked_out_while_streaming == [0, 0, 0]
+
+
+def test_turns_folded_into_the_summary_are_not_sent_again(main, user_id, monkeypatch):
+    from models import Message
+
+    histories = []
+
+    def stream_ai_reply(**kwargs):
+        histories.append((kwargs["summary"], kwargs["history"]))
+        yield f"reply number {len(histories)} for you"
+
+    monkeypatch.setattr(main.ai_personality, "stream_ai_reply", stream_ai_reply)
+
+    def turn(ws, text):
+        ws.send_json({"message": text})
+        frames = [ws.receive_json() for _ in range(4)]
+        assert frames[2]["type"] == "done"
+
+    with TestClient(main.app).websocket_connect(f"/ws/chat/{user_id}") as ws:
+        assert ws.receive_json() == {"type": "ready"}
+        turn(ws, "first message about my dog bruno")
+        turn(ws, "second message about my sister")
+
+        # The background summarizer folds the first turn in
+        db = main.SessionLocal()
+        try:
+            first_reply_id = db.query(Message.id).filter(Message.user_id == user_id).order_by(Message.id).all()[1][0]
+            db.query(User).filter(User.id == user_id).update(
+                {"summary": "The user has a dog named Bruno.", "summary_upto_id": first_reply_id}
+            )
+            db.commit()
+        finally:
+            db.close()
+        main.user_cache.invalidate(user_id)
+
+        turn(ws, "third message about the weather")
+
+    summary, history = histories[-1]
+    assert summary == "The user has a dog named Bruno."
+    assert [content for _, content in history] == ["second message about my sister", "reply number 2 for you"]
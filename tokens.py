@@ -0,0 +1,55 @@
+# tokens.py
+# Fast local token estimates. Not an exact BPE count, but close enough (and cheap enough)
+# to store on every Message at insert time and to enforce budgets with.
+import os
+import re
+from bisect import bisect_right
+from itertools import accumulate
+from typing import List, Optional, Sequence, Tuple
+
+# Longest user message accepted by /chat/ (longer ones are rejected with 413)
+MAX_INPUT_TOKENS = int(os.getenv("MAX_INPUT_TOKENS", "2000"))
+# Personalities longer than this are truncated before they go into the system prompt
+MAX_PERSONALITY_TOKENS = int(os.getenv("MAX_PERSONALITY_TOKENS", "300"))
+# Provider output cap (OpenAI max_tokens, Gemini max_output_tokens)
+MAX_OUTPUT_TOKENS = int(os.getenv("MAX_OUTPUT_TOKENS", "500"))
+# Room for the raw turns sent with each prompt (the rolling summary counts against it)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def _piece_tokens(piece: str) -> int:
+    if piece.isascii():
+        # Common English/romanized words are one token; long ones split every ~5 characters
+        return 1 + (len(piece) - 1) // 5
+    # Indic and other non-Latin scripts come out at roughly one token per two characters
+    return (len(piece) + 1) // 2
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """Approximate the provider token count of `text`."""
+    if not text:
+        return 0
+    return sum(_piece_tokens(piece) for piece in _PIECE_RE.findall(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut `text` so that count_tokens() of the result is at most max_tokens."""
+    total = 0
+    for match in _PIECE_RE.finditer(text):
+        total += _piece_tokens(match.group())
+        if total > max_tokens:
+            return text[:match.start()].rstrip()
+    return text
+
+
+def fit_history(turns: Sequence[Tuple[str, str, Optional[int]]], budget: int) -> List[Tuple[str, str]]:
+    """
+    Keep the newest (sender, content, token_count) turns whose total fits in `budget`.
+    Uses the counts stored on each Message, so nothing is re-tokenized per request.
+    """
+    # Prefix sums over newest-first counts; the cut is one bisect
+    counts = [count if count is not None else count_tokens(content) for _, content, count in reversed(turns)]
+    keep = bisect_right(list(accumulate(counts)), budget)
+    return [(sender, content) for sender, content, _ in turns[len(turns) - keep:]]
@@ -0,0 +1,315 @@
+# uploads.py
+# Lifecycle of uploaded files on the configured storage backend (storage.py). Every upload
+# gets a row in the uploads table (size, last access, referencing message) before its bytes
+# are written, and a background loop works through the index in small batches: it deletes
+# orphans, evicts the least recently used originals (keeping a thumbnail) to stay within the
+# per-user and global quotas, and indexes stray files it finds while slowly walking the
+# storage. Nothing here lists the storage or sums usage on a request path.
+import asyncio
+import io
+import os
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from PIL import Image
+from sqlalchemy import bindparam, func, literal, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import router
+from models import ChatJob, Message, Upload
+from sharding import DIRECTORY_SHARD
+from storage import THUMB_PREFIX
+
+UPLOAD_URL_PREFIX = "/uploads/"
+
+# Storage budget for originals; thumbnails are small and not counted
+UPLOAD_USER_QUOTA_BYTES = int(os.getenv("UPLOAD_USER_QUOTA_BYTES", str(200 * 1024 * 1024)))
+UPLOAD_TOTAL_QUOTA_BYTES = int(os.getenv("UPLOAD_TOTAL_QUOTA_BYTES", str(5 * 1024 * 1024 * 1024)))
+# Unreferenced uploads younger than this may still belong to a turn in progress
+UPLOAD_ORPHAN_GRACE_SECONDS = int(os.getenv("UPLOAD_ORPHAN_GRACE_SECONDS", "21600"))
+UPLOAD_GC_INTERVAL_SECONDS = int(os.getenv("UPLOAD_GC_INTERVAL_SECONDS", "300"))
+# Index rows / storage entries handled per step per tick
+UPLOAD_GC_BATCH = 200
+
+THUMBNAIL_SIZE = (256, 256)
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp"}
+LEGACY_MESSAGE_ID = 0
+
+
+def name_from_url(url: Optional[str]) -> Optional[str]:
+    if url and url.startswith(UPLOAD_URL_PREFIX):
+        return url[len(UPLOAD_URL_PREFIX):]
+    return None
+
+
+class _QuotaExceeded(Exception):
+    pass
+
+
+class _CappedReader:
+    """Reads a request body for storage.put, raising _QuotaExceeded once it passes `limit` bytes."""
+
+    def __init__(self, fileobj, limit: int):
+        self.fileobj = fileobj
+        self.limit = limit
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        # Never ask for more than one byte past the limit: that is enough to know it was passed
+        room = self.limit - self.size + 1
+        data = self.fileobj.read(room if size < 0 else min(size, room))
+        self.size += len(data)
+        if self.size > self.limit:
+            raise _QuotaExceeded()
+        return data
+
+
+class UploadStore:
+    """Writes uploads, records references and access, and runs the incremental cleanup."""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._touches = {}
+        self._lock = threading.Lock()
+        self._scan = None
+        self._scan_since = None
+        self.deleted = 0
+        self.evicted = 0
+
+    def save(self, db: Session, user_id: int, filename: Optional[str], fileobj) -> Tuple[str, str]:
+        """Store an uploaded file. Returns (local path for the vision path, public URL)."""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        file_extension = Path(filename or "").suffix
+        stored_name = f"{user_id}_{timestamp}_{uuid.uuid4().hex[:8]}{file_extension}"
+
+        # Originals still on disk count against the quota until the cleanup loop evicts them
+        used = db.scalar(
+            select(func.coalesce(func.sum(Upload.size), 0))
+            .where(Upload.user_id == user_id, Upload.evicted_at.is_(None))
+        )
+
+        # Index first: a crash after this leaves a row the orphan sweep cleans up, never an untracked file
+        upload = Upload(name=stored_name, user_id=user_id, size=0)
+        db.add(upload)
+        db.commit()
+
+        try:
+            # Stop reading as soon as the body passes what is left of the quota
+            upload.size = self.storage.put(stored_name, _CappedReader(fileobj, UPLOAD_USER_QUOTA_BYTES - used))
+        except _QuotaExceeded:
+            self.storage.delete(stored_name)
+            db.delete(upload)
+            db.commit()
+            raise HTTPException(status_code=413, detail="Upload quota exceeded.")
+        db.commit()
+
+        return self.storage.local_path(stored_name), f"{UPLOAD_URL_PREFIX}{stored_name}"
+
+    def attach(self, db: Session, image_url: Optional[str], message_id: int):
+        """Mark the upload behind image_url as referenced by message_id (committed by the caller)."""
+        name = name_from_url(image_url)
+        if name:
+            db.query(Upload).filter(Upload.name == name).update(
+                {"message_id": message_id}, synchronize_session=False
+            )
+
+    def resolve(self, name: str) -> Optional[Tuple[str, Optional[str]]]:
+        """
+        Storage key to serve for an upload URL: the original, or its thumbnail once evicted.
+        Returns (key, media_type) or None. Access is recorded in memory and flushed by the loop.
+        """
+        if "/" in name or name.startswith("."):
+            return None
+        if self.storage.exists(name):
+            self.touch(name)
+            return name, None
+        thumb = f"{THUMB_PREFIX}{name}.jpg"
+        if self.storage.exists(thumb):
+            return thumb, "image/jpeg"
+        return None
+
+    def local_path(self, image_url: Optional[str]) -> Optional[str]:
+        """Local file for an upload URL (downloaded into the read-through cache if remote)."""
+        name = name_from_url(image_url)
+        return self.storage.local_path(name) if name else None
+
+    def _make_thumbnail(self, name: str) -> Optional[str]:
+        thumb_name = f"{name}.jpg"
+        buffer = io.BytesIO()
+        try:
+            with Image.open(self.storage.local_path(name)) as image:
+                image.thumbnail(THUMBNAIL_SIZE)
+                image.convert("RGB").save(buffer, "JPEG", quality=80)
+            buffer.seek(0)
+            self.storage.put(f"{THUMB_PREFIX}{thumb_name}", buffer)
+        except Exception as e:
+            print(f"Thumbnail error for {name}: {e}")
+            return None
+        return thumb_name
+
+    def touch(self, name: str):
+        with self._lock:
+            self._touches[name] = datetime.utcnow()
+
+    def flush_touches(self, db: Session) -> int:
+        with self._lock:
+            touches, self._touches = self._touches, {}
+        if touches:
+            # One executemany per shard. Upload names start with the owner's user id (see save());
+            # stray files without one were indexed on shard 0.
+            by_shard = defaultdict(list)
+            for name, at in touches.items():
+                owner = name.split("_", 1)[0]
+                shard = router.shard_for(int(owner)) if router.sharded and owner.isdigit() else DIRECTORY_SHARD
+                by_shard[shard].append({"touched_name": name, "touched_at": at})
+            uploads = Upload.__table__
+            stmt = (
+                update(uploads)
+                .where(uploads.c.name == bindparam("touched_name"))
+                .values(last_access_at=bindparam("touched_at"))
+            )
+            for shard, params in by_shard.items():
+                bind = {"shard_id": shard} if router.sharded else {}
+                db.connection(bind_arguments=bind).execute(stmt, params)
+            db.commit()
+        return len(touches)
+
+    def scan_step(self, db: Session) -> int:
+        """Index up to UPLOAD_GC_BATCH files from the storage walk that have no row yet."""
+        if self._scan is None:
+            self._scan = self.storage.iter_files()
+            # Untracked files older than the first indexed upload predate the index itself
+            # One row per shard when sharded
+            earliest = [at for at in db.scalars(select(func.min(Upload.created_at))) if at is not None]
+            self._scan_since = min(earliest, default=None) or datetime.utcnow()
+        batch = {}
+        for name, size, modified in self._scan:
+            batch[name] = (size, modified)
+            if len(batch) >= UPLOAD_GC_BATCH:
+                break
+        else:
+            self._scan = None
+        if not batch:
+            return 0
+
+        known = set(db.scalars(select(Upload.name).where(Upload.name.in_(list(batch)))))
+        stray = [name for name in batch if name not in known]
+        if not stray:
+            return 0
+        referenced = dict(db.execute(
+            select(Message.image_url, Message.id).where(
+                Message.image_url.in_([UPLOAD_URL_PREFIX + name for name in stray])
+            )
+        ).all())
+        for name in stray:
+            size, modified = batch[name]
+            message_id = referenced.get(UPLOAD_URL_PREFIX + name)
+            if message_id is None and modified < self._scan_since:
+                message_id = LEGACY_MESSAGE_ID
+            user_id = name.split("_", 1)[0]
+            db.add(Upload(
+                name=name,
+                user_id=int(user_id) if user_id.isdigit() else None,
+                size=size,
+                message_id=message_id,
+                created_at=modified,
+                last_access_at=modified,
+            ))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another worker indexed the same files first
+            db.rollback()
+            return 0
+        return len(stray)
+
+    def collect_orphans(self, db: Session) -> int:
+        """Delete uploads no message references once the grace period has passed."""
+        cutoff = datetime.utcnow() - timedelta(seconds=UPLOAD_ORPHAN_GRACE_SECONDS)
+        # A queued job stores its image_url on the job row until it runs
+        pending_job = (
+            select(ChatJob.id)
+            .where(ChatJob.image_url == literal(UPLOAD_URL_PREFIX) + Upload.name)
+            .where(ChatJob.status.notin_(("done", "failed")))
+            .exists()
+        )
+        orphans = db.scalars(
+            select(Upload)
+            .where(Upload.message_id.is_(None), Upload.created_at < cutoff, ~pending_job)
+            .limit(UPLOAD_GC_BATCH)
+        ).all()
+        for upload in orphans:
+            self.storage.delete(upload.name)
+            if upload.thumb_name:
+                self.storage.delete(f"{THUMB_PREFIX}{upload.thumb_name}")
+            db.delete(upload)
+        db.commit()
+        self.deleted += len(orphans)
+        return len(orphans)
+
+    def _evict_lru(self, db: Session, excess: int, *criteria) -> int:
+        """Evict the coldest originals matching criteria until `excess` bytes are freed (one batch at most)."""
+        freed = 0
+        coldest = db.scalars(
+            select(Upload)
+            .where(Upload.evicted_at.is_(None), *criteria)
+            .order_by(Upload.last_access_at.asc())
+            .limit(UPLOAD_GC_BATCH)
+        ).all()
+        # Each shard's batch is ordered on its own
+        coldest.sort(key=lambda upload: upload.last_access_at or datetime.min)
+        for upload in coldest:
+            if freed >= excess:
+                break
+            if upload.thumb_name is None and Path(upload.name).suffix.lower() in IMAGE_EXTENSIONS:
+                upload.thumb_name = self._make_thumbnail(upload.name)
+            self.storage.delete(upload.name)
+            upload.evicted_at = datetime.utcnow()
+            freed += upload.size or 0
+            self.evicted += 1
+        db.commit()
+        return freed
+
+    def enforce_quotas(self, db: Session) -> int:
+        freed = 0
+        over_quota = db.execute(
+            select(Upload.user_id, func.sum(Upload.size))
+            .where(Upload.evicted_at.is_(None))
+            .group_by(Upload.user_id)
+            .having(func.sum(Upload.size) > UPLOAD_USER_QUOTA_BYTES)
+        ).all()
+        for user_id, used in over_quota:
+            if user_id is not None:
+                freed += self._evict_lru(db, used - UPLOAD_USER_QUOTA_BYTES, Upload.user_id == user_id)
+        total = sum(db.scalars(select(func.coalesce(func.sum(Upload.size), 0)).where(Upload.evicted_at.is_(None))))
+        if total > UPLOAD_TOTAL_QUOTA_BYTES:
+            freed += self._evict_lru(db, total - UPLOAD_TOTAL_QUOTA_BYTES)
+        return freed
+
+    def run_once(self, session_factory):
+        db = session_factory()
+        try:
+            self.flush_touches(db)
+            self.scan_step(db)
+            self.collect_orphans(db)
+            self.enforce_quotas(db)
+        finally:
+            db.close()
+
+    async def gc_loop(self, session_factory, interval: int = UPLOAD_GC_INTERVAL_SECONDS):
+        """Background task: one bounded cleanup step every `interval` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.run_once, session_factory)
+            except Exception as e:
+                print(f"Upload cleanup error: {e}")
+
+    def stats(self) -> dict:
+        return {"pending_touches": len(self._touches), "deleted": self.deleted, "evicted": self.evicted}
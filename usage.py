@@ -0,0 +1,203 @@
+# usage.py
+# Usage analytics from rollups instead of scans of `messages`. Every stored message bumps one
+# usage_daily row (user, day, sender, language) inside the same transaction as the insert,
+# so the counts are exactly as durable as the messages. /stats reads only these rows.
+#
+# Rebuild the rollups from existing history (hot table and archive):   python usage.py backfill
+import sys
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from database import shard_bind
+from detect_language import scan_script
+from export import iter_user_messages
+from language_state import LanguageState
+from models import UsageDaily, User
+from tokens import count_tokens
+
+STATS_GROUPS = {
+    "day": UsageDaily.day,
+    "user": UsageDaily.user_id,
+    "sender": UsageDaily.sender,
+    "language": UsageDaily.language,
+}
+
+RollupKey = Tuple[int, date, str, str]
+
+
+def _insert_for(db: Session, user_id: int):
+    """Dialect insert with ON CONFLICT support, or None for other databases."""
+    dialect = db.get_bind(**shard_bind(user_id)).dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
+
+
+def _add(db: Session, key: RollupKey, messages: int, tokens: int, latency_ms: int):
+    user_id, day, sender, language = key
+    values = {
+        "user_id": user_id, "day": day, "sender": sender, "language": language,
+        "message_count": messages, "token_count": tokens, "latency_ms_sum": latency_ms,
+    }
+    insert = _insert_for(db, user_id)
+    if insert is not None:
+        stmt = insert(UsageDaily).values(**values)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["user_id", "day", "sender", "language"],
+            set_={
+                "message_count": UsageDaily.message_count + stmt.excluded.message_count,
+                "token_count": UsageDaily.token_count + stmt.excluded.token_count,
+                "latency_ms_sum": UsageDaily.latency_ms_sum + stmt.excluded.latency_ms_sum,
+            },
+        ), bind_arguments=shard_bind(user_id))
+        return
+    updated = db.execute(
+        update(UsageDaily)
+        .where(UsageDaily.user_id == user_id, UsageDaily.day == day,
+               UsageDaily.sender == sender, UsageDaily.language == language)
+        .values(
+            message_count=UsageDaily.message_count + messages,
+            token_count=UsageDaily.token_count + tokens,
+            latency_ms_sum=UsageDaily.latency_ms_sum + latency_ms,
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not updated:
+        db.add(UsageDaily(**values))
+        db.flush()
+
+
+def record(db: Session, user_id: int, sender: str, language: Optional[str], token_count: int,
+           at: datetime, latency_ms: Optional[int] = None):
+    """Count one message. Not committed: it rides on the caller's message insert."""
+    _add(db, (user_id, at.date(), sender, language or "unknown"), 1, token_count or 0, latency_ms or 0)
+
+
+def record_many(db: Session, rows: Iterable[dict]):
+    """Count bulk-inserted message rows (batch), one upsert per rollup key."""
+    totals: Dict[RollupKey, List[int]] = defaultdict(lambda: [0, 0, 0])
+    asked_at = {}
+    for row in rows:
+        # Batch rows come as (user, ai) pairs; the pair's timestamps give the latency
+        latency_ms = 0
+        if row["sender"] == "user":
+            asked_at[row["user_id"]] = row["timestamp"]
+        elif row["user_id"] in asked_at:
+            latency_ms = int((row["timestamp"] - asked_at.pop(row["user_id"])).total_seconds() * 1000)
+        key = (row["user_id"], row["timestamp"].date(), row["sender"], scan_script(row["content"]) or "unknown")
+        total = totals[key]
+        total[0] += 1
+        total[1] += row.get("token_count") or 0
+        total[2] += latency_ms
+    for key, (messages, tokens, latency_ms) in totals.items():
+        _add(db, key, messages, tokens, latency_ms)
+
+
+def query_stats(db: Session, group_by: List[str], start: Optional[date] = None, end: Optional[date] = None,
+                user_id: Optional[int] = None) -> List[dict]:
+    """Message, token and latency totals from the rollups, grouped by any of STATS_GROUPS."""
+    columns = [STATS_GROUPS[name].label(name) for name in group_by]
+    messages = func.sum(UsageDaily.message_count)
+    ai_messages = func.sum(UsageDaily.message_count).filter(UsageDaily.sender == "ai")
+    stmt = select(
+        *columns,
+        messages.label("messages"),
+        func.sum(UsageDaily.token_count).label("tokens"),
+        func.sum(UsageDaily.latency_ms_sum).label("latency_ms_sum"),
+        ai_messages.label("ai_messages"),
+    )
+    if start is not None:
+        stmt = stmt.where(UsageDaily.day >= start)
+    if end is not None:
+        stmt = stmt.where(UsageDaily.day <= end)
+    if user_id is not None:
+        stmt = stmt.where(UsageDaily.user_id == user_id)
+    if columns:
+        stmt = stmt.group_by(*columns).order_by(*columns)
+
+    # With sharding every shard returns its own groups: merge them by group key
+    merged: Dict[tuple, List[int]] = {}
+    for row in db.execute(stmt):
+        total = merged.setdefault(tuple(getattr(row, name) for name in group_by), [0, 0, 0, 0])
+        total[0] += row.messages or 0
+        total[1] += row.tokens or 0
+        total[2] += row.latency_ms_sum or 0
+        total[3] += row.ai_messages or 0
+
+    results = []
+    for key in sorted(merged, key=lambda key: tuple((value is None, value) for value in key)):
+        messages_sum, tokens, latency_ms_sum, ai_count = merged[key]
+        item = dict(zip(group_by, key))
+        item["messages"] = messages_sum
+        item["tokens"] = tokens
+        item["avg_latency_ms"] = round(latency_ms_sum / ai_count) if ai_count else None
+        results.append(item)
+    return results
+
+
+def backfill_user(db: Session, user_id: int) -> int:
+    """
+    Recompute one user's rollups from their full history and replace the existing rows.
+    Languages are replayed through the same sticky estimate the live path uses; latency is
+    the gap between each AI message and the user message before it.
+    """
+    totals: Dict[RollupKey, List[int]] = defaultdict(lambda: [0, 0, 0])
+    state = LanguageState()
+    asked_at = None
+    count = 0
+    for msg in iter_user_messages(db, user_id):
+        at = datetime.fromisoformat(msg["timestamp"]) if msg["timestamp"] else None
+        if at is None:
+            continue
+        latency_ms = 0
+        if msg["sender"] == "user":
+            state.observe(msg["content"] or "")
+            asked_at = at
+        elif asked_at is not None:
+            latency_ms = int((at - asked_at).total_seconds() * 1000)
+            asked_at = None
+        total = totals[(user_id, at.date(), msg["sender"], state.script or "unknown")]
+        total[0] += 1
+        total[1] += count_tokens(msg["content"])
+        total[2] += latency_ms
+        count += 1
+
+    db.query(UsageDaily).filter(UsageDaily.user_id == user_id).delete(synchronize_session=False)
+    for key, (messages, tokens, latency_ms) in totals.items():
+        _add(db, key, messages, tokens, latency_ms)
+    db.commit()
+    return count
+
+
+def backfill(db: Session) -> int:
+    """
+    Rebuild every user's rollups, one user per transaction. Meant for off-peak runs:
+    turns stored while their user is being rebuilt are picked up by the next run.
+    """
+    total = 0
+    for (user_id,) in db.execute(select(User.id).order_by(User.id)).all():
+        total += backfill_user(db, user_id)
+    return total
+
+
+if __name__ == "__main__":
+    from database import SessionLocal, router
+    from models import Base
+
+    if sys.argv[1:] != ["backfill"]:
+        sys.exit("usage: python usage.py backfill")
+    for shard_engine in router.engines.values():
+        Base.metadata.create_all(bind=shard_engine)
+    db = SessionLocal()
+    try:
+        print(f"Rebuilt usage rollups from {backfill(db)} messages")
+    finally:
+        db.close()